@@ -1,24 +1,81 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from models import db, AmbulanceTrip
+from models import db, AmbulanceTrip, DispatchCall, Vehicle, TRIP_FIELDS
 import config
-import route_optimizer
-import requests
-import json
+import route_cache
+import route_matrix
+import provider_clients
+import isochrone_service
+import isochrone_coverage
+import route_frequency
+import route_tiles
+import trip_stats
+import trip_import
+import trip_worker
+import fleet
+import dispatch
+import spatial_index
+import migrations
+import db_utils
+import geometry_codec
+import metrics
+import response_cache
+import base64
 from datetime import datetime, timedelta
 import csv
 import io
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Thread pool used to fetch route legs concurrently
+leg_executor = ThreadPoolExecutor(max_workers=config.ROUTING_LEG_WORKERS, thread_name_prefix='route-leg')
+# Bulk imports get their own pool, so live submissions never queue behind their legs
+import_leg_executor = ThreadPoolExecutor(max_workers=config.IMPORT_LEG_WORKERS, thread_name_prefix='import-leg')
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = config.SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = config.SQLALCHEMY_TRACK_MODIFICATIONS
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_utils.engine_options(config.SQLALCHEMY_DATABASE_URI)
 CORS(app)
 
 db.init_app(app)
 
-# Create database tables
+# WAL journaling for SQLite, so worker processes can read while one writes
+with app.app_context():
+    db_utils.configure_engine(db.engine)
+
+# Request timing, DB query counts and the optional ?profile=1 profiler
 with app.app_context():
+    metrics.init_app(app, db.engine, profiling=config.PROFILING_ENABLED)
+
+# Worker processes started by serve.py merge their metrics on each scrape
+if config.METRICS_MULTIPROCESS_DIR:
+    metrics.enable_multiprocess(config.METRICS_MULTIPROCESS_DIR, config.METRICS_FLUSH_INTERVAL)
+
+# Compression for large responses (cached responses are compressed once)
+response_cache.init_app(app)
+
+# Create database tables (one worker process at a time)
+with app.app_context(), migrations.startup_lock():
     db.create_all()
+    migrations.ensure_schema()
+    migrations.migrate_trip_datetimes()
+
+    # Optionally precompute the hospital/campus route matrix
+    if config.ROUTE_MATRIX_BUILD_ON_STARTUP and route_matrix.is_empty():
+        try:
+            route_matrix.build_matrix(config.ORS_API_KEY)
+        except Exception as e:
+            logger.warning(f"Route matrix build failed: {e}. Routes will be calculated on demand.")
+
+    # Build the route frequency aggregate for databases created before it existed
+    if route_frequency.is_stale():
+        route_frequency.rebuild()
+    if trip_stats.is_stale():
+        trip_stats.rebuild()
 
 @app.route('/')
 def index():
@@ -26,15 +83,19 @@ def index():
 
 @app.route('/api/get-current-odometer', methods=['GET'])
 def get_current_odometer():
-    """Get the current odometer reading (last trip's end reading or initial value)"""
-    last_trip = AmbulanceTrip.query.order_by(AmbulanceTrip.id.desc()).first()
-    if last_trip:
-        current_reading = last_trip.km_reading_end
-    else:
-        current_reading = config.INITIAL_ODOMETER
+    """
+    Get the current odometer reading (last trip's end reading or initial value).
+    
+    Optional query parameter vehicle_id selects a vehicle's own odometer.
+    """
+    try:
+        current_reading = fleet.current_odometer(request.args.get('vehicle_id', type=int))
+    except LookupError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
     return jsonify({'odometer': current_reading})
 
 @app.route('/api/get-locations', methods=['GET'])
+@response_cache.cached(response_cache.STATIC, max_age=config.STATIC_MAX_AGE)
 def get_locations():
     """Get all campus locations"""
     locations = []
@@ -54,11 +115,8 @@ def get_route():
     hospital_coords = [config.HOSPITAL_COORDS[1], config.HOSPITAL_COORDS[0]]  # lon, lat for ORS
     
     try:
-        # Route 1: Hospital to Pickup
-        route1 = calculate_route(hospital_coords, pickup_coords)
-        
-        # Route 2: Pickup to Hospital
-        route2 = calculate_route(pickup_coords, hospital_coords)
+        # Route 1: Hospital to Pickup, Route 2: Pickup to Hospital (fetched concurrently)
+        route1, route2 = calculate_routes([(hospital_coords, pickup_coords), (pickup_coords, hospital_coords)])
         
         # Combine routes
         total_distance = route1['distance'] + route2['distance']
@@ -67,6 +125,10 @@ def get_route():
         # Combine geometries
         combined_geometry = route1['geometry'] + route2['geometry']
         
+        if data.get('geometry_format') == 'polyline':
+            route1, route2 = encode_route(route1), encode_route(route2)
+            combined_geometry = geometry_codec.encode_polyline(combined_geometry)
+        
         return jsonify({
             'success': True,
             'route1': route1,
@@ -80,7 +142,9 @@ def get_route():
 
 def calculate_route(start_coords, end_coords):
     """
-    Calculate route between two points using route_optimizer with 3-tier fallback.
+    Calculate route between two points using route_optimizer with tiered fallback.
+    Known hospital/campus pairs are served from the precomputed route matrix
+    and repeat routes from the persistent route cache.
     
     Args:
         start_coords: [lon, lat] of starting point
@@ -89,24 +153,105 @@ def calculate_route(start_coords, end_coords):
     Returns:
         Dict with distance (km), duration (minutes), and geometry (list of [lat, lon])
     """
-    return route_optimizer.calculate_route(start_coords, end_coords, config.ORS_API_KEY)
+    route = route_matrix.lookup(start_coords, end_coords)
+    if route is not None:
+        return route_matrix.with_geometry(route, start_coords, end_coords, config.ORS_API_KEY, **routing_options())
+    return route_cache.calculate_route(start_coords, end_coords, config.ORS_API_KEY, **routing_options())
+
+def calculate_routes(legs, executor=None):
+    """
+    Calculate several routes concurrently.
+    
+    Matrix lookups happen in the request thread; only legs that need a
+    cache lookup or provider call (including matrix legs without geometry)
+    are fetched on the leg pool, so total latency is the slowest leg rather
+    than the sum of all legs.
+    
+    Args:
+        legs: List of (start_coords, end_coords) pairs, each [lon, lat]
+        executor: Pool the legs are fetched on (defaults to leg_executor)
+    
+    Returns:
+        List of route dicts in the same order as legs
+    """
+    executor = executor or leg_executor
+    routes = [route_matrix.lookup(start, end) for start, end in legs]
+    futures = {}
+    for i, (start, end) in enumerate(legs):
+        if routes[i] is None:
+            futures[i] = executor.submit(route_cache.calculate_route, start, end, config.ORS_API_KEY, **routing_options())
+        elif not routes[i]['geometry']:
+            futures[i] = executor.submit(route_matrix.with_geometry, routes[i], start, end, config.ORS_API_KEY,
+                                         **routing_options())
+    for i, future in futures.items():
+        routes[i] = future.result()
+    return routes
+
+def calculate_import_routes(legs):
+    """calculate_routes() on the bulk import pool"""
+    return calculate_routes(legs, import_leg_executor)
+
+# Background routing for async trip submissions
+trip_worker.init_app(app, calculate_routes)
+
+def encode_route(route):
+    """Copy of a route dict with its geometry as an encoded polyline"""
+    return dict(route, geometry=geometry_codec.encode_polyline(route['geometry']), geometry_format='polyline')
+
+def routing_options():
+    """Routing budget and hedging settings from config"""
+    return {
+        'budget': config.ROUTING_BUDGET,
+        'hedged': config.ROUTING_HEDGED,
+        'hedge_delay': config.ROUTING_HEDGE_DELAY
+    }
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/get-route-cache-stats', methods=['GET'])
+def get_route_cache_stats():
+    """Get route cache hit/miss counters and size"""
+    return jsonify({'success': True, 'stats': route_cache.get_cache().stats()})
+
+@app.route('/api/get-provider-status', methods=['GET'])
+def get_provider_status():
+    """Get circuit breaker state for each routing provider"""
+    return jsonify({'success': True, 'providers': provider_clients.status()})
 
 @app.route('/api/submit-trip', methods=['POST'])
 def submit_trip():
-    """Submit a new ambulance trip"""
+    """
+    Submit a new ambulance trip.
+    
+    With "async": true the trip is saved immediately with an offline
+    estimate and route_status 'pending' (unless both legs are in the route
+    matrix with geometry), and the real route is computed in the background; poll
+    /api/trips/<id>/status for the result.
+    
+    Optional vehicle_id records the trip on that vehicle's odometer, and
+    call_id marks the dispatch call it served as completed.
+    """
     data = request.json
     
     try:
-        # Get current odometer
-        last_trip = AmbulanceTrip.query.order_by(AmbulanceTrip.id.desc()).first()
-        km_reading_start = last_trip.km_reading_end if last_trip else config.INITIAL_ODOMETER
+        vehicle_id = data.get('vehicle_id')
         
         # Calculate route
         pickup_coords = [data['pickup_lon'], data['pickup_lat']]
         hospital_coords = [config.HOSPITAL_COORDS[1], config.HOSPITAL_COORDS[0]]
         
-        route1 = calculate_route(hospital_coords, pickup_coords)
-        route2 = calculate_route(pickup_coords, hospital_coords)
+        route_status = None
+        if data.get('async', config.ASYNC_TRIP_SUBMISSION):
+            route1 = route_matrix.lookup(hospital_coords, pickup_coords)
+            route2 = route_matrix.lookup(pickup_coords, hospital_coords)
+            if any(route is None or not route['geometry'] for route in (route1, route2)):
+                route1, route2 = trip_worker.provisional_routes(hospital_coords, pickup_coords)
+                route_status = trip_worker.PENDING
+        else:
+            route1, route2 = calculate_routes([(hospital_coords, pickup_coords), (pickup_coords, hospital_coords)])
         
         total_distance = route1['distance'] + route2['distance']
         total_duration = route1['duration'] + route2['duration']
@@ -116,13 +261,14 @@ def submit_trip():
         departure_time = datetime.strptime(f"{data['date']} {data['time']}", "%Y-%m-%d %H:%M")
         arrival_time = departure_time + timedelta(minutes=total_duration)
         
-        # Calculate end odometer
-        km_reading_end = km_reading_start + total_distance
+        # Reserve the odometer range (of the vehicle, if one is given) once the
+        # route is known, so the chain is only locked until the commit below
+        km_reading_start, km_reading_end = fleet.advance_odometer(vehicle_id, total_distance)
         
         # Create new trip
         new_trip = AmbulanceTrip(
-            date=data['date'],
-            time=data['time'],
+            date=departure_time.date(),
+            time=departure_time.time(),
             km_reading_start=km_reading_start,
             km_reading_end=km_reading_end,
             pickup_location=data['pickup_location'],
@@ -134,136 +280,234 @@ def submit_trip():
             notes=data.get('notes', ''),
             distance_km=total_distance,
             duration_minutes=total_duration,
-            departure_time=departure_time.strftime("%H:%M:%S"),
-            arrival_time=arrival_time.strftime("%H:%M:%S"),
-            route_geometry=json.dumps(combined_geometry)
+            departure_time=departure_time,
+            arrival_time=arrival_time,
+            route_status=route_status,
+            vehicle_id=vehicle_id
         )
+        new_trip.geometry = combined_geometry
         
         db.session.add(new_trip)
+        db.session.flush()
+        fleet.record_trip(new_trip, data.get('call_id'))
+        if route_status != trip_worker.PENDING:
+            # Provisional straight lines are kept out of the frequency map
+            route_frequency.record_trip(new_trip.date.isoformat(), combined_geometry)
+        trip_stats.record_trip(new_trip)
+        response_cache.record_change()
         db.session.commit()
+        spatial_index.invalidate_pickups()
+        
+        if route_status == trip_worker.PENDING:
+            trip_worker.enqueue(new_trip.id)
+        
+        geometry_format = data.get('geometry_format', 'json')
+        if geometry_format == 'polyline':
+            route1, route2 = encode_route(route1), encode_route(route2)
         
         return jsonify({
             'success': True,
-            'trip': new_trip.to_dict(),
+            'trip': new_trip.to_dict(geometry_format),
             'route1': route1,
             'route2': route2,
             'total_distance': total_distance,
             'total_duration': total_duration
         })
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 404
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+CSV_HEADER = [
+    'ID', 'Date', 'Time', 'KM Reading Start', 'KM Reading End',
+    'Pickup Location', 'Patient Name', 'Driver Name', 'Purpose',
+    'Notes', 'Distance (km)', 'Duration (min)', 'Departure Time',
+    'Arrival Time', 'Created At'
+]
+
+CSV_COLUMNS = [
+    AmbulanceTrip.id, AmbulanceTrip.date, AmbulanceTrip.time, AmbulanceTrip.km_reading_start,
+    AmbulanceTrip.km_reading_end, AmbulanceTrip.pickup_location, AmbulanceTrip.patient_name,
+    AmbulanceTrip.driver_name, AmbulanceTrip.purpose, AmbulanceTrip.notes, AmbulanceTrip.distance_km,
+    AmbulanceTrip.duration_minutes, AmbulanceTrip.departure_time, AmbulanceTrip.arrival_time,
+    AmbulanceTrip.created_at
+]
+
 @app.route('/api/export-csv', methods=['GET'])
 def export_csv():
-    """Export all ambulance trips to CSV"""
-    trips = AmbulanceTrip.query.order_by(AmbulanceTrip.created_at.desc()).all()
+    """
+    Export ambulance trips to CSV, streamed in batches.
     
-    # Create CSV in memory
+    Optional query parameters:
+        start_date, end_date: YYYY-MM-DD (inclusive)
+        driver: exact driver name
+        purpose: exact purpose
+        gzip: 1 to download a gzip-compressed file
+    """
+    try:
+        start_date, end_date = parse_date_arg('start_date'), parse_date_arg('end_date')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    query = db.session.query(*CSV_COLUMNS).order_by(AmbulanceTrip.created_at.desc())
+    
+    if start_date:
+        query = query.filter(AmbulanceTrip.date >= start_date)
+    if end_date:
+        query = query.filter(AmbulanceTrip.date <= end_date)
+    if request.args.get('driver'):
+        query = query.filter(AmbulanceTrip.driver_name == request.args['driver'])
+    if request.args.get('purpose'):
+        query = query.filter(AmbulanceTrip.purpose == request.args['purpose'])
+    
+    # Server-side cursor: rows are fetched from the database in batches as the response streams
+    rows = query.execution_options(stream_results=True, yield_per=config.EXPORT_BATCH_SIZE)
+    chunks = generate_csv(rows)
+    
+    filename = f'ambulance_trips_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    mimetype = 'text/csv'
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+def generate_csv(rows):
+    """Yield CSV text one batch of rows at a time"""
     output = io.StringIO()
     writer = csv.writer(output)
     
     # Write header
-    writer.writerow([
-        'ID', 'Date', 'Time', 'KM Reading Start', 'KM Reading End',
-        'Pickup Location', 'Patient Name', 'Driver Name', 'Purpose',
-        'Notes', 'Distance (km)', 'Duration (min)', 'Departure Time',
-        'Arrival Time', 'Created At'
-    ])
+    writer.writerow(CSV_HEADER)
     
     # Write data
-    for trip in trips:
+    for count, row in enumerate(rows, 1):
         writer.writerow([
-            trip.id, trip.date, trip.time, trip.km_reading_start,
-            trip.km_reading_end, trip.pickup_location, trip.patient_name,
-            trip.driver_name, trip.purpose, trip.notes, trip.distance_km,
-            trip.duration_minutes, trip.departure_time, trip.arrival_time,
-            trip.created_at.strftime("%Y-%m-%d %H:%M:%S") if trip.created_at else ''
+            row.id, row.date.isoformat(), row.time.strftime("%H:%M"), row.km_reading_start,
+            row.km_reading_end, row.pickup_location, row.patient_name,
+            row.driver_name, row.purpose, row.notes, row.distance_km,
+            row.duration_minutes, row.departure_time.strftime("%H:%M:%S"), row.arrival_time.strftime("%H:%M:%S"),
+            row.created_at.strftime("%Y-%m-%d %H:%M:%S") if row.created_at else ''
         ])
+        if count % config.EXPORT_BATCH_SIZE == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
     
-    # Prepare file for download
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'ambulance_trips_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-    )
+    yield output.getvalue()
+
+def parse_date_arg(name):
+    """Parse an optional YYYY-MM-DD query parameter"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"{name} must be YYYY-MM-DD")
+
+def parse_date_range_args():
+    """Parse the optional start_date/end_date query parameters as YYYY-MM-DD strings"""
+    start_date, end_date = parse_date_arg('start_date'), parse_date_arg('end_date')
+    return (start_date.isoformat() if start_date else None,
+            end_date.isoformat() if end_date else None)
+
+def gzip_chunks(chunks):
+    """Gzip-compress a stream of text chunks"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
 
 @app.route('/api/get-isochrones', methods=['GET'])
 def get_isochrones():
-    """Get isochrone zones from hospital (3, 5, 7 minutes)"""
-    hospital_coords = [config.HOSPITAL_COORDS[1], config.HOSPITAL_COORDS[0]]
-    
+    """Get isochrone zones from hospital (3, 5, 7 minutes) from the precomputed store"""
     try:
-        isochrones = []
-        for minutes in [3, 5, 7]:
-            isochrone = calculate_isochrone(hospital_coords, minutes * 60)
-            isochrones.append({
-                'minutes': minutes,
-                'geometry': isochrone
-            })
-        
-        return jsonify({'success': True, 'isochrones': isochrones})
+        store = isochrone_service.get_isochrones()
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def calculate_isochrone(coords, seconds):
-    """Calculate isochrone using OpenRouteService"""
-    url = 'https://api.openrouteservice.org/v2/isochrones/driving-car'
-    
-    headers = {
-        'Authorization': config.ORS_API_KEY,
-        'Content-Type': 'application/json'
-    }
-    
-    body = {
-        'locations': [coords],
-        'range': [seconds]
-    }
+    if request.args.get('format') == 'geojson':
+        response = jsonify(store['geojson'])
+    else:
+        response = jsonify({
+            'success': True,
+            'isochrones': store['isochrones'],
+            'generated_at': datetime.utcfromtimestamp(store['generated_at']).isoformat()
+        })
+    response.set_etag(store['etag'])
+    response.last_modified = int(store['generated_at'])
+    response.cache_control.public = True
+    response.cache_control.max_age = config.ISOCHRONE_MAX_AGE
+    return response.make_conditional(request)
+
+@app.route('/api/coverage', methods=['GET'])
+def get_coverage():
+    """
+    Share of campus locations and historical pickups inside each isochrone
+    zone, with the busiest uncovered pickup hotspots.
     
-    response = requests.post(url, json=body, headers=headers)
+    Optional query parameters:
+        minutes: zone that counts as covered for uncovered lists and hotspots (default largest)
+        hotspots: number of hotspots returned
+    """
+    try:
+        result = isochrone_coverage.get_coverage(
+            minutes=request.args.get('minutes', type=int),
+            hotspots=request.args.get('hotspots', type=int)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
     
-    if response.status_code == 200:
-        data = response.json()
-        # Convert coordinates from lon,lat to lat,lon
-        geometry = []
-        for coord in data['features'][0]['geometry']['coordinates'][0]:
-            geometry.append([coord[1], coord[0]])
-        return geometry
-    else:
-        raise Exception(f"OpenRouteService API error: {response.status_code}")
+    response = jsonify({'success': True, **result})
+    response.set_etag(result['version'])
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/api/get-route-frequency', methods=['GET'])
+@response_cache.cached()
 def get_route_frequency():
-    """Analyze route frequency from historical data"""
-    trips = AmbulanceTrip.query.all()
-    
-    # Create a dictionary to count route segments
-    route_segments = {}
-    
-    for trip in trips:
-        if trip.route_geometry:
-            geometry = json.loads(trip.route_geometry)
-            # Create segments from consecutive points
-            for i in range(len(geometry) - 1):
-                # Create a segment key (rounded to reduce precision)
-                p1 = (round(geometry[i][0], 4), round(geometry[i][1], 4))
-                p2 = (round(geometry[i+1][0], 4), round(geometry[i+1][1], 4))
-                segment = tuple(sorted([p1, p2]))  # Sort to make direction-independent
-                
-                route_segments[segment] = route_segments.get(segment, 0) + 1
-    
-    # Convert to list with frequency
-    max_frequency = max(route_segments.values()) if route_segments else 1
-    
-    segments_list = []
-    for segment, count in route_segments.items():
-        segments_list.append({
-            'coordinates': [[segment[0][0], segment[0][1]], [segment[1][0], segment[1][1]]],
-            'frequency': count,
-            'normalized_frequency': count / max_frequency
-        })
+    """
+    Analyze route frequency from the segment aggregate.
+    
+    Optional query parameters:
+        bbox: min_lat,min_lon,max_lat,max_lon
+        start_date, end_date: YYYY-MM-DD (inclusive)
+        min_frequency: minimum times a segment was used
+    """
+    try:
+        bbox = request.args.get('bbox')
+        if bbox:
+            bbox = tuple(float(v) for v in bbox.split(','))
+            if len(bbox) != 4:
+                raise ValueError('bbox must be min_lat,min_lon,max_lat,max_lon')
+        min_frequency = request.args.get('min_frequency', 1, type=int)
+        start_date, end_date = parse_date_range_args()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    segments_list = route_frequency.query_segments(
+        bbox=bbox,
+        start_date=start_date,
+        end_date=end_date,
+        min_frequency=min_frequency
+    )
+    
+    # Normalize against the most used segment
+    max_frequency = max(s['frequency'] for s in segments_list) if segments_list else 1
+    for segment in segments_list:
+        segment['normalized_frequency'] = segment['frequency'] / max_frequency
     
     return jsonify({
         'success': True,
@@ -271,5 +515,390 @@ def get_route_frequency():
         'max_frequency': max_frequency
     })
 
+@app.route('/api/route-frequency/tiles/<int:z>/<int:x>/<int:y>', methods=['GET'])
+@response_cache.cached()
+def get_route_frequency_tile(z, x, y):
+    """
+    Route frequency for one web map tile, as merged and simplified polylines
+    from the aggregate level matching the zoom.
+    
+    Optional query parameters:
+        start_date, end_date: YYYY-MM-DD (inclusive)
+        min_frequency: minimum times a segment was used
+    """
+    try:
+        start_date, end_date = parse_date_range_args()
+        tile = route_tiles.get_tile(
+            z, x, y,
+            start_date=start_date,
+            end_date=end_date,
+            min_frequency=request.args.get('min_frequency', 1, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({'success': True, 'z': z, 'x': x, 'y': y, **tile})
+
+@app.route('/api/nearest', methods=['GET', 'POST'])
+def get_nearest():
+    """
+    Snap points to the nearest campus location or historical pickup point.
+    
+    GET takes lat and lon query parameters; POST takes {"points": [[lat, lon], ...]}
+    for batch lookups (up to NEAREST_MAX_POINTS). Optional parameters (query
+    string or JSON body): source (campus, pickups or all; default campus) and
+    max_distance_km (matches further away are returned as null).
+    """
+    if request.method == 'POST':
+        options = request.get_json(silent=True) or {}
+    else:
+        options = request.args
+    try:
+        if request.method == 'POST':
+            points = [[float(lat), float(lon)] for lat, lon in options.get('points') or []]
+            if len(points) > config.NEAREST_MAX_POINTS:
+                raise ValueError(f"At most {config.NEAREST_MAX_POINTS} points per request")
+        else:
+            points = [[float(request.args['lat']), float(request.args['lon'])]]
+        max_km = options.get('max_distance_km')
+        matches = spatial_index.nearest(
+            points,
+            source=options.get('source', 'campus'),
+            max_km=float(max_km) if max_km not in (None, '') else None
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f"Invalid request: {e}"}), 400
+    
+    if request.method == 'GET':
+        return jsonify({'success': True, 'match': matches[0]})
+    return jsonify({'success': True, 'matches': matches})
+
+@app.route('/api/trips', methods=['GET'])
+def list_trips():
+    """
+    List trips newest first with keyset pagination. Route geometry is never
+    loaded here; fetch it per trip from /api/trips/<id>/geometry.
+    
+    Optional query parameters:
+        limit: page size (default TRIPS_PAGE_SIZE, max TRIPS_MAX_PAGE_SIZE)
+        cursor: next_cursor from the previous page
+        order: 'date' (default, by date then id) or 'id'
+        fields: comma-separated subset of trip fields
+        start_date, end_date, driver, purpose, pickup_location: filters
+    """
+    try:
+        fields = request.args.get('fields')
+        fields = fields.split(',') if fields else list(TRIP_FIELDS)
+        unknown = [name for name in fields if name not in TRIP_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        
+        order = request.args.get('order', 'date')
+        if order not in ('date', 'id'):
+            raise ValueError("order must be 'date' or 'id'")
+        limit = min(request.args.get('limit', config.TRIPS_PAGE_SIZE, type=int), config.TRIPS_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError('limit must be positive')
+        cursor = decode_cursor(request.args.get('cursor'), order)
+        start_date, end_date = parse_date_arg('start_date'), parse_date_arg('end_date')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Only the requested columns are selected
+    query = AmbulanceTrip.query.options(db.load_only(*AmbulanceTrip.columns_for(fields + [order])))
+    
+    if start_date:
+        query = query.filter(AmbulanceTrip.date >= start_date)
+    if end_date:
+        query = query.filter(AmbulanceTrip.date <= end_date)
+    for arg, column in (('driver', AmbulanceTrip.driver_name), ('purpose', AmbulanceTrip.purpose),
+                        ('pickup_location', AmbulanceTrip.pickup_location)):
+        if request.args.get(arg):
+            query = query.filter(column == request.args[arg])
+    
+    if order == 'date':
+        if cursor:
+            last_date, last_id = cursor
+            query = query.filter(db.or_(
+                AmbulanceTrip.date < last_date,
+                db.and_(AmbulanceTrip.date == last_date, AmbulanceTrip.id < last_id)
+            ))
+        query = query.order_by(AmbulanceTrip.date.desc(), AmbulanceTrip.id.desc())
+    else:
+        if cursor:
+            query = query.filter(AmbulanceTrip.id < cursor)
+        query = query.order_by(AmbulanceTrip.id.desc())
+    
+    trips = query.limit(limit + 1).all()
+    has_more = len(trips) > limit
+    trips = trips[:limit]
+    
+    next_cursor = None
+    if has_more:
+        last = trips[-1]
+        next_cursor = encode_cursor(f"{last.date.isoformat()}|{last.id}" if order == 'date' else str(last.id))
+    
+    return jsonify({
+        'success': True,
+        'trips': [trip.to_dict(geometry_format=None, fields=fields) for trip in trips],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/trips/<int:trip_id>/geometry', methods=['GET'])
+def get_trip_geometry(trip_id):
+    """Get one trip's route geometry (?format=polyline for the encoded form)"""
+    trip = db.session.get(AmbulanceTrip, trip_id, options=[
+        db.load_only(AmbulanceTrip.id, AmbulanceTrip.route_polyline, AmbulanceTrip.route_geometry)
+    ])
+    if trip is None:
+        return jsonify({'success': False, 'error': 'Trip not found'}), 404
+    
+    if request.args.get('format') == 'polyline':
+        return jsonify({'success': True, 'id': trip.id, 'route_polyline': trip.encoded_geometry})
+    return jsonify({'success': True, 'id': trip.id, 'geometry': trip.geometry})
+
+@app.route('/api/trips/<int:trip_id>/status', methods=['GET'])
+def get_trip_status(trip_id):
+    """Get a trip's routing status and current figures (for polling async submissions)"""
+    trip = db.session.get(AmbulanceTrip, trip_id)
+    if trip is None:
+        return jsonify({'success': False, 'error': 'Trip not found'}), 404
+    
+    return jsonify({
+        'success': True,
+        'route_status': trip.route_status or trip_worker.COMPLETE,
+        'trip': trip.to_dict(geometry_format=None)
+    })
+
+def encode_cursor(value):
+    """Opaque pagination cursor"""
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, order):
+    """Parse a cursor from encode_cursor into (date, id) or id"""
+    if not cursor:
+        return None
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        if order == 'date':
+            last_date, last_id = value.split('|')
+            return datetime.strptime(last_date, "%Y-%m-%d").date(), int(last_id)
+        return int(value)
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+
+@app.route('/api/import-trips', methods=['POST'])
+def import_trips():
+    """
+    Bulk import historical trips from an uploaded CSV or JSONL file.
+    
+    Send the file as multipart field 'file', or as the raw request body with
+    ?format=csv|jsonl. Optional query parameters: batch_size, start_odometer.
+    """
+    upload = request.files.get('file')
+    if upload:
+        stream = upload.stream
+        fmt = request.args.get('format') or trip_import.detect_format(upload.filename or '')
+    else:
+        stream = request.stream
+        fmt = request.args.get('format', 'csv')
+    batch_size = request.args.get('batch_size', config.IMPORT_BATCH_SIZE, type=int)
+    if batch_size <= 0:
+        return jsonify({'success': False, 'error': 'batch_size must be a positive integer'}), 400
+    
+    try:
+        records = trip_import.read_records(trip_import.text_stream(stream), fmt)
+        summary = trip_import.import_trips(
+            records,
+            calculate_import_routes,
+            batch_size=batch_size,
+            start_odometer=request.args.get('start_odometer', type=float)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        # Batches committed before any failure are already in the table
+        spatial_index.invalidate_pickups()
+    
+    return jsonify({'success': True, **summary})
+
+@app.route('/api/stats/summary', methods=['GET'])
+@response_cache.cached()
+def get_stats_summary():
+    """Trip totals, averages and most common pickup location (optional start_date/end_date)"""
+    try:
+        start_date, end_date = parse_date_range_args()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    stats = trip_stats.summary(start_date, end_date)
+    return jsonify({'success': True, 'statistics': stats})
+
+@app.route('/api/stats/hourly', methods=['GET'])
+@response_cache.cached()
+def get_stats_hourly():
+    """Trips per hour of day and peak hour (optional start_date/end_date)"""
+    try:
+        start_date, end_date = parse_date_range_args()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    stats = trip_stats.hourly(start_date, end_date)
+    return jsonify({'success': True, **stats})
+
+@app.route('/api/stats/daily', methods=['GET'])
+@response_cache.cached()
+def get_stats_daily():
+    """Trips per date and per day of week (optional start_date/end_date)"""
+    try:
+        start_date, end_date = parse_date_range_args()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    stats = trip_stats.daily(start_date, end_date)
+    return jsonify({'success': True, **stats})
+
+@app.route('/api/stats/weekly', methods=['GET'])
+@response_cache.cached()
+def get_stats_weekly():
+    """Trips per ISO week (optional start_date/end_date)"""
+    try:
+        start_date, end_date = parse_date_range_args()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    stats = trip_stats.weekly(start_date, end_date)
+    return jsonify({'success': True, **stats})
+
+@app.route('/api/vehicles', methods=['GET'])
+def list_vehicles():
+    """List vehicles with their current odometer readings"""
+    vehicles = []
+    for vehicle in Vehicle.query.order_by(Vehicle.id):
+        data = vehicle.to_dict()
+        data['odometer'] = fleet.current_odometer(vehicle.id)
+        vehicles.append(data)
+    return jsonify({'success': True, 'vehicles': vehicles})
+
+@app.route('/api/vehicles', methods=['POST'])
+def create_vehicle():
+    """
+    Add a vehicle: {"name": ..., "initial_odometer": ..., "lat": ..., "lon": ...}.
+    Position defaults to the hospital.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        name = str(data['name']).strip()
+        if not name:
+            raise ValueError('name is required')
+        if Vehicle.query.filter_by(name=name).first():
+            raise ValueError(f"Vehicle {name!r} already exists")
+        vehicle = Vehicle(
+            name=name,
+            initial_odometer=float(data.get('initial_odometer', config.INITIAL_ODOMETER)),
+            lat=float(data.get('lat', config.HOSPITAL_COORDS[0])),
+            lon=float(data.get('lon', config.HOSPITAL_COORDS[1])),
+            active=bool(data.get('active', True))
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        message = 'name is required' if isinstance(e, KeyError) else str(e)
+        return jsonify({'success': False, 'error': message}), 400
+    
+    db.session.add(vehicle)
+    db.session.commit()
+    return jsonify({'success': True, 'vehicle': vehicle.to_dict()}), 201
+
+@app.route('/api/vehicles/<int:vehicle_id>', methods=['PATCH'])
+def update_vehicle(vehicle_id):
+    """
+    Update a vehicle's dispatch state: active, lat/lon (current position)
+    and available_at (ISO datetime, or null when free now).
+    """
+    vehicle = db.session.get(Vehicle, vehicle_id)
+    if vehicle is None:
+        return jsonify({'success': False, 'error': 'Vehicle not found'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        if 'active' in data:
+            vehicle.active = bool(data['active'])
+        if 'lat' in data or 'lon' in data:
+            vehicle.lat, vehicle.lon = float(data['lat']), float(data['lon'])
+        if 'available_at' in data:
+            vehicle.available_at = datetime.fromisoformat(data['available_at']) if data['available_at'] else None
+    except (KeyError, TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f"Invalid vehicle update: {e}"}), 400
+    
+    db.session.commit()
+    return jsonify({'success': True, 'vehicle': vehicle.to_dict()})
+
+@app.route('/api/dispatch/calls', methods=['GET'])
+def list_dispatch_calls():
+    """List dispatch calls (optional status filter, default pending)"""
+    status = request.args.get('status', fleet.PENDING)
+    calls = DispatchCall.query.filter_by(status=status).order_by(DispatchCall.received_at, DispatchCall.id)
+    return jsonify({'success': True, 'calls': [call.to_dict() for call in calls]})
+
+@app.route('/api/dispatch/calls', methods=['POST'])
+def create_dispatch_call():
+    """
+    Register a pickup call: {"pickup_location", "pickup_lat", "pickup_lon"}.
+    
+    The pending calls are replanned straight away; with "assign": true the
+    first call of each vehicle's queue is also committed. Optional
+    "objective" is 'total' or 'max'.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        call = DispatchCall(
+            pickup_location=str(data.get('pickup_location') or 'Unknown'),
+            pickup_lat=float(data['pickup_lat']),
+            pickup_lon=float(data['pickup_lon'])
+        )
+        objective = data.get('objective')
+        if objective is not None and objective not in dispatch.OBJECTIVES:
+            raise ValueError(f"objective must be one of {', '.join(dispatch.OBJECTIVES)}")
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f"Invalid call: {e}"}), 400
+    
+    db.session.add(call)
+    db.session.commit()
+    plan = fleet.assign(objective) if data.get('assign') else fleet.plan(objective)
+    return jsonify({'success': True, 'call': db.session.get(DispatchCall, call.id).to_dict(), 'plan': plan}), 201
+
+@app.route('/api/dispatch/calls/<int:call_id>/cancel', methods=['POST'])
+def cancel_dispatch_call(call_id):
+    """Cancel a pending or assigned call"""
+    call = db.session.get(DispatchCall, call_id)
+    if call is None:
+        return jsonify({'success': False, 'error': 'Call not found'}), 404
+    if call.status not in (fleet.PENDING, fleet.ASSIGNED):
+        return jsonify({'success': False, 'error': f"Call is already {call.status}"}), 409
+    call.status = fleet.CANCELLED
+    db.session.commit()
+    return jsonify({'success': True, 'call': call.to_dict()})
+
+@app.route('/api/dispatch/plan', methods=['GET'])
+def get_dispatch_plan():
+    """Plan the pending calls across active vehicles without saving (objective=total|max)"""
+    try:
+        plan = fleet.plan(request.args.get('objective'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'plan': plan})
+
+@app.route('/api/dispatch/assign', methods=['POST'])
+def assign_dispatch_calls():
+    """Plan the pending calls and commit the next call for each vehicle (optional {"objective"})"""
+    data = request.get_json(silent=True) or {}
+    try:
+        plan = fleet.assign(data.get('objective'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'plan': plan})
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
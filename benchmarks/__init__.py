@@ -0,0 +1 @@
+"""Benchmark and load-test suite with stub routing providers."""
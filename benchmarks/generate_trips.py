@@ -0,0 +1,103 @@
+"""
+Synthetic Trip Generator
+Fills a database with realistic-looking trips for benchmarking.
+
+Trips are spread evenly over the last `days` days, picked up at campus
+locations or at a fixed pool of free-form points near campus, and routed
+with the stub providers' synthetic routes. They go through
+trip_import.import_trips, so odometer chaining, batched inserts and the
+aggregate tables match a real bulk import.
+
+    python -m benchmarks.generate_trips --trips 100000 --db instance/benchmark.db
+"""
+
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+import config
+import trip_import
+from benchmarks.stub_providers import synthetic_route
+
+PURPOSES = ['Emergency', 'Scheduled', 'Transfer', 'Checkup']
+DRIVERS = ['Ramesh', 'Suresh', 'Mahesh', 'Ganesh', 'Dinesh']
+
+
+def pickup_points(free_points: int, seed: int = 0) -> List[Tuple[str, float, float]]:
+    """Campus locations plus free_points random points within ~1 km of the hospital."""
+    rng = random.Random(seed)
+    points = [(name, lat, lon) for name, (lat, lon) in config.CAMPUS_LOCATIONS.items()]
+    hospital_lat, hospital_lon = config.HOSPITAL_COORDS
+    for i in range(free_points):
+        points.append((f"Point {i + 1}", hospital_lat + rng.uniform(-0.01, 0.01), hospital_lon + rng.uniform(-0.01, 0.01)))
+    return points
+
+
+def records(count: int, days: int = 365, free_points: int = 200, seed: int = 0) -> Iterator[Dict]:
+    """
+    Synthetic import records in chronological order.
+
+    Args:
+        count: Number of trips
+        days: Trips are spread over this many days, ending now
+        free_points: Size of the pool of free-form pickup points
+        seed: Random seed
+    """
+    rng = random.Random(seed)
+    points = pickup_points(free_points, seed)
+    start = datetime.now().replace(second=0, microsecond=0) - timedelta(days=days)
+    interval = days * 86400 / max(count, 1)
+    for i in range(count):
+        departure = start + timedelta(seconds=i * interval + rng.uniform(0, interval * 0.9))
+        name, lat, lon = rng.choice(points)
+        yield {
+            'date': departure.strftime('%Y-%m-%d'),
+            'time': departure.strftime('%H:%M'),
+            'pickup_location': name,
+            'pickup_lat': lat,
+            'pickup_lon': lon,
+            'patient_name': f"Patient {i + 1}",
+            'driver_name': rng.choice(DRIVERS),
+            'purpose': rng.choice(PURPOSES),
+            'notes': ''
+        }
+
+
+def resolve_routes(legs: List[Tuple]) -> List[Dict]:
+    """Synthetic route for each (start, end) leg, without any network call."""
+    return [synthetic_route(start, end) for start, end in legs]
+
+
+def generate(count: int, days: int = 365, free_points: int = 200, seed: int = 0, batch_size: int = 5000) -> Dict:
+    """
+    Insert synthetic trips. Must be called inside an application context.
+
+    Returns:
+        The trip_import summary
+    """
+    def progress(summary):
+        print(f"  {summary['imported']:,} / {count:,} trips ({summary['rows_per_second']:,.0f} rows/s)", end='\r')
+
+    summary = trip_import.import_trips(records(count, days, free_points, seed), resolve_routes,
+                                       batch_size=batch_size, progress=progress)
+    print()
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill a database with synthetic trips')
+    parser.add_argument('--trips', type=int, default=10000, help='number of trips to add (e.g. 10000, 100000, 1000000)')
+    parser.add_argument('--db', default=os.path.join(config.INSTANCE_DIR, 'benchmark.db'), help='SQLite database path')
+    parser.add_argument('--days', type=int, default=365, help='spread trips over this many days')
+    parser.add_argument('--free-points', type=int, default=200, help='free-form pickup points besides campus locations')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.abspath(args.db)}"
+    from app import app
+
+    with app.app_context():
+        summary = generate(args.trips, args.days, args.free_points, args.seed)
+        print(f"✓ Added {summary['imported']:,} trips to {args.db} in {summary['elapsed']}s")
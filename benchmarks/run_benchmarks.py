@@ -0,0 +1,280 @@
+"""
+Benchmark Runner
+Runs scripted request scenarios against the app with stub routing providers
+and reports latency percentiles, throughput and memory.
+
+The app is served in-process through Flask's test client against a
+dedicated database (filled with synthetic trips up to --trips), with ORS
+and OSRM pointed at a local stub server, so results do not depend on the
+network or on the public providers.
+
+    python -m benchmarks.run_benchmarks --trips 100000 --save results.json
+    python -m benchmarks.run_benchmarks --trips 100000 --baseline results.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import config
+from benchmarks import generate_trips
+from benchmarks.stub_providers import StubProviderServer
+
+# (method, url, JSON body)
+Request = Tuple[str, str, Optional[Dict]]
+
+
+def _submit_trip(i: int, rng: random.Random) -> Request:
+    name, (lat, lon) = rng.choice(list(config.CAMPUS_LOCATIONS.items()))
+    return 'POST', '/api/submit-trip', {
+        # Jittered up to ~300 m so most requests miss the matrix and route cache
+        'pickup_lat': lat + rng.uniform(-0.003, 0.003),
+        'pickup_lon': lon + rng.uniform(-0.003, 0.003),
+        'pickup_location': name,
+        'date': date.today().isoformat(),
+        'time': f"{rng.randrange(24):02d}:{rng.randrange(60):02d}",
+        'patient_name': f"Benchmark {i}",
+        'driver_name': 'Benchmark',
+        'purpose': 'Emergency',
+        'notes': '',
+        'geometry_format': 'polyline'
+    }
+
+
+def _route_frequency(i: int, rng: random.Random) -> Request:
+    if i % 2:
+        start = date.today() - timedelta(days=rng.randrange(30, 365))
+        return 'GET', f"/api/get-route-frequency?start_date={start}&end_date={start + timedelta(days=30)}", None
+    return 'GET', '/api/get-route-frequency', None
+
+
+def _route_frequency_tiles(i: int, rng: random.Random) -> Request:
+    # A tile near the hospital at a zoom between the default map view and street level
+    zoom = rng.randrange(13, 17)
+    n = 2 ** zoom
+    lat, lon = config.HOSPITAL_COORDS
+    x = int((lon + 180) / 360 * n) + rng.randrange(-1, 2)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n) + rng.randrange(-1, 2)
+    return 'GET', f"/api/route-frequency/tiles/{zoom}/{x}/{y}", None
+
+
+def _export_csv(i: int, rng: random.Random) -> Request:
+    if i % 2:
+        start = date.today() - timedelta(days=rng.randrange(30, 365))
+        return 'GET', f"/api/export-csv?start_date={start}&end_date={start + timedelta(days=30)}", None
+    return 'GET', '/api/export-csv', None
+
+
+def _isochrones(i: int, rng: random.Random) -> Request:
+    return 'GET', '/api/get-isochrones', None
+
+
+# Scenario name -> (default request count, request factory)
+SCENARIOS: Dict[str, Tuple[int, Callable[[int, random.Random], Request]]] = {
+    'submit-trip': (200, _submit_trip),
+    'route-frequency': (50, _route_frequency),
+    'route-frequency-tiles': (200, _route_frequency_tiles),
+    'export-csv': (6, _export_csv),
+    'isochrones': (200, _isochrones),
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = max(int(round(p / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def run_scenario(app, name: str, requests: int, concurrency: int, seed: int = 0,
+                 trace_memory: bool = False) -> Dict:
+    """
+    Send `requests` requests for one scenario from `concurrency` threads.
+
+    Returns:
+        Result dict with latency percentiles (ms), throughput and memory
+    """
+    _, factory = SCENARIOS[name]
+    rng = random.Random(seed)
+    planned = [factory(i, rng) for i in range(requests)]
+    local = threading.local()
+    latencies = []
+    errors = 0
+    response_bytes = 0
+    lock = threading.Lock()
+
+    def send(request):
+        nonlocal errors, response_bytes
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        method, url, body = request
+        started = time.perf_counter()
+        response = client.open(url, method=method, json=body)
+        data = response.get_data()  # Drain streamed responses
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            response_bytes += len(data)
+            if response.status_code >= 400:
+                errors += 1
+
+    if trace_memory:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, planned))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        'scenario': name,
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        'throughput_rps': round(requests / wall, 1) if wall else 0.0,
+        'mean_response_kb': round(response_bytes / max(requests, 1) / 1024, 1),
+        'peak_rss_mb': _peak_rss_mb()
+    }
+    if trace_memory:
+        result['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+    return result
+
+
+def compare(results: List[Dict], baseline: List[Dict], max_regression: float) -> List[str]:
+    """
+    Compare p95 latency and throughput against a saved baseline.
+
+    Returns:
+        One message per scenario that regressed by more than max_regression (a fraction)
+    """
+    previous = {result['scenario']: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result['scenario'])
+        if not old:
+            continue
+        if old['p95_ms'] and result['p95_ms'] > old['p95_ms'] * (1 + max_regression):
+            regressions.append(f"{result['scenario']}: p95 {old['p95_ms']} ms -> {result['p95_ms']} ms")
+        if old['throughput_rps'] and result['throughput_rps'] < old['throughput_rps'] * (1 - max_regression):
+            regressions.append(f"{result['scenario']}: throughput {old['throughput_rps']} -> {result['throughput_rps']} req/s")
+    return regressions
+
+
+def print_report(results: List[Dict], trips: int, stub: StubProviderServer):
+    columns = ['scenario', 'requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms',
+               'throughput_rps', 'mean_response_kb', 'peak_rss_mb']
+    if results and 'peak_traced_mb' in results[0]:
+        columns.append('peak_traced_mb')
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in columns}
+
+    print(f"\nBenchmark results ({trips:,} trips, stub latency {stub.latency * 1000:.0f} ms, "
+          f"failure rate {stub.failure_rate:.0%})")
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    for result in results:
+        print('  '.join(str(result[c]).ljust(widths[c]) for c in columns))
+    print(f"Provider requests: {dict(stub.requests)}")
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ambulance app with stub routing providers')
+    parser.add_argument('--trips', type=int, default=10000, help='trips in the benchmark database (e.g. 10000, 100000, 1000000)')
+    parser.add_argument('--db', default=os.path.join(config.INSTANCE_DIR, 'benchmark.db'), help='SQLite database path')
+    parser.add_argument('--fresh', action='store_true', help='delete the benchmark database first')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated scenarios to run')
+    parser.add_argument('--requests', type=int, help='requests per scenario (default depends on scenario)')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent client threads')
+    parser.add_argument('--latency', type=float, default=0.05, help='stub provider latency (seconds)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of stub provider requests that fail')
+    parser.add_argument('--trace-memory', action='store_true', help='report peak Python allocations (slows requests)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='JSON', help='write results to a file')
+    parser.add_argument('--baseline', metavar='JSON', help='compare against saved results and exit 1 on regression')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='allowed p95/throughput regression (fraction)')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    stub = StubProviderServer(latency=args.latency, failure_rate=args.failure_rate, seed=args.seed).start()
+    scratch = tempfile.mkdtemp(prefix='ambulance-benchmark-')
+
+    # Configure before the app is imported: it opens the database at import time
+    if args.fresh and os.path.exists(args.db):
+        os.remove(args.db)
+    config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.abspath(args.db)}"
+    config.ORS_BASE_URL = config.OSRM_BASE_URL = stub.url
+    config.ORS_API_KEY = 'benchmark'
+    config.ROUTE_CACHE_PATH = os.path.join(scratch, 'route_cache.db')
+    config.ISOCHRONE_STORE_PATH = os.path.join(scratch, 'isochrones.geojson')
+    config.ROAD_NETWORK_PATH = os.path.join(scratch, 'road_network.geojson')
+    config.ROUTE_MATRIX_BUILD_ON_STARTUP = False
+
+    from app import app
+    from models import db, AmbulanceTrip
+
+    with app.app_context():
+        existing = db.session.query(db.func.count(AmbulanceTrip.id)).scalar()
+        if existing < args.trips:
+            print(f"Generating {args.trips - existing:,} synthetic trips...")
+            generate_trips.generate(args.trips - existing, seed=args.seed + existing)
+
+    if args.trace_memory:
+        tracemalloc.start()
+
+    results = []
+    for name in names:
+        requests = args.requests or SCENARIOS[name][0]
+        print(f"Running {name} ({requests} requests, concurrency {args.concurrency})...")
+        results.append(run_scenario(app, name, requests, args.concurrency, args.seed, args.trace_memory))
+
+    stub.stop()
+    print_report(results, max(existing, args.trips), stub)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'trips': max(existing, args.trips), 'results': results}, f, indent=2)
+        print(f"✓ Results saved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.max_regression)
+        if regressions:
+            print("\nRegressions:")
+            for message in regressions:
+                print(f"  ✗ {message}")
+            sys.exit(1)
+        print(f"✓ No regressions beyond {args.max_regression:.0%} against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
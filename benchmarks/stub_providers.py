@@ -0,0 +1,238 @@
+"""
+Stub Routing Providers
+Local HTTP server imitating the ORS directions/matrix/isochrones and OSRM
+route/table APIs, with configurable latency and failure rate.
+
+Routes are synthetic: a gently curved line between the two points, 30%
+longer than the straight-line distance and driven at 25 km/h. Point the app
+at the server with ORS_BASE_URL/OSRM_BASE_URL, or run it on its own:
+
+    python -m benchmarks.stub_providers --port 8089 --latency 0.05 --failure-rate 0.1
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+ROAD_FACTOR = 1.3  # Synthetic road distance / straight-line distance
+SPEED_KMH = 25
+ROUTE_POINTS = 20
+
+
+def synthetic_route(start_coords: List[float], end_coords: List[float]) -> Dict:
+    """
+    Synthetic road route between two points.
+
+    Args:
+        start_coords: [lon, lat] of starting point
+        end_coords: [lon, lat] of ending point
+
+    Returns:
+        Dict with distance (km), duration (minutes), geometry (list of [lat, lon])
+        and source, as returned by route_optimizer.calculate_route
+    """
+    (lon1, lat1), (lon2, lat2) = start_coords, end_coords
+    distance = _haversine(lat1, lon1, lat2, lon2) * ROAD_FACTOR
+    geometry = []
+    for i in range(ROUTE_POINTS + 1):
+        t = i / ROUTE_POINTS
+        bend = math.sin(t * math.pi) * 0.1  # Bow the line sideways by up to 10% of its length
+        geometry.append([
+            round(lat1 + (lat2 - lat1) * t - (lon2 - lon1) * bend, 6),
+            round(lon1 + (lon2 - lon1) * t + (lat2 - lat1) * bend, 6)
+        ])
+    return {
+        'distance': distance,
+        'duration': distance / SPEED_KMH * 60,
+        'geometry': geometry,
+        'source': 'Stub'
+    }
+
+
+class StubProviderServer:
+    """
+    Threaded stub provider server.
+
+    Args:
+        port: Port to listen on (0 picks a free port)
+        latency: Mean added response latency (seconds)
+        jitter: Latency varies uniformly by this fraction either way
+        failure_rate: Fraction of requests answered with HTTP 503
+        seed: Optional random seed for reproducible failures
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.05, jitter: float = 0.5,
+                 failure_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        """Serve in the calling thread until stop() or KeyboardInterrupt."""
+        self._server.serve_forever()
+
+    def start(self) -> 'StubProviderServer':
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-providers', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _delay_and_fail(self, endpoint: str) -> bool:
+        """Sleep for the configured latency; return True if this request should fail."""
+        with self._lock:
+            self.requests[endpoint] += 1
+            delay = self.latency * (1 + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.failure_rate
+        time.sleep(max(delay, 0))
+        return fail
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real providers
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path.startswith('/route/v1/'):
+                    self._answer('osrm-route', lambda: _osrm_route(_path_coords(path)))
+                elif path.startswith('/table/v1/'):
+                    self._answer('osrm-table', lambda: _osrm_table(_path_coords(path)))
+                else:
+                    self._send(404, {'error': 'Not found'})
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if path.startswith('/v2/directions/'):
+                    self._answer('ors-directions', lambda: _ors_directions(body['coordinates']))
+                elif path.startswith('/v2/matrix/'):
+                    self._answer('ors-matrix', lambda: _ors_matrix(body['locations']))
+                elif path.startswith('/v2/isochrones/'):
+                    self._answer('ors-isochrones', lambda: _ors_isochrones(body['locations'][0], body['range']))
+                else:
+                    self._send(404, {'error': 'Not found'})
+
+            def _answer(self, endpoint, build):
+                if stub._delay_and_fail(endpoint):
+                    self._send(503, {'error': 'Stub failure'})
+                else:
+                    self._send(200, build())
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _ors_directions(coordinates: List[List[float]]) -> Dict:
+    route = synthetic_route(coordinates[0], coordinates[-1])
+    return {'routes': [{
+        'summary': {'distance': route['distance'] * 1000, 'duration': route['duration'] * 60},
+        'geometry': {'type': 'LineString', 'coordinates': [[lon, lat] for lat, lon in route['geometry']]}
+    }]}
+
+
+def _osrm_route(coordinates: List[List[float]]) -> Dict:
+    route = synthetic_route(coordinates[0], coordinates[-1])
+    return {'code': 'Ok', 'routes': [{
+        'distance': route['distance'] * 1000,
+        'duration': route['duration'] * 60,
+        'geometry': {'type': 'LineString', 'coordinates': [[lon, lat] for lat, lon in route['geometry']]}
+    }]}
+
+
+def _ors_matrix(locations: List[List[float]]) -> Dict:
+    distances = [[synthetic_route(a, b)['distance'] for b in locations] for a in locations]
+    return {
+        'distances': distances,  # km, as requested with units=km
+        'durations': [[d / SPEED_KMH * 3600 for d in row] for row in distances]
+    }
+
+
+def _osrm_table(locations: List[List[float]]) -> Dict:
+    distances = [[synthetic_route(a, b)['distance'] * 1000 for b in locations] for a in locations]
+    return {
+        'code': 'Ok',
+        'distances': distances,
+        'durations': [[d / 1000 / SPEED_KMH * 3600 for d in row] for row in distances]
+    }
+
+
+def _ors_isochrones(center: List[float], ranges: List[int]) -> Dict:
+    lon, lat = center
+    features = []
+    for seconds in ranges:
+        radius_km = SPEED_KMH * seconds / 3600 / ROAD_FACTOR
+        ring = []
+        for i in range(33):
+            angle = 2 * math.pi * i / 32
+            ring.append([
+                lon + radius_km / (111.32 * math.cos(math.radians(lat))) * math.cos(angle),
+                lat + radius_km / 110.57 * math.sin(angle)
+            ])
+        features.append({
+            'type': 'Feature',
+            'properties': {'value': seconds, 'center': center},
+            'geometry': {'type': 'Polygon', 'coordinates': [ring]}
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def _path_coords(path: str) -> List[List[float]]:
+    """Coordinates from an OSRM path such as /route/v1/driving/lon,lat;lon,lat"""
+    return [[float(v) for v in pair.split(',')] for pair in path.rsplit('/', 1)[-1].split(';')]
+
+
+def _haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371 * math.asin(math.sqrt(a))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run stub ORS/OSRM servers')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.05, help='mean response latency (seconds)')
+    parser.add_argument('--jitter', type=float, default=0.5, help='latency jitter as a fraction of --latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    server = StubProviderServer(args.port, args.latency, args.jitter, args.failure_rate)
+    print(f"Stub providers listening on {server.url}")
+    print(f"  ORS_BASE_URL={server.url} OSRM_BASE_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,20 @@
+"""
+Build Route Matrix Script
+Precomputes the travel distance/duration matrix between the hospital and
+every campus location using one batched provider request
+"""
+
+import argparse
+
+from app import app
+import config
+import route_matrix
+
+parser = argparse.ArgumentParser(description='Precompute the hospital/campus route matrix')
+parser.add_argument('--geometry', action='store_true',
+                    help='also fetch road geometry for hospital legs missing from the route cache')
+args = parser.parse_args()
+
+with app.app_context():
+    count = route_matrix.build_matrix(config.ORS_API_KEY, with_geometry=args.geometry)
+    print(f"✓ Stored {count} matrix entries")
@@ -0,0 +1,58 @@
+"""
+Build Road Network Script
+Writes the offline routing network (config.ROAD_NETWORK_PATH) from the road
+geometries of stored trips, optionally merged with an OSM GeoJSON extract
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from app import app
+from models import db, AmbulanceTrip
+import config
+import road_graph
+
+parser = argparse.ArgumentParser(description='Build the offline road network used by the road graph routing tier')
+parser.add_argument('--merge', metavar='GEOJSON', action='append', default=[],
+                    help='road network GeoJSON (e.g. an OSM extract) to include; may be repeated')
+parser.add_argument('--output', default=config.ROAD_NETWORK_PATH, help='output path')
+args = parser.parse_args()
+
+
+def trip_routes():
+    """Stored trip geometries with their average speed, skipping straight-line estimates"""
+    query = AmbulanceTrip.query.options(db.undefer(AmbulanceTrip.route_polyline), db.undefer(AmbulanceTrip.route_geometry))
+    query = query.filter(AmbulanceTrip.has_final_route())
+    for trip in query.yield_per(500):
+        geometry = trip.geometry
+        if len(geometry) > 4:  # Haversine legs have two points each
+            speed = trip.distance_km / trip.duration_minutes * 60 if trip.duration_minutes else None
+            yield geometry, speed
+
+
+with app.app_context():
+    network = road_graph.network_from_routes(trip_routes())
+    print(f"✓ Collected {len(network['features'])} distinct trip routes")
+
+    for path in args.merge:
+        with open(path) as f:
+            features = json.load(f).get('features', [])
+        network['features'].extend(features)
+        print(f"✓ Merged {len(features)} features from {path}")
+
+    # Written to a temp file and renamed, so running workers never load a partial network
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(args.output)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(network, f)
+        os.replace(tmp_path, args.output)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    road_graph.invalidate()
+    graph = road_graph.load(args.output)
+    print(f"✓ Wrote {args.output} ({graph.node_count} nodes, {graph.edge_count} edges)")
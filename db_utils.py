@@ -0,0 +1,119 @@
+"""
+Database Utilities
+Engine setup for concurrent worker processes, and helpers shared by the
+incrementally maintained aggregate tables.
+
+SQLite databases run in WAL mode with a busy timeout, so readers never wait
+for the writer and concurrent writes queue for the (short) write lock
+instead of failing with "database is locked". Every engine gets a
+connection pool sized for threaded workers.
+"""
+
+from typing import Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+import config
+from models import db
+
+
+def engine_options(uri: str) -> Dict:
+    """
+    SQLAlchemy engine options for a database URI.
+
+    Args:
+        uri: Database URI (SQLite or PostgreSQL)
+
+    Returns:
+        Dict for Flask-SQLAlchemy's SQLALCHEMY_ENGINE_OPTIONS
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        options = {'connect_args': {'timeout': config.SQLITE_BUSY_TIMEOUT}}
+        if url.database in (None, '', ':memory:'):
+            return options  # In-memory databases share a single connection
+    else:
+        options = {'pool_pre_ping': True}
+    options.update(
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_recycle=config.DB_POOL_RECYCLE
+    )
+    return options
+
+
+def configure_engine(engine):
+    """Switch every new SQLite connection to WAL journaling (no-op for other databases)."""
+    if engine.dialect.name != 'sqlite' or not config.SQLITE_WAL:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        # Durable at every checkpoint; a power loss can only drop the last commits
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+
+def insert_missing(model, row: Dict, key_columns: List[str]):
+    """
+    Insert a row unless one with the same key exists, including one inserted
+    concurrently by another process. The caller commits.
+
+    Args:
+        model: Model class (must have a unique constraint on key_columns)
+        row: Column values
+        key_columns: Columns identifying the row
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        db.session.execute(insert(model).values(**row).on_conflict_do_nothing(index_elements=key_columns))
+        return
+
+    if model.query.filter_by(**{name: row[name] for name in key_columns}).first() is None:
+        db.session.add(model(**row))
+        db.session.flush()
+
+
+def upsert_add(model, rows: List[Dict], key_columns: List[str], add_columns: List[str]):
+    """
+    Insert rows, or add their values to existing rows with the same key,
+    within the current session. The caller commits.
+
+    Args:
+        model: Aggregate model class (must have a unique constraint on key_columns)
+        rows: Dicts with values for key_columns and add_columns
+        key_columns: Columns identifying an aggregate row
+        add_columns: Columns whose values are added on conflict
+    """
+    if not rows:
+        return
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        # One statement executed for all rows, so it is compiled once and cached
+        stmt = insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={name: getattr(model, name) + stmt.excluded[name] for name in add_columns}
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    for row in rows:
+        updated = model.query.filter_by(**{name: row[name] for name in key_columns}).update(
+            {name: getattr(model, name) + row[name] for name in add_columns},
+            synchronize_session=False
+        )
+        if not updated:
+            db.session.add(model(**row))
@@ -0,0 +1,343 @@
+"""
+Dispatch Optimizer
+Assigns pending pickup calls to ambulances using the travel-time matrix.
+
+Travel times come from the precomputed route matrix where both ends are
+(snapped to) known locations, and from a straight-line estimate otherwise,
+so a plan never waits on a routing provider. Each ambulance brings its
+patient back to the hospital before taking its next call.
+
+When there are no more calls than free ambulances, each call gets its own
+ambulance and the plan is an optimal assignment (Hungarian algorithm, or a
+bottleneck assignment when minimizing the longest response). With more
+calls than ambulances, ambulances are given queues of calls by regret
+insertion followed by relocate/swap local search. Both phases stop at
+config.DISPATCH_TIME_LIMIT (calls not yet placed by then are appended to the
+queue that reaches them first), so the plan can be recomputed on every new
+call.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import config
+import route_matrix
+import spatial_index
+
+logger = logging.getLogger(__name__)
+
+TOTAL = 'total'
+MAX = 'max'
+OBJECTIVES = (TOTAL, MAX)
+
+
+def travel_minutes(points: Sequence[Sequence[float]]) -> np.ndarray:
+    """
+    Travel times between every pair of points.
+    Must be called inside an application context.
+
+    Args:
+        points: List of [lat, lon] points
+
+    Returns:
+        Square array of durations in minutes: route matrix durations where
+        available, otherwise straight-line distance x DISPATCH_ROAD_FACTOR at
+        HAVERSINE_SPEED_KMH
+    """
+    estimate = (spatial_index.haversine_matrix(points, points) * config.DISPATCH_ROAD_FACTOR
+                / config.HAVERSINE_SPEED_KMH * 60)
+    durations = route_matrix.duration_matrix(points)
+    return np.where(np.isnan(durations), estimate, durations)
+
+
+def hungarian(cost: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Minimum-cost assignment of rows to columns (Hungarian algorithm with
+    potentials, O(n^2 m)).
+
+    Args:
+        cost: n x m cost array; the smaller dimension is fully assigned
+
+    Returns:
+        List of (row, column) pairs
+    """
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0:
+        return []
+    if cost.shape[0] > cost.shape[1]:
+        return [(row, column) for column, row in hungarian(cost.T)]
+
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    matched_row = np.zeros(m + 1, dtype=int)  # Column j (1-based) -> row (1-based), 0 if free
+    way = np.zeros(m + 1, dtype=int)
+
+    for i in range(1, n + 1):
+        matched_row[0] = i
+        j0 = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = matched_row[j0]
+            free = ~used[1:]
+            slack = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = j0
+            candidates = np.where(free, min_slack[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            u[matched_row[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+            j0 = j1
+            if matched_row[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            matched_row[j0] = matched_row[j1]
+            j0 = j1
+
+    return sorted((matched_row[j] - 1, j - 1) for j in range(1, m + 1) if matched_row[j])
+
+
+def bottleneck_assignment(cost: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Assignment minimizing the largest cost, then the total cost among the
+    assignments with that largest cost.
+
+    Args:
+        cost: n x m cost array; the smaller dimension is fully assigned
+
+    Returns:
+        List of (row, column) pairs
+    """
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0:
+        return []
+    size = min(cost.shape)
+    thresholds = np.unique(cost)
+
+    def within(threshold):
+        return sum(cost[r, c] <= threshold for r, c in hungarian((cost > threshold).astype(float))) == size
+
+    # Smallest threshold under which a complete assignment exists
+    low, high = 0, len(thresholds) - 1
+    while low < high:
+        middle = (low + high) // 2
+        if within(thresholds[middle]):
+            high = middle
+        else:
+            low = middle + 1
+
+    penalty = cost.sum() + 1
+    return hungarian(np.where(cost <= thresholds[low], cost, cost + penalty))
+
+
+def plan(vehicles: List[Dict], calls: List[Dict], now: Optional[datetime] = None,
+         objective: str = TOTAL) -> Dict:
+    """
+    Plan which ambulance answers which call.
+    Must be called inside an application context.
+
+    Args:
+        vehicles: Dicts with id, lat, lon (where the vehicle is, or will be
+            when free) and available_at (datetime, or None if free now)
+        calls: Dicts with id, pickup_lat, pickup_lon and received_at (datetime)
+        now: Planning time (defaults to the current local time)
+        objective: 'total' to minimize the sum of response times, 'max' to
+            minimize the longest response time
+
+    Returns:
+        Dict with objective, method ('assignment' or 'routing'), assignments
+        (one per planned call: call_id, vehicle_id, sequence in the vehicle's
+        queue, eta at the pickup, free_at back at the hospital and
+        response_minutes since the call was received),
+        unassigned call ids, total/max response minutes and solve_ms
+
+    Raises:
+        ValueError: If objective is unknown
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"objective must be one of {', '.join(OBJECTIVES)}")
+    started = time.perf_counter()
+    now = now or datetime.now()
+    result = {'objective': objective, 'method': None, 'assignments': [], 'unassigned': [],
+              'total_response_minutes': 0.0, 'max_response_minutes': 0.0}
+    if not vehicles or not calls:
+        result['unassigned'] = [call['id'] for call in calls]
+        result['solve_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    n_vehicles, n_calls = len(vehicles), len(calls)
+    points = ([[v['lat'], v['lon']] for v in vehicles]
+              + [[c['pickup_lat'], c['pickup_lon']] for c in calls]
+              + [config.HOSPITAL_COORDS])
+    travel = travel_minutes(points)
+    problem = {
+        'ready': np.array([max((v['available_at'] - now).total_seconds() / 60, 0) if v.get('available_at') else 0.0
+                           for v in vehicles]),
+        'waited': np.array([max((now - c['received_at']).total_seconds() / 60, 0) for c in calls]),
+        'to_call': travel[:n_vehicles, n_vehicles:n_vehicles + n_calls],  # vehicle -> pickup
+        'from_hospital': travel[-1, n_vehicles:n_vehicles + n_calls],  # hospital -> pickup
+        # Time from reaching a pickup until the vehicle is free again at the hospital
+        'turnaround': (config.DISPATCH_SCENE_MINUTES + travel[n_vehicles:n_vehicles + n_calls, -1]
+                       + config.DISPATCH_HANDOVER_MINUTES)
+    }
+
+    if n_calls <= n_vehicles:
+        result['method'] = 'assignment'
+        cost = problem['ready'][:, None] + problem['to_call'] + problem['waited'][None, :]
+        pairs = bottleneck_assignment(cost) if objective == MAX else hungarian(cost)
+        queues = [[] for _ in vehicles]
+        for vehicle, call in pairs:
+            queues[vehicle].append(call)
+    else:
+        result['method'] = 'routing'
+        queues = _route(problem, objective, started)
+
+    responses = []
+    for vehicle, queue in enumerate(queues):
+        for sequence, (call, arrival) in enumerate(zip(queue, _arrivals(problem, vehicle, queue))):
+            response = arrival + problem['waited'][call]
+            responses.append(response)
+            result['assignments'].append({
+                'call_id': calls[call]['id'],
+                'vehicle_id': vehicles[vehicle]['id'],
+                'sequence': sequence,
+                'eta': (now + timedelta(minutes=float(arrival))).isoformat(timespec='seconds'),
+                'free_at': (now + timedelta(minutes=float(arrival + problem['turnaround'][call]))
+                            ).isoformat(timespec='seconds'),
+                'response_minutes': round(float(response), 2)
+            })
+    result['assignments'].sort(key=lambda a: (a['sequence'], a['eta']))
+    if responses:
+        result['total_response_minutes'] = round(float(sum(responses)), 2)
+        result['max_response_minutes'] = round(float(max(responses)), 2)
+    result['solve_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def _arrivals(problem: Dict, vehicle: int, queue: List[int]) -> List[float]:
+    """Minutes from now until the vehicle reaches each call in its queue."""
+    arrivals = []
+    clock = problem['ready'][vehicle]
+    for position, call in enumerate(queue):
+        clock += problem['to_call'][vehicle, call] if position == 0 else problem['from_hospital'][call]
+        arrivals.append(clock)
+        clock += problem['turnaround'][call]
+    return arrivals
+
+
+def _queue_cost(problem: Dict, vehicle: int, queue: List[int]) -> Tuple[float, float]:
+    """(total, longest) response time of the calls in one vehicle's queue."""
+    responses = [arrival + problem['waited'][call]
+                 for call, arrival in zip(queue, _arrivals(problem, vehicle, queue))]
+    return float(sum(responses)), float(max(responses, default=0.0))
+
+
+def _score(costs: List[Tuple[float, float]], objective: str) -> Tuple[float, float]:
+    """Plan cost from per-vehicle costs: (total, longest), or (longest, total) for MAX."""
+    total = sum(cost[0] for cost in costs)
+    longest = max(cost[1] for cost in costs)
+    return (longest, total) if objective == MAX else (total, longest)
+
+
+def _route(problem: Dict, objective: str, started: float) -> List[List[int]]:
+    """
+    Queues of calls per vehicle: regret insertion, then relocate/swap local
+    search. Calls still unplaced when config.DISPATCH_TIME_LIMIT runs out are
+    appended to whichever queue reaches them first.
+    """
+    n_vehicles, n_calls = problem['to_call'].shape
+    deadline = started + config.DISPATCH_TIME_LIMIT
+    queues = [[] for _ in range(n_vehicles)]
+    costs = [(0.0, 0.0)] * n_vehicles
+    remaining = set(range(n_calls))
+
+    # Regret-2 insertion: place first the call that would lose most by not getting its best spot
+    while remaining and time.perf_counter() < deadline:
+        best = None
+        total = sum(cost[0] for cost in costs)
+        for call in sorted(remaining):
+            if best is not None and time.perf_counter() >= deadline:
+                break
+            options = []
+            for vehicle in range(n_vehicles):
+                others_longest = max((costs[other][1] for other in range(n_vehicles) if other != vehicle),
+                                     default=0.0)
+                for position in range(len(queues[vehicle]) + 1):
+                    queue = queues[vehicle][:position] + [call] + queues[vehicle][position:]
+                    cost = _queue_cost(problem, vehicle, queue)
+                    plan_total, plan_longest = total - costs[vehicle][0] + cost[0], max(others_longest, cost[1])
+                    score = (plan_longest, plan_total) if objective == MAX else (plan_total, plan_longest)
+                    options.append((score, vehicle, queue, cost))
+            options.sort(key=lambda option: option[0])
+            regret = options[1][0][0] - options[0][0][0] if len(options) > 1 else np.inf
+            if best is None or regret > best[0]:
+                best = (regret, call, options[0])
+        _, call, (_, vehicle, queue, cost) = best
+        queues[vehicle], costs[vehicle] = queue, cost
+        remaining.discard(call)
+
+    if remaining:
+        # Out of time: greedy append, longest-waiting calls first
+        logger.info(f"Dispatch time limit reached with {len(remaining)} call(s) left; placing them greedily")
+        free = [_arrivals(problem, vehicle, queue)[-1] + problem['turnaround'][queue[-1]] if queue
+                else problem['ready'][vehicle] for vehicle, queue in enumerate(queues)]
+        for call in sorted(remaining, key=lambda call: -problem['waited'][call]):
+            arrivals = [free[vehicle] + (problem['from_hospital'][call] if queues[vehicle]
+                                         else problem['to_call'][vehicle, call])
+                        for vehicle in range(n_vehicles)]
+            vehicle = int(np.argmin(arrivals))
+            queues[vehicle].append(call)
+            free[vehicle] = arrivals[vehicle] + problem['turnaround'][call]
+        costs = [_queue_cost(problem, vehicle, queue) for vehicle, queue in enumerate(queues)]
+
+    # First-improvement local search until no move helps or the time limit is reached
+    current = _score(costs, objective)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for changed in _moves(queues):
+            candidate = list(costs)
+            for vehicle, queue in changed.items():
+                candidate[vehicle] = _queue_cost(problem, vehicle, queue)
+            score = _score(candidate, objective)
+            if score < current:
+                for vehicle, queue in changed.items():
+                    queues[vehicle] = queue
+                costs, current, improved = candidate, score, True
+                break
+            if time.perf_counter() >= deadline:
+                break
+    return queues
+
+
+def _moves(queues: List[List[int]]):
+    """Relocate and swap moves, as {vehicle: new queue} for the vehicles they change."""
+    slots = [(vehicle, position) for vehicle, queue in enumerate(queues) for position in range(len(queue))]
+    for vehicle, position in slots:
+        call = queues[vehicle][position]
+        source = queues[vehicle][:position] + queues[vehicle][position + 1:]
+        for target in range(len(queues)):
+            base = source if target == vehicle else queues[target]
+            for target_position in range(len(base) + 1):
+                if target == vehicle and target_position == position:
+                    continue
+                queue = base[:target_position] + [call] + base[target_position:]
+                yield {vehicle: queue} if target == vehicle else {vehicle: source, target: queue}
+    for a, (vehicle_a, position_a) in enumerate(slots):
+        for vehicle_b, position_b in slots[a + 1:]:
+            if vehicle_a == vehicle_b:
+                continue
+            queue_a, queue_b = list(queues[vehicle_a]), list(queues[vehicle_b])
+            queue_a[position_a], queue_b[position_b] = queue_b[position_b], queue_a[position_a]
+            yield {vehicle_a: queue_a, vehicle_b: queue_b}
@@ -0,0 +1,195 @@
+"""
+Fleet
+Vehicles, their odometers and the pending-call queue behind the dispatch
+optimizer.
+
+Each vehicle chains its own odometer through its trips; trips without a
+vehicle keep the original single-ambulance chain. The current reading of
+each chain is kept in an odometer_state row that advance_odometer() moves
+forward with a single UPDATE, so concurrent submissions (from any number of
+worker processes) reserve consecutive, non-overlapping ranges while only
+locking that row until they commit. Vehicle position and
+available_at describe where and when it will next be free, and are moved
+forward as calls are assigned and trips are recorded.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+
+import config
+import db_utils
+import dispatch
+from models import db, AmbulanceTrip, DispatchCall, OdometerState, Vehicle
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+ASSIGNED = 'assigned'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+
+NO_VEHICLE = 0  # odometer_state chain of trips recorded without a vehicle
+
+
+def current_odometer(vehicle_id: Optional[int] = None) -> float:
+    """
+    Current odometer reading of a vehicle (the end reading of its last trip).
+
+    Args:
+        vehicle_id: Vehicle, or None for trips recorded without a vehicle
+
+    Returns:
+        Odometer reading (km); the vehicle's initial reading (or
+        config.INITIAL_ODOMETER) if it has no trips yet
+
+    Raises:
+        LookupError: If the vehicle does not exist
+    """
+    reading = db.session.query(OdometerState.reading).filter_by(chain=_chain(vehicle_id)).scalar()
+    if reading is not None:
+        return reading
+    return _last_trip_reading(vehicle_id)
+
+
+def advance_odometer(vehicle_id: Optional[int], distance: float) -> Tuple[float, float]:
+    """
+    Atomically move a vehicle's odometer forward within the current session.
+    The chain's state row stays locked until the caller commits (or rolls
+    back), so no other submission can reserve an overlapping range.
+
+    Args:
+        vehicle_id: Vehicle, or None for trips recorded without a vehicle
+        distance: Kilometres to add (0 just locks and reads the reading;
+            negative corrects an earlier overestimate)
+
+    Returns:
+        (start, end) readings of the reserved range
+
+    Raises:
+        LookupError: If the vehicle does not exist
+    """
+    chain = _chain(vehicle_id)
+    row = update(OdometerState).where(OdometerState.chain == chain).execution_options(synchronize_session=False)
+    for _ in range(2):
+        # Writing the row locks it (on SQLite, the database) until commit, so the
+        # reading cannot change between reading and advancing it
+        if db.session.execute(row.values(updated_at=datetime.utcnow())).rowcount:
+            start = db.session.query(OdometerState.reading).filter_by(chain=chain).scalar()
+            end = start + distance
+            db.session.execute(row.values(reading=end))
+            return start, end
+        # First trip of the chain since the state table was added: seed it from the trips
+        db_utils.insert_missing(OdometerState, {
+            'chain': chain,
+            'reading': _last_trip_reading(vehicle_id),
+            'updated_at': datetime.utcnow()
+        }, ['chain'])
+    raise RuntimeError(f"Odometer state for chain {chain} could not be created")
+
+
+def record_trip(trip: AmbulanceTrip, call_id: Optional[int] = None):
+    """
+    Update the vehicle and call served by a new trip within the current
+    session. The caller commits together with the trip.
+
+    Args:
+        trip: The new trip (flushed, so it has an id)
+        call_id: Optional dispatch call the trip served
+
+    Raises:
+        LookupError: If the call does not exist
+    """
+    if call_id is not None:
+        call = db.session.get(DispatchCall, call_id)
+        if call is None:
+            raise LookupError(f"Call {call_id} not found")
+        call.status = COMPLETED
+        call.trip_id = trip.id
+        call.vehicle_id = call.vehicle_id or trip.vehicle_id
+
+    if trip.vehicle_id is not None:
+        vehicle = db.session.get(Vehicle, trip.vehicle_id)
+        vehicle.lat, vehicle.lon = config.HOSPITAL_COORDS
+        if vehicle.available_at is None or trip.arrival_time > vehicle.available_at:
+            vehicle.available_at = trip.arrival_time
+
+
+def pending_calls() -> List[DispatchCall]:
+    """Calls waiting for an ambulance, oldest first."""
+    return DispatchCall.query.filter_by(status=PENDING).order_by(DispatchCall.received_at, DispatchCall.id).all()
+
+
+def plan(objective: Optional[str] = None, now: Optional[datetime] = None) -> Dict:
+    """
+    Plan the pending calls across the active vehicles (nothing is saved).
+
+    Args:
+        objective: 'total' or 'max' (defaults to config.DISPATCH_OBJECTIVE)
+        now: Planning time (defaults to the current local time)
+
+    Returns:
+        dispatch.plan() result
+
+    Raises:
+        ValueError: If objective is unknown
+    """
+    vehicles = [
+        {'id': v.id, 'lat': v.lat, 'lon': v.lon, 'available_at': v.available_at}
+        for v in Vehicle.query.filter_by(active=True).order_by(Vehicle.id)
+    ]
+    calls = [
+        {'id': c.id, 'pickup_lat': c.pickup_lat, 'pickup_lon': c.pickup_lon, 'received_at': c.received_at}
+        for c in pending_calls()
+    ]
+    return dispatch.plan(vehicles, calls, now, objective or config.DISPATCH_OBJECTIVE)
+
+
+def assign(objective: Optional[str] = None, now: Optional[datetime] = None) -> Dict:
+    """
+    Plan the pending calls and commit the first call in each vehicle's
+    queue; calls queued behind another are left pending and replanned on
+    the next call or assignment.
+
+    Returns:
+        The plan, with 'assigned' listing the committed call ids
+    """
+    result = plan(objective, now)
+    first = [a for a in result['assignments'] if a['sequence'] == 0]
+    for assignment in first:
+        call = db.session.get(DispatchCall, assignment['call_id'])
+        vehicle = db.session.get(Vehicle, assignment['vehicle_id'])
+        call.status = ASSIGNED
+        call.vehicle_id = vehicle.id
+        call.eta = datetime.fromisoformat(assignment['eta'])
+        # The vehicle is busy until it has brought the patient to the hospital
+        vehicle.lat, vehicle.lon = config.HOSPITAL_COORDS
+        vehicle.available_at = datetime.fromisoformat(assignment['free_at'])
+    db.session.commit()
+
+    result['assigned'] = [a['call_id'] for a in first]
+    logger.info(f"✓ Assigned {len(first)} call(s) ({result['method']}, {result['solve_ms']} ms)")
+    return result
+
+
+def _chain(vehicle_id: Optional[int]) -> int:
+    return NO_VEHICLE if vehicle_id is None else vehicle_id
+
+
+def _last_trip_reading(vehicle_id: Optional[int]) -> float:
+    """End reading of the chain's last trip, or its initial reading."""
+    vehicle = None
+    if vehicle_id is not None:
+        vehicle = db.session.get(Vehicle, vehicle_id)
+        if vehicle is None:
+            raise LookupError(f"Vehicle {vehicle_id} not found")
+
+    query = db.session.query(AmbulanceTrip.km_reading_end)
+    query = query.filter(AmbulanceTrip.vehicle_id == vehicle_id if vehicle_id is not None
+                         else AmbulanceTrip.vehicle_id.is_(None))
+    last_reading = query.order_by(AmbulanceTrip.id.desc()).limit(1).scalar()
+    if last_reading is not None:
+        return last_reading
+    return vehicle.initial_odometer if vehicle else config.INITIAL_ODOMETER
@@ -0,0 +1,99 @@
+"""
+Geometry Codec
+Encoded polyline (Google polyline algorithm) support for route geometries.
+
+Geometries are lists of [lat, lon] points. Encoding with 5 decimal places
+(~1 m) keeps route shape exact at map scale while storing each point in a
+few bytes of ASCII instead of ~40 bytes of JSON.
+"""
+
+import json
+from typing import List, Optional
+
+PRECISION = 5
+
+
+def encode_polyline(geometry: List[List[float]], precision: int = PRECISION) -> str:
+    """
+    Encode a geometry as a polyline string.
+
+    Args:
+        geometry: List of [lat, lon] points
+        precision: Decimal places kept
+
+    Returns:
+        Encoded polyline
+    """
+    factor = 10 ** precision
+    chunks = []
+    prev_lat = prev_lon = 0
+    for lat, lon in geometry:
+        lat_i = int(round(lat * factor))
+        lon_i = int(round(lon * factor))
+        _encode_value(lat_i - prev_lat, chunks)
+        _encode_value(lon_i - prev_lon, chunks)
+        prev_lat, prev_lon = lat_i, lon_i
+    return ''.join(chunks)
+
+
+def decode_polyline(encoded: str, precision: int = PRECISION) -> List[List[float]]:
+    """
+    Decode a polyline string into a geometry.
+
+    Args:
+        encoded: Encoded polyline
+        precision: Decimal places used when encoding
+
+    Returns:
+        List of [lat, lon] points
+    """
+    factor = 10 ** precision
+    geometry = []
+    index = lat = lon = 0
+    length = len(encoded)
+    while index < length:
+        delta, index = _decode_value(encoded, index)
+        lat += delta
+        delta, index = _decode_value(encoded, index)
+        lon += delta
+        geometry.append([lat / factor, lon / factor])
+    return geometry
+
+
+def decode_stored(route_polyline: Optional[str], route_geometry: Optional[str]) -> List[List[float]]:
+    """
+    Decode a trip geometry from whichever column holds it.
+
+    Args:
+        route_polyline: Encoded polyline column value
+        route_geometry: Legacy JSON column value
+
+    Returns:
+        List of [lat, lon] points (empty if neither is set)
+    """
+    if route_polyline:
+        return decode_polyline(route_polyline)
+    if route_geometry:
+        return json.loads(route_geometry)
+    return []
+
+
+def _encode_value(value: int, chunks: List[str]):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def _decode_value(encoded: str, index: int):
+    result = shift = 0
+    while True:
+        b = ord(encoded[index]) - 63
+        index += 1
+        result |= (b & 0x1f) << shift
+        shift += 5
+        if b < 0x20:
+            break
+    value = ~(result >> 1) if result & 1 else result >> 1
+    return value, index
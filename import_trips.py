@@ -0,0 +1,32 @@
+"""
+Import Trips Script
+Bulk imports historical trips from a CSV or JSONL file
+"""
+
+import argparse
+
+from app import app, calculate_import_routes
+import config
+import trip_import
+
+parser = argparse.ArgumentParser(description='Bulk import historical ambulance trips')
+parser.add_argument('path', help='CSV or JSONL file with one trip per row')
+parser.add_argument('--format', choices=['csv', 'jsonl'], help='file format (guessed from the extension by default)')
+parser.add_argument('--batch-size', type=int, default=config.IMPORT_BATCH_SIZE, help='trips inserted per commit')
+parser.add_argument('--start-odometer', type=float, help='odometer before the first imported trip')
+args = parser.parse_args()
+
+
+def report(summary):
+    print(f"  {summary['imported']} imported, {summary['skipped']} skipped, "
+          f"{summary['unique_routes']} unique routes, {summary['rows_per_second']} rows/s")
+
+
+with app.app_context(), open(args.path, encoding='utf-8-sig', newline='') as f:
+    records = trip_import.read_records(f, args.format or trip_import.detect_format(args.path))
+    summary = trip_import.import_trips(records, calculate_import_routes, batch_size=args.batch_size,
+                                       start_odometer=args.start_odometer, progress=report)
+
+    for error in summary['errors']:
+        print(f"  ✗ record {error['record']}: {error['error']}")
+    print(f"\n✓ Imported {summary['imported']} trips in {summary['elapsed']}s")
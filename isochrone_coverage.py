@@ -0,0 +1,211 @@
+"""
+Coverage Analysis
+Which campus locations and historical pickups lie inside the hospital's
+isochrone zones.
+
+Each stored isochrone polygon is prepared as a spatial_index.PolygonIndex
+and points are classified in batches by the smallest zone containing them.
+Results are kept in memory: campus locations are classified once per
+isochrone store, and historical pickups are aggregated by distinct point, so
+a later request only classifies trips added since the previous one. A new
+isochrone store (different ETag) triggers a full recompute.
+
+Uncovered pickups are grouped into config.COVERAGE_HOTSPOT_CELL grid cells
+and the busiest cells are reported as hotspots.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import func
+
+import config
+import isochrone_service
+import spatial_index
+from models import db, AmbulanceTrip
+
+logger = logging.getLogger(__name__)
+
+_state = None
+_lock = threading.Lock()
+
+
+def get_coverage(minutes: Optional[int] = None, hotspots: Optional[int] = None) -> Dict:
+    """
+    Coverage of campus locations and historical pickups by the isochrones.
+    Must be called inside an application context.
+
+    Args:
+        minutes: Zone a point must lie in to count as covered for the
+            uncovered lists and hotspots (defaults to the largest zone)
+        hotspots: Number of hotspots returned (defaults to config.COVERAGE_HOTSPOTS)
+
+    Returns:
+        Dict with zones, campus and pickup coverage per zone (count and
+        percent), uncovered campus locations, hotspots (uncovered grid cells
+        by trip count), version (changes whenever the result may change) and
+        isochrones_generated_at
+
+    Raises:
+        ValueError: If minutes is not one of the isochrone zones
+        Exception: If no isochrones are available
+    """
+    state = _refresh()
+    zones = state['zones']
+    minutes = zones[-1] if minutes is None else minutes
+    if minutes not in zones:
+        raise ValueError(f"minutes must be one of {', '.join(str(z) for z in zones)}")
+    hotspots = config.COVERAGE_HOTSPOTS if hotspots is None else hotspots
+
+    with _lock:
+        campus = state['campus']
+        pickup_trips = Counter(state['pickup_trips'])
+        cells = [(key, dict(cell, locations=Counter(cell['locations']))) for key, cell in state['cells'].items()]
+        points = len(state['points'])
+        last_trip_id = state['last_trip_id']
+
+    def covered(zone):
+        return zone is not None and zone <= minutes
+
+    uncovered_cells = defaultdict(lambda: {'trips': 0, 'lat_sum': 0.0, 'lon_sum': 0.0, 'locations': Counter()})
+    for (cell, zone), stats in cells:
+        if covered(zone):
+            continue
+        merged = uncovered_cells[cell]
+        merged['trips'] += stats['trips']
+        merged['lat_sum'] += stats['lat_sum']
+        merged['lon_sum'] += stats['lon_sum']
+        merged['locations'].update(stats['locations'])
+    busiest = sorted(uncovered_cells.values(), key=lambda c: c['trips'], reverse=True)[:hotspots]
+
+    total_trips = sum(pickup_trips.values())
+    return {
+        'zones': zones,
+        'minutes': minutes,
+        'campus': {
+            'total': len(campus),
+            'zones': _zone_summary(zones, Counter(location['minutes'] for location in campus), len(campus)),
+            'uncovered': [location['name'] for location in campus if not covered(location['minutes'])],
+            'locations': campus
+        },
+        'pickups': {
+            'trips': total_trips,
+            'points': points,
+            'zones': _zone_summary(zones, pickup_trips, total_trips)
+        },
+        'hotspots': [
+            {
+                'lat': round(cell['lat_sum'] / cell['trips'], 6),
+                'lon': round(cell['lon_sum'] / cell['trips'], 6),
+                'trips': cell['trips'],
+                'top_location': cell['locations'].most_common(1)[0][0]
+            }
+            for cell in busiest
+        ],
+        'version': hashlib.sha1(f"{state['etag']}:{last_trip_id}".encode()).hexdigest(),
+        'isochrones_generated_at': state['generated_at']
+    }
+
+
+def classify(points, polygons: List[spatial_index.PolygonIndex], zones: List[int]) -> List[Optional[int]]:
+    """
+    Smallest zone containing each point.
+
+    Args:
+        points: Points as [lat, lon]
+        polygons: Prepared polygons, one per zone
+        zones: Zone minutes, ascending
+
+    Returns:
+        Zone minutes per point, None for points outside every zone
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    result = np.full(len(points), -1)
+    # Largest zone first, so smaller zones overwrite it where they apply
+    for polygon, minutes in sorted(zip(polygons, zones), key=lambda pair: -pair[1]):
+        result[polygon.contains(points)] = minutes
+    return [int(minutes) if minutes >= 0 else None for minutes in result]
+
+
+def _refresh() -> Dict:
+    """Bring the cached state up to date with the isochrone store and new trips."""
+    global _state
+    store = isochrone_service.get_isochrones()
+    with _lock:
+        if _state is None or _state['etag'] != store['etag']:
+            _state = _build_state(store)
+        state = _state
+        last_trip_id = db.session.query(func.max(AmbulanceTrip.id)).scalar() or 0
+        if last_trip_id > state['last_trip_id']:
+            _add_pickups(state, state['last_trip_id'], last_trip_id)
+    return state
+
+
+def _build_state(store: Dict) -> Dict:
+    """Prepare polygons and classify the campus locations for an isochrone store."""
+    features = sorted(store['geojson']['features'], key=lambda f: f['properties']['seconds'])
+    zones = [round(feature['properties']['seconds'] / 60) for feature in features]
+    polygons = [spatial_index.PolygonIndex(_rings(feature['geometry'])) for feature in features]
+
+    names = list(config.CAMPUS_LOCATIONS)
+    campus_zones = classify([config.CAMPUS_LOCATIONS[name] for name in names], polygons, zones)
+    logger.info(f"✓ Coverage prepared for {len(zones)} isochrone zones")
+    return {
+        'etag': store['etag'],
+        'generated_at': store['generated_at'],
+        'zones': zones,
+        'polygons': polygons,
+        'campus': [{'name': name, 'minutes': zone} for name, zone in zip(names, campus_zones)],
+        'pickup_trips': Counter(),  # Zone minutes (None if outside) -> trips
+        'cells': {},  # (hotspot cell, zone minutes) -> trips, coordinate sums, pickup location names
+        'points': set(),  # Distinct (lat, lon) pickup points
+        'last_trip_id': 0
+    }
+
+
+def _add_pickups(state: Dict, after_id: int, up_to_id: int):
+    """Classify the pickups of trips with after_id < id <= up_to_id and add them to the state."""
+    rows = db.session.query(
+        AmbulanceTrip.pickup_lat, AmbulanceTrip.pickup_lon, AmbulanceTrip.pickup_location,
+        func.count(AmbulanceTrip.id)
+    ).filter(AmbulanceTrip.id > after_id, AmbulanceTrip.id <= up_to_id).group_by(
+        AmbulanceTrip.pickup_lat, AmbulanceTrip.pickup_lon, AmbulanceTrip.pickup_location
+    ).all()
+
+    zones = classify([[lat, lon] for lat, lon, _, _ in rows], state['polygons'], state['zones'])
+    cell_size = config.COVERAGE_HOTSPOT_CELL
+    for (lat, lon, name, trips), zone in zip(rows, zones):
+        state['pickup_trips'][zone] += trips
+        key = ((int(np.floor(lat / cell_size)), int(np.floor(lon / cell_size))), zone)
+        cell = state['cells'].setdefault(key, {'trips': 0, 'lat_sum': 0.0, 'lon_sum': 0.0, 'locations': Counter()})
+        cell['trips'] += trips
+        cell['lat_sum'] += lat * trips
+        cell['lon_sum'] += lon * trips
+        cell['locations'][name] += trips
+        state['points'].add((lat, lon))
+    state['last_trip_id'] = up_to_id
+
+
+def _rings(geometry: Dict) -> List:
+    if geometry['type'] == 'Polygon':
+        return geometry['coordinates']
+    if geometry['type'] == 'MultiPolygon':
+        return [ring for polygon in geometry['coordinates'] for ring in polygon]
+    raise ValueError(f"Unsupported isochrone geometry {geometry['type']}")
+
+
+def _zone_summary(zones: List[int], counts: Counter, total: int) -> Dict:
+    """Cumulative count and percent covered within each zone."""
+    summary = {}
+    covered = 0
+    for minutes in zones:
+        covered += counts.get(minutes, 0)
+        summary[str(minutes)] = {
+            'covered': covered,
+            'percent': round(covered / total * 100, 1) if total else 0.0
+        }
+    return summary
@@ -0,0 +1,143 @@
+"""
+Isochrone Service
+Precomputed hospital isochrones served from a local GeoJSON store.
+
+The hospital never moves, so the 3/5/7 minute zones are fetched with one
+multi-range ORS request, written to disk and served from memory. The store
+is refreshed in the background once it is older than
+config.ISOCHRONE_REFRESH_INTERVAL; if ORS is unreachable the last good
+polygons keep being served.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import config
+import route_optimizer
+
+logger = logging.getLogger(__name__)
+
+_store = None
+_store_lock = threading.Lock()
+_refresh_lock = threading.Lock()  # Held while a refresh is running, so only one ORS request is made
+
+
+def get_isochrones() -> Dict:
+    """
+    Return the stored isochrones, refreshing them if missing or stale.
+
+    Returns:
+        Dict with keys: geojson (FeatureCollection), isochrones (list of
+        {'minutes', 'geometry'} with geometry as [lat, lon] pairs),
+        etag and generated_at
+
+    Raises:
+        Exception: If no isochrones have ever been stored and ORS fails
+    """
+    store = _load()
+    if store is None:
+        with _refresh_lock:
+            # Another request may have fetched the store while this one waited
+            store = _load()
+            if store is None:
+                return refresh()
+
+    if time.time() - store['generated_at'] > config.ISOCHRONE_REFRESH_INTERVAL:
+        _refresh_in_background()
+    return store
+
+
+def refresh() -> Dict:
+    """
+    Fetch fresh isochrones from ORS and replace the store.
+
+    Returns:
+        The new store
+
+    Raises:
+        Exception: If the ORS request fails (the previous store is kept)
+    """
+    hospital_coords = [config.HOSPITAL_COORDS[1], config.HOSPITAL_COORDS[0]]
+    ranges = [minutes * 60 for minutes in config.ISOCHRONE_MINUTES]
+    geojson = route_optimizer.calculate_isochrones(hospital_coords, ranges, config.ORS_API_KEY)
+
+    store = _build_store(geojson, time.time())
+    store_dir = os.path.dirname(config.ISOCHRONE_STORE_PATH)
+    os.makedirs(store_dir, exist_ok=True)
+    # A unique temp file in the same directory, so os.replace is atomic and
+    # writers in other processes never move each other's file
+    fd, tmp_path = tempfile.mkstemp(dir=store_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'generated_at': store['generated_at'], 'geojson': geojson}, f)
+        os.replace(tmp_path, config.ISOCHRONE_STORE_PATH)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    global _store
+    with _store_lock:
+        _store = store
+    logger.info("✓ Isochrone store refreshed")
+    return store
+
+
+def _load() -> Optional[Dict]:
+    """Return the in-memory store, loading it from disk on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None and os.path.exists(config.ISOCHRONE_STORE_PATH):
+                try:
+                    with open(config.ISOCHRONE_STORE_PATH) as f:
+                        data = json.load(f)
+                    _store = _build_store(data['geojson'], data['generated_at'])
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"Could not read isochrone store: {e}")
+    return _store
+
+
+def _refresh_in_background():
+    """Refresh the store on a background thread unless a refresh is already running."""
+    if not _refresh_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            refresh()
+        except Exception as e:
+            logger.warning(f"Isochrone refresh failed: {e}. Serving last good isochrones.")
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=run, name='isochrone-refresh', daemon=True).start()
+
+
+def _build_store(geojson: Dict, generated_at: float) -> Dict:
+    payload = json.dumps(geojson, sort_keys=True).encode('utf-8')
+    return {
+        'geojson': geojson,
+        'isochrones': _to_isochrones(geojson),
+        'etag': hashlib.sha1(payload).hexdigest(),
+        'generated_at': generated_at
+    }
+
+
+def _to_isochrones(geojson: Dict) -> List[Dict]:
+    """Convert features to the {'minutes', 'geometry'} shape used by the frontend."""
+    isochrones = []
+    for feature in geojson['features']:
+        # Convert coordinates from lon,lat to lat,lon
+        ring = feature['geometry']['coordinates'][0]
+        isochrones.append({
+            'minutes': round(feature['properties']['seconds'] / 60),
+            'geometry': [[coord[1], coord[0]] for coord in ring]
+        })
+    return isochrones
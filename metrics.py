@@ -0,0 +1,393 @@
+"""
+Metrics
+In-process counters and histograms exposed in the Prometheus text format.
+
+Modules record into the metrics defined here (provider latency, routing
+fallbacks, HTTP requests, DB queries); owners of existing counters such as
+the route cache register callback metrics that are read at scrape time.
+init_app() adds the request timing middleware, DB query tracking and the
+optional per-request profiler.
+
+With several worker processes (serve.py), each worker also writes its
+values to its own file in a shared directory every
+config.METRICS_FLUSH_INTERVAL seconds, and a scrape answered by any worker
+merges all files: counters and histograms are summed (including those of
+workers that have exited, so they never go backwards) and callback gauges
+of live workers get a worker label.
+"""
+
+import atexit
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from flask import g, has_request_context, request, Response
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+_registry_lock = threading.Lock()
+_multiprocess_dir = None
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, Dict, float]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count per label set."""
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    """Cumulative bucketed observations (e.g. latencies in seconds) per label set."""
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        return _histogram_samples(self.name, self.labelnames, self.buckets, values)
+
+
+class CallbackMetric(_Metric):
+    """
+    Metric whose samples are read from a callback at scrape time.
+
+    Args:
+        collect: Returns (labels dict, value) pairs
+        metric_type: 'gauge' or 'counter'
+    """
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], Iterable[Tuple[Dict, float]]],
+                 metric_type: str = 'gauge', labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.type = metric_type
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name, labels, value
+
+
+# Routing providers
+PROVIDER_REQUESTS = Counter('ambulance_provider_requests_total',
+                            'HTTP requests sent to routing providers', ['provider', 'outcome'])
+PROVIDER_LATENCY = Histogram('ambulance_provider_request_duration_seconds',
+                             'Routing provider HTTP request latency', ['provider'])
+ROUTING_FALLBACKS = Counter('ambulance_routing_fallbacks_total',
+                            'Routing tiers that failed and fell back to the next tier', ['tier'])
+ROUTES_CALCULATED = Counter('ambulance_routes_calculated_total',
+                            'Routes calculated by route_optimizer, by the tier that answered', ['source'])
+ROUTE_MATRIX_LOOKUPS = Counter('ambulance_route_matrix_lookups_total',
+                               'Route matrix lookups', ['result'])
+
+# HTTP endpoints
+HTTP_REQUESTS = Counter('ambulance_http_requests_total',
+                        'HTTP requests handled', ['method', 'endpoint', 'status'])
+HTTP_LATENCY = Histogram('ambulance_http_request_duration_seconds',
+                         'Time to produce an HTTP response (streamed bodies excluded)', ['method', 'endpoint'])
+RESPONSE_CACHE_LOOKUPS = Counter('ambulance_response_cache_lookups_total',
+                                 'Lookups in the in-process response cache', ['result'])
+
+# Database
+DB_QUERIES = Counter('ambulance_db_queries_total', 'SQL statements executed', ['operation'])
+DB_LATENCY = Histogram('ambulance_db_query_duration_seconds', 'SQL statement execution time', ['operation'],
+                       buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+DB_QUERIES_PER_REQUEST = Histogram('ambulance_db_queries_per_request', 'SQL statements executed per HTTP request',
+                                   ['endpoint'], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500))
+
+
+def render() -> str:
+    """All registered metrics (of every worker process, if shared) in the Prometheus text format."""
+    if _multiprocess_dir:
+        families = _merged_families()
+    else:
+        with _registry_lock:
+            metrics = list(_registry)
+        families = []
+        for metric in metrics:
+            try:
+                families.append((metric.name, metric.documentation, metric.type, list(metric.samples())))
+            except Exception as e:
+                logger.warning(f"Collecting {metric.name} failed: {e}")
+
+    lines = []
+    for name, documentation, metric_type, samples in families:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for sample_name, labels, value in samples:
+            lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def enable_multiprocess(directory: str, flush_interval: float):
+    """
+    Share this process's metrics with the other worker processes through
+    directory (which the server clears before starting its workers).
+
+    Args:
+        directory: Directory holding one <pid>.json snapshot per worker
+        flush_interval: Seconds between snapshot writes
+    """
+    global _multiprocess_dir
+    os.makedirs(directory, exist_ok=True)
+    _multiprocess_dir = directory
+    _write_snapshot()
+    atexit.register(_write_snapshot)
+
+    def flush():
+        while True:
+            time.sleep(flush_interval)
+            try:
+                _write_snapshot()
+            except Exception as e:
+                logger.warning(f"Writing metrics snapshot failed: {e}")
+
+    threading.Thread(target=flush, name='metrics-flush', daemon=True).start()
+
+
+def init_app(app, engine, profiling: bool = False):
+    """
+    Install request timing, per-request DB query counts and, if enabled,
+    the ?profile=1 request profiler.
+
+    Args:
+        app: Flask application
+        engine: SQLAlchemy engine whose statements are counted
+        profiling: Allow requests with ?profile=1 to return a cProfile report
+    """
+    instrument_engine(engine)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        g.db_queries = 0
+        g.db_time = 0.0
+        if profiling and request.args.get('profile') == '1':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                g.profiler = profiler
+            except ValueError:
+                logger.warning("Another request is being profiled, skipping")
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+
+        HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+        HTTP_LATENCY.observe(elapsed, method=request.method, endpoint=endpoint)
+        DB_QUERIES_PER_REQUEST.observe(g.db_queries, endpoint=endpoint)
+        response.headers.add('Server-Timing', f'db;dur={g.db_time * 1000:.1f};desc="{g.db_queries} queries"')
+        response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.1f}')
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            return _profile_response(profiler, elapsed, g.db_queries)
+        return response
+
+
+def instrument_engine(engine):
+    """Count and time every SQL statement executed through engine."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['metrics_started'].pop()
+        elapsed = time.perf_counter() - started
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+        DB_QUERIES.inc(operation=operation)
+        DB_LATENCY.observe(elapsed, operation=operation)
+        if has_request_context():
+            g.db_queries = g.get('db_queries', 0) + 1
+            g.db_time = g.get('db_time', 0.0) + elapsed
+
+
+def _write_snapshot():
+    """Write this process's metric values to <pid>.json in the shared directory."""
+    with _registry_lock:
+        metrics = list(_registry)
+    snapshot = {}
+    for metric in metrics:
+        family = {'documentation': metric.documentation, 'type': metric.type,
+                  'labelnames': list(metric.labelnames)}
+        if isinstance(metric, (Counter, Histogram)):
+            with metric._lock:
+                family['values'] = [[list(key), value] for key, value in metric._values.items()]
+            if isinstance(metric, Histogram):
+                family['buckets'] = list(metric.buckets)
+        else:
+            try:
+                family['samples'] = list(metric.samples())
+            except Exception as e:
+                logger.warning(f"Collecting {metric.name} failed: {e}")
+                continue
+        snapshot[metric.name] = family
+
+    fd, tmp_path = tempfile.mkstemp(dir=_multiprocess_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, os.path.join(_multiprocess_dir, f"{os.getpid()}.json"))
+
+
+def _merged_families() -> List[Tuple[str, str, str, List]]:
+    """Metric families of every snapshot: counters and histograms summed, gauges labelled by worker."""
+    _write_snapshot()
+    merged = {}
+    for filename in sorted(os.listdir(_multiprocess_dir)):
+        if not filename.endswith('.json'):
+            continue
+        pid = filename[:-len('.json')]
+        try:
+            with open(os.path.join(_multiprocess_dir, filename)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read metrics snapshot {filename}: {e}")
+            continue
+        alive = pid.isdigit() and _is_alive(int(pid))
+
+        for name, family in snapshot.items():
+            target = merged.setdefault(name, {
+                'documentation': family['documentation'], 'type': family['type'],
+                'labelnames': family['labelnames'], 'buckets': family.get('buckets'),
+                'values': {},  # Counter/Histogram label values -> summed value or counts
+                'summed': {},  # Callback counter (sample name, labels) -> summed value
+                'samples': []  # Callback gauge samples of live workers
+            })
+            if 'values' in family:
+                for key, value in family['values']:
+                    key = tuple(key)
+                    if target['buckets'] is not None:
+                        previous = target['values'].get(key, [0] * len(value))
+                        target['values'][key] = [a + b for a, b in zip(previous, value)]
+                    else:
+                        target['values'][key] = target['values'].get(key, 0) + value
+            elif family['type'] == 'counter':
+                for sample_name, labels, value in family['samples']:
+                    key = (sample_name, tuple(sorted(labels.items())))
+                    target['summed'][key] = target['summed'].get(key, 0) + value
+            elif alive:
+                target['samples'] += [(sample_name, dict(labels, worker=pid), value)
+                                      for sample_name, labels, value in family['samples']]
+
+    families = []
+    for name, family in merged.items():
+        if family['buckets'] is not None:
+            samples = list(_histogram_samples(name, family['labelnames'], family['buckets'], family['values']))
+        else:
+            samples = ([(name, dict(zip(family['labelnames'], key)), value)
+                        for key, value in family['values'].items()]
+                       + [(sample_name, dict(labels), value)
+                          for (sample_name, labels), value in family['summed'].items()]
+                       + family['samples'])
+        families.append((name, family['documentation'], family['type'], samples))
+    return families
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _histogram_samples(name: str, labelnames: Sequence[str], buckets: Sequence[float], values: Dict):
+    for key, counts in values.items():
+        labels = dict(zip(labelnames, key))
+        for bound, count in zip(buckets, counts):
+            yield f"{name}_bucket", dict(labels, le=_format_value(bound)), count
+        yield f"{name}_bucket", dict(labels, le='+Inf'), counts[-2]
+        yield f"{name}_count", labels, counts[-2]
+        yield f"{name}_sum", labels, counts[-1]
+
+
+def _profile_response(profiler: cProfile.Profile, elapsed: float, db_queries: int) -> Response:
+    """Replace the response with the top of the request's cProfile report."""
+    output = io.StringIO()
+    output.write(f"{request.method} {request.full_path}: {elapsed * 1000:.1f} ms, {db_queries} DB queries\n\n")
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(40)
+    return Response(output.getvalue(), mimetype='text/plain')
+
+
+def _format_labels(labels: Dict) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value) if isinstance(value, int) else repr(float(value))
@@ -0,0 +1,21 @@
+"""
+Migrate Database Script
+Upgrades an existing ambulance database in place: adds new columns and
+converts existing rows to the current storage formats
+"""
+
+from app import app
+import migrations
+
+with app.app_context():
+    migrations.ensure_schema()
+    print("✓ Schema is up to date")
+
+    converted = migrations.migrate_trip_datetimes()
+    print(f"✓ Converted {converted} trips to typed date/time columns")
+
+    converted = migrations.migrate_route_geometry()
+    print(f"✓ Re-encoded {converted} route geometries as polylines")
+
+    migrations.compact()
+    print("\nDatabase migrated successfully!")
@@ -0,0 +1,180 @@
+"""
+Database Migrations
+Lightweight in-place upgrades for existing ambulance.db files.
+
+ensure_schema() runs at app startup and adds columns and indexes that
+newer models define but older databases lack (db.create_all only creates
+missing tables), and migrate_trip_datetimes() converts the legacy string
+date/time columns the typed model can no longer read. Slower data
+migrations rewrite existing rows and are run with `python migrate_db.py`.
+startup_lock() serializes this startup work when several worker processes
+start together.
+"""
+
+import json
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, text
+
+from models import db, AmbulanceTrip
+import config
+import geometry_codec
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the single-process development server is supported
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def startup_lock():
+    """
+    Hold an exclusive lock on instance/startup.lock, so worker processes on
+    this host create tables, migrate and rebuild aggregates one at a time
+    (later workers then find nothing left to do).
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(config.INSTANCE_DIR, exist_ok=True)
+    with open(os.path.join(config.INSTANCE_DIR, 'startup.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def ensure_schema():
+    """Add any nullable model columns missing from existing tables."""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    logger.warning(f"Cannot add NOT NULL column {table.name}.{column.name} automatically")
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info(f"✓ Added column {table.name}.{column.name}")
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                logger.info(f"✓ Created index {index.name}")
+
+
+def migrate_trip_datetimes(batch_size: int = 500) -> int:
+    """
+    Convert legacy string trip times to the typed storage format (SQLite only).
+
+    Older databases stored time as 'HH:MM' and departure/arrival as
+    'HH:MM:SS' strings. They are rewritten as full time and datetime values;
+    an arrival earlier than its departure is taken to be on the next day.
+
+    Returns:
+        Number of trips converted
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return 0
+
+    converted = 0
+    with db.engine.begin() as conn:
+        rows = conn.execute(text(
+            "SELECT id, date, time, departure_time, arrival_time FROM ambulance_trips "
+            "WHERE length(departure_time) <= 8 OR length(time) <= 5"
+        )).fetchall()
+
+        updates = []
+        for trip_id, date, time, departure, arrival in rows:
+            time = time if len(time) > 5 else f"{time}:00"
+            departure_at = _legacy_datetime(date, departure)
+            arrival_at = _legacy_datetime(date, arrival)
+            if arrival_at < departure_at:
+                arrival_at += timedelta(days=1)
+            updates.append({
+                'id': trip_id,
+                'time': f"{time[:8]}.000000" if len(time) <= 8 else time,
+                'departure_time': departure_at.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                'arrival_time': arrival_at.strftime('%Y-%m-%d %H:%M:%S.%f')
+            })
+
+        for i in range(0, len(updates), batch_size):
+            conn.execute(text(
+                "UPDATE ambulance_trips SET time = :time, departure_time = :departure_time, "
+                "arrival_time = :arrival_time WHERE id = :id"
+            ), updates[i:i + batch_size])
+        converted = len(updates)
+
+    if converted:
+        logger.info(f"✓ Converted {converted} trips to typed date/time columns")
+    return converted
+
+
+def _legacy_datetime(date: str, value: str) -> datetime:
+    if len(value) > 8:
+        return datetime.fromisoformat(value)
+    return datetime.strptime(f"{date} {value}", '%Y-%m-%d %H:%M:%S')
+
+
+def migrate_route_geometry(batch_size: int = 500) -> int:
+    """
+    Re-encode legacy JSON route geometries as polylines and clear the JSON column.
+
+    Args:
+        batch_size: Rows converted per commit
+
+    Returns:
+        Number of trips converted
+    """
+    converted = 0
+    while True:
+        rows = db.session.query(AmbulanceTrip.id, AmbulanceTrip.route_geometry).filter(
+            AmbulanceTrip.route_geometry.isnot(None)
+        ).limit(batch_size).all()
+        if not rows:
+            break
+
+        db.session.bulk_update_mappings(AmbulanceTrip, [
+            {
+                'id': trip_id,
+                'route_polyline': geometry_codec.encode_polyline(json.loads(route_geometry)),
+                'route_geometry': None
+            }
+            for trip_id, route_geometry in rows
+        ])
+        db.session.commit()
+        converted += len(rows)
+
+    if converted:
+        logger.info(f"✓ Re-encoded {converted} route geometries")
+    return converted
+
+
+def compact():
+    """Reclaim space freed by data migrations (SQLite only)."""
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+
+
+def run_data_migrations():
+    """Run every data migration, then compact the database."""
+    migrate_route_geometry()
+    compact()
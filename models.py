@@ -1,14 +1,27 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import json
+
+import geometry_codec
 
 db = SQLAlchemy()
 
 class AmbulanceTrip(db.Model):
     __tablename__ = 'ambulance_trips'
+    __table_args__ = (
+        db.Index('ix_ambulance_trips_date_time', 'date', 'time'),
+        db.Index('ix_ambulance_trips_driver_date', 'driver_name', 'date'),
+        db.Index('ix_ambulance_trips_pickup_date', 'pickup_location', 'date'),
+        db.Index('ix_ambulance_trips_purpose_date', 'purpose', 'date'),
+        db.Index('ix_ambulance_trips_departure_time', 'departure_time'),
+        db.Index('ix_ambulance_trips_created_at', 'created_at'),
+        db.Index('ix_ambulance_trips_route_status', 'route_status'),
+        db.Index('ix_ambulance_trips_vehicle_id', 'vehicle_id', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.String(20), nullable=False)
-    time = db.Column(db.String(20), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    time = db.Column(db.Time, nullable=False)
     km_reading_start = db.Column(db.Float, nullable=False)
     km_reading_end = db.Column(db.Float, nullable=False)
     pickup_location = db.Column(db.String(100), nullable=False)
@@ -20,29 +33,261 @@ class AmbulanceTrip(db.Model):
     notes = db.Column(db.Text)
     distance_km = db.Column(db.Float, nullable=False)
     duration_minutes = db.Column(db.Float, nullable=False)
-    departure_time = db.Column(db.String(20), nullable=False)
-    arrival_time = db.Column(db.String(20), nullable=False)
-    route_geometry = db.Column(db.Text)  # Store route as JSON
+    departure_time = db.Column(db.DateTime, nullable=False)
+    arrival_time = db.Column(db.DateTime, nullable=False)
+    # Route columns are deferred: they are only loaded when accessed
+    route_geometry = db.deferred(db.Column(db.Text), group='route')  # Legacy route as JSON, superseded by route_polyline
+    route_polyline = db.deferred(db.Column(db.Text), group='route')  # Route as encoded polyline
+    route_status = db.Column(db.String(20))  # 'pending' while routed in the background, else 'complete'/'failed'
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'))  # None for the original single ambulance
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    @property
+    def geometry(self):
+        """Route as a list of [lat, lon] points, decoded on first access"""
+        cached = self.__dict__.get('_decoded_geometry')
+        if cached is None:
+            cached = geometry_codec.decode_stored(self.route_polyline, self.route_geometry)
+            self.__dict__['_decoded_geometry'] = cached
+        return cached
+    
+    @geometry.setter
+    def geometry(self, points):
+        self.route_polyline = geometry_codec.encode_polyline(points) if points else None
+        self.route_geometry = None
+        self.__dict__['_decoded_geometry'] = list(points) if points else []
+    
+    @property
+    def encoded_geometry(self):
+        """Route as an encoded polyline, without decoding"""
+        if self.route_polyline:
+            return self.route_polyline
+        return geometry_codec.encode_polyline(self.geometry) if self.route_geometry else None
+    
+    def to_dict(self, geometry_format='json', fields=None):
+        """
+        Serialize the trip.
+        
+        Args:
+            geometry_format: 'json' for the route as a JSON string of [lat, lon]
+                pairs, 'polyline' for the encoded polyline, None to omit it
+            fields: Optional list of keys from TRIP_FIELDS to include; only the
+                columns those fields need are read, so deferred columns stay unloaded
+        """
+        data = {name: TRIP_FIELDS[name][1](self) for name in (fields or TRIP_FIELDS)}
+        if geometry_format == 'json':
+            data['route_geometry'] = json.dumps(self.geometry) if (self.route_polyline or self.route_geometry) else None
+        elif geometry_format == 'polyline':
+            data['route_polyline'] = self.encoded_geometry
+        return data
+    
+    @staticmethod
+    def columns_for(fields):
+        """Model attributes needed to serialize the given fields"""
+        names = {'id'}
+        for name in fields:
+            names.update(TRIP_FIELDS[name][0])
+        return [getattr(AmbulanceTrip, name) for name in sorted(names)]
+    
+    @staticmethod
+    def has_final_route():
+        """Filter excluding trips that still hold a provisional route (pending or failed background routing)"""
+        return db.or_(AmbulanceTrip.route_status.is_(None), AmbulanceTrip.route_status == 'complete')
+
+
+# Serializable trip fields: key -> (columns read, serializer)
+TRIP_FIELDS = {
+    'id': (['id'], lambda t: t.id),
+    'date': (['date'], lambda t: t.date.isoformat()),
+    'time': (['time'], lambda t: t.time.strftime('%H:%M')),
+    'km_reading_start': (['km_reading_start'], lambda t: t.km_reading_start),
+    'km_reading_end': (['km_reading_end'], lambda t: t.km_reading_end),
+    'pickup_location': (['pickup_location'], lambda t: t.pickup_location),
+    'pickup_lat': (['pickup_lat'], lambda t: t.pickup_lat),
+    'pickup_lon': (['pickup_lon'], lambda t: t.pickup_lon),
+    'patient_name': (['patient_name'], lambda t: t.patient_name),
+    'driver_name': (['driver_name'], lambda t: t.driver_name),
+    'purpose': (['purpose'], lambda t: t.purpose),
+    'notes': (['notes'], lambda t: t.notes),
+    'distance_km': (['distance_km'], lambda t: t.distance_km),
+    'duration_minutes': (['duration_minutes'], lambda t: t.duration_minutes),
+    'departure_time': (['departure_time'], lambda t: t.departure_time.strftime('%H:%M:%S')),
+    'arrival_time': (['arrival_time'], lambda t: t.arrival_time.strftime('%H:%M:%S')),
+    'departure_at': (['departure_time'], lambda t: t.departure_time.isoformat()),
+    'arrival_at': (['arrival_time'], lambda t: t.arrival_time.isoformat()),
+    'route_status': (['route_status'], lambda t: t.route_status or 'complete'),
+    'vehicle_id': (['vehicle_id'], lambda t: t.vehicle_id),
+    'created_at': (['created_at'], lambda t: t.created_at.isoformat() if t.created_at else None),
+}
+
+
+class Vehicle(db.Model):
+    """An ambulance in the fleet, with its own odometer chain and dispatch state"""
+    __tablename__ = 'vehicles'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+    initial_odometer = db.Column(db.Float, nullable=False, default=0)
+    active = db.Column(db.Boolean, nullable=False, default=True)  # False while out of service
+    lat = db.Column(db.Float, nullable=False)  # Where the vehicle will be when next available
+    lon = db.Column(db.Float, nullable=False)
+    available_at = db.Column(db.DateTime)  # None when available now
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'initial_odometer': self.initial_odometer,
+            'active': self.active,
+            'lat': self.lat,
+            'lon': self.lon,
+            'available_at': self.available_at.isoformat() if self.available_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class OdometerState(db.Model):
+    """Current odometer reading of each chain, advanced atomically as trips are recorded"""
+    __tablename__ = 'odometer_state'
+
+    chain = db.Column(db.Integer, primary_key=True)  # Vehicle id, 0 for trips without a vehicle
+    reading = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DispatchCall(db.Model):
+    """A pickup request waiting for, or assigned to, an ambulance"""
+    __tablename__ = 'dispatch_calls'
+    __table_args__ = (
+        db.Index('ix_dispatch_calls_status', 'status', 'received_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    pickup_location = db.Column(db.String(100), nullable=False)
+    pickup_lat = db.Column(db.Float, nullable=False)
+    pickup_lon = db.Column(db.Float, nullable=False)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.now)  # Local time, like trip times
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, assigned, completed, cancelled
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'))
+    eta = db.Column(db.DateTime)  # Estimated arrival at the pickup, set when assigned
+    trip_id = db.Column(db.Integer, db.ForeignKey('ambulance_trips.id'))  # Trip that served the call
+
     def to_dict(self):
         return {
             'id': self.id,
-            'date': self.date,
-            'time': self.time,
-            'km_reading_start': self.km_reading_start,
-            'km_reading_end': self.km_reading_end,
             'pickup_location': self.pickup_location,
             'pickup_lat': self.pickup_lat,
             'pickup_lon': self.pickup_lon,
-            'patient_name': self.patient_name,
-            'driver_name': self.driver_name,
-            'purpose': self.purpose,
-            'notes': self.notes,
+            'received_at': self.received_at.isoformat(),
+            'status': self.status,
+            'vehicle_id': self.vehicle_id,
+            'eta': self.eta.isoformat() if self.eta else None,
+            'trip_id': self.trip_id
+        }
+
+
+class RouteMatrixEntry(db.Model):
+    """Precomputed travel distance/duration between two known locations"""
+    __tablename__ = 'route_matrix'
+
+    id = db.Column(db.Integer, primary_key=True)
+    origin_name = db.Column(db.String(100), nullable=False)
+    origin_lat = db.Column(db.Float, nullable=False)
+    origin_lon = db.Column(db.Float, nullable=False)
+    destination_name = db.Column(db.String(100), nullable=False)
+    destination_lat = db.Column(db.Float, nullable=False)
+    destination_lon = db.Column(db.Float, nullable=False)
+    distance_km = db.Column(db.Float, nullable=False)
+    duration_minutes = db.Column(db.Float, nullable=False)
+    route_geometry = db.Column(db.Text)  # Optional road geometry as JSON
+    source = db.Column(db.String(50), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'origin_name': self.origin_name,
+            'origin_lat': self.origin_lat,
+            'origin_lon': self.origin_lon,
+            'destination_name': self.destination_name,
+            'destination_lat': self.destination_lat,
+            'destination_lon': self.destination_lon,
             'distance_km': self.distance_km,
             'duration_minutes': self.duration_minutes,
-            'departure_time': self.departure_time,
-            'arrival_time': self.arrival_time,
-            'route_geometry': self.route_geometry,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'source': self.source,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
+
+
+class RouteSegmentCount(db.Model):
+    """Number of times a rounded route segment was driven on a given date"""
+    __tablename__ = 'route_segment_counts'
+    __table_args__ = (
+        db.UniqueConstraint('date', 'lat1', 'lon1', 'lat2', 'lon2', name='uq_route_segment_counts_segment'),
+        # Covers bbox/tile queries, so they never read the table itself
+        db.Index('ix_route_segment_counts_tile', 'lat1', 'lon1', 'lat2', 'lon2', 'date', 'count'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.String(20), nullable=False)
+    lat1 = db.Column(db.Float, nullable=False)
+    lon1 = db.Column(db.Float, nullable=False)
+    lat2 = db.Column(db.Float, nullable=False)
+    lon2 = db.Column(db.Float, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RouteSegmentLevelCount(db.Model):
+    """Route segment counts on the coarser grid of one route frequency tile level"""
+    __tablename__ = 'route_segment_level_counts'
+    __table_args__ = (
+        db.UniqueConstraint('level', 'date', 'lat1', 'lon1', 'lat2', 'lon2',
+                            name='uq_route_segment_level_counts_segment'),
+        db.Index('ix_route_segment_level_counts_tile', 'level', 'lat1', 'lon1', 'lat2', 'lon2', 'date', 'count'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    level = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.String(20), nullable=False)
+    lat1 = db.Column(db.Float, nullable=False)
+    lon1 = db.Column(db.Float, nullable=False)
+    lat2 = db.Column(db.Float, nullable=False)
+    lon2 = db.Column(db.Float, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TripDailyStats(db.Model):
+    """Per-date trip totals, updated as trips are submitted"""
+    __tablename__ = 'trip_daily_stats'
+
+    date = db.Column(db.String(20), primary_key=True)
+    trip_count = db.Column(db.Integer, nullable=False, default=0)
+    total_distance_km = db.Column(db.Float, nullable=False, default=0)
+    total_duration_minutes = db.Column(db.Float, nullable=False, default=0)
+
+
+class TripHourlyStats(db.Model):
+    """Per-date, per-hour trip counts"""
+    __tablename__ = 'trip_hourly_stats'
+
+    date = db.Column(db.String(20), primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True)
+    trip_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TripLocationStats(db.Model):
+    """Per-date, per-pickup-location trip counts"""
+    __tablename__ = 'trip_location_stats'
+
+    date = db.Column(db.String(20), primary_key=True)
+    pickup_location = db.Column(db.String(100), primary_key=True)
+    trip_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DataVersion(db.Model):
+    """Change counter per cached data scope, shared by all worker processes"""
+    __tablename__ = 'data_versions'
+
+    scope = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.Float, nullable=False)  # UNIX time of the last change
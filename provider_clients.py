@@ -0,0 +1,237 @@
+"""
+Provider Clients
+Shared HTTP clients for the external routing providers (ORS, OSRM).
+
+Each provider gets one persistent requests.Session with a pooled adapter so
+connections are reused across calls, retry with exponential backoff for
+transient failures, and a circuit breaker that stops sending traffic to a
+provider that keeps failing. config.ROUTING_TIMEOUT is applied here and
+nowhere else.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# HTTP statuses that indicate the provider itself is unhealthy
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is refused because the provider's breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+
+    closed:    requests flow; consecutive failures are counted
+    open:      requests are refused until reset_timeout has passed
+    half-open: a single trial request is let through; success closes the
+               breaker, failure opens it again
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._state = CLOSED
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def available(self) -> bool:
+        """Return True if a request would currently be allowed."""
+        with self._lock:
+            state = self._current_state()
+            return state == CLOSED or (state == HALF_OPEN and not self._trial_in_flight)
+
+    def acquire(self) -> bool:
+        """Reserve permission to send a request; returns False if refused."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._state = CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._current_state() == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._state = OPEN
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+        return self._state
+
+
+class ProviderClient:
+    """Pooled, retrying HTTP client guarded by a circuit breaker."""
+
+    def __init__(self, name: str, timeout: float, retries: int, backoff: float,
+                 pool_size: int, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def available(self) -> bool:
+        """Return True unless the breaker is refusing requests."""
+        return self.breaker.available()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method: str, url: str, timeout: Optional[float] = None,
+                deadline: Optional[float] = None, **kwargs) -> requests.Response:
+        """
+        Send a request with retries, honoring the circuit breaker.
+
+        Args:
+            method: HTTP method
+            url: Request URL
+            timeout: Per-attempt timeout (defaults to config.ROUTING_TIMEOUT)
+            deadline: Optional time.monotonic() value; each attempt's timeout is
+                clipped to it and no attempt starts with less than
+                config.PROVIDER_MIN_TIMEOUT left
+            **kwargs: Passed to requests.Session.request
+
+        Returns:
+            The final response (may be a non-2xx status the caller must handle)
+
+        Raises:
+            CircuitOpenError: If the breaker is open
+            requests.RequestException: If every attempt failed at the transport level
+                (requests.Timeout if the deadline passed before the first attempt)
+        """
+        timeout = timeout if timeout is not None else self.timeout
+
+        for attempt in range(self.retries + 1):
+            attempt_timeout = timeout
+            if deadline is not None:
+                attempt_timeout = min(timeout, deadline - time.monotonic())
+                if attempt_timeout < config.PROVIDER_MIN_TIMEOUT:
+                    if attempt == 0:
+                        raise requests.Timeout(f"{self.name} deadline passed before the request was sent")
+                    break
+
+            if not self.breaker.acquire():
+                raise CircuitOpenError(f"{self.name} circuit is open")
+
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=attempt_timeout, **kwargs)
+            except requests.RequestException as e:
+                self._record(started, 'error')
+                self.breaker.record_failure()
+                error, response = e, None
+            else:
+                if response.status_code not in RETRYABLE_STATUSES:
+                    self._record(started, 'success' if response.ok else 'rejected')
+                    self.breaker.record_success()
+                    return response
+                self._record(started, 'failure')
+                self.breaker.record_failure()
+                error = None
+
+            delay = self.backoff * (2 ** attempt)
+            if attempt == self.retries or (deadline is not None and
+                                           time.monotonic() + delay + config.PROVIDER_MIN_TIMEOUT >= deadline):
+                break
+            logger.info(f"{self.name} attempt {attempt + 1} failed, retrying in {delay:.2f}s...")
+            time.sleep(delay)
+
+        if response is not None:
+            return response
+        raise error
+
+    def _record(self, started: float, outcome: str):
+        metrics.PROVIDER_LATENCY.observe(time.perf_counter() - started, provider=self.name)
+        metrics.PROVIDER_REQUESTS.inc(provider=self.name, outcome=outcome)
+
+    def status(self) -> Dict:
+        return {
+            'state': self.breaker.state,
+            'consecutive_failures': self.breaker.failures
+        }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def default_timeout() -> float:
+    """Per-request timeout applied when a caller does not pass one."""
+    return config.ROUTING_TIMEOUT
+
+
+def get_client(name: str) -> ProviderClient:
+    """Return the shared client for a provider ('ors' or 'osrm'), creating it on first use."""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = ProviderClient(
+                    name,
+                    timeout=default_timeout(),
+                    retries=config.PROVIDER_RETRIES,
+                    backoff=config.PROVIDER_RETRY_BACKOFF,
+                    pool_size=config.PROVIDER_POOL_SIZE,
+                    failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+                    reset_timeout=config.CIRCUIT_RESET_TIMEOUT
+                )
+                _clients[name] = client
+    return client
+
+
+def status() -> Dict:
+    """Return breaker state for every provider client created so far."""
+    return {name: client.status() for name, client in _clients.items()}
+
+
+metrics.CallbackMetric(
+    'ambulance_provider_circuit_open', 'Whether a provider circuit breaker is refusing requests (1) or not (0)',
+    lambda: [({'provider': name}, int(state['state'] == OPEN)) for name, state in status().items()],
+    labelnames=['provider']
+)
@@ -0,0 +1,21 @@
+"""
+Rebuild Aggregates Script
+Recomputes the route segment frequency aggregate and the trip statistics
+rollups from all stored trips
+"""
+
+from app import app, db
+import response_cache
+import route_frequency
+import trip_stats
+
+with app.app_context():
+    count = route_frequency.rebuild()
+    print(f"✓ Rebuilt route frequency aggregate ({count} rows)")
+
+    count = trip_stats.rebuild()
+    print(f"✓ Rebuilt trip statistics ({count} trips)")
+
+    # Running servers drop responses rendered from the old aggregates
+    response_cache.record_change()
+    db.session.commit()
@@ -0,0 +1,267 @@
+"""
+Response Cache
+In-process cache of rendered read-only responses, conditional GET and
+response compression.
+
+Views decorated with @cached() are rendered once per URL (path and sorted
+query parameters) and served from memory until their scope's data changes:
+the 'trips' scope whenever trips are added or corrected, the 'static' scope
+never. Writers call record_change() in the same transaction as their data,
+which counts the change in the data_versions table; once it commits, this
+process drops its responses at once, and other worker processes drop theirs
+within config.RESPONSE_CACHE_SYNC_INTERVAL seconds, the longest they go
+between checks of the count. Every cached response
+carries a weak ETag and a Last-Modified time (when its scope last changed),
+so browsers revalidating with If-None-Match/If-Modified-Since get an empty
+304.
+
+init_app() also compresses large text responses with brotli (if the
+optional brotli package is installed) or gzip, keeping the compressed bodies
+of cached responses so each is only compressed once.
+"""
+
+import functools
+import gzip
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from flask import request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import config
+import db_utils
+import metrics
+from models import db, DataVersion
+
+try:
+    import brotli
+except ImportError:  # Optional: responses are gzip-compressed without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+TRIPS = 'trips'
+STATIC = 'static'
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/geo+json', 'text/html', 'text/css',
+                          'text/plain', 'text/csv', 'text/javascript', 'application/javascript'}
+
+_entries = OrderedDict()  # (scope, path, args) -> entry dict, least recently used first
+_generations = {}  # scope -> number of times this process dropped the scope's responses
+_versions = {}  # scope -> DataVersion.version the cached responses belong to (None: check now)
+_checked = {}  # scope -> time.monotonic() of the last version check
+_last_modified = {}  # scope -> UNIX time the scope's data last changed
+_lock = threading.Lock()
+_started = time.time()
+
+
+def cached(scope: str = TRIPS, max_age: int = 0):
+    """
+    Decorator caching a GET view's successful responses until scope is invalidated.
+
+    Args:
+        scope: TRIPS for views derived from trip data, STATIC for views that
+            only change with a restart
+        max_age: Cache-Control max-age (seconds); 0 makes browsers revalidate
+            on every use, which costs a 304 once the response is cached
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (scope, request.path, tuple(sorted(
+                (name, value) for name, value in request.args.items(multi=True) if name != 'profile'
+            )))
+            entry = None
+            if config.RESPONSE_CACHE_ENABLED:
+                if scope != STATIC:
+                    _sync(scope)
+                entry = _get(key)
+            metrics.RESPONSE_CACHE_LOOKUPS.inc(result='hit' if entry else 'miss')
+
+            if entry is None:
+                with _lock:
+                    generation = _generations.get(scope, 0)
+                response = view(*args, **kwargs)
+                if isinstance(response, tuple) or response.status_code != 200 or response.is_streamed:
+                    return response  # Errors and streams are never cached
+                entry = _new_entry(response, scope)
+                if config.RESPONSE_CACHE_ENABLED:
+                    _put(key, entry, scope, generation)
+
+            return _respond(entry, max_age)
+        return wrapper
+    return decorator
+
+
+def record_change(scope: str = TRIPS):
+    """
+    Count a change to a scope's data within the current session, so cached
+    responses of every worker process are dropped once the caller commits.
+    Call it last before the commit: on PostgreSQL the scope's row stays
+    locked until then.
+    """
+    now = time.time()
+    db_utils.insert_missing(DataVersion, {'scope': scope, 'version': 0, 'updated_at': now}, ['scope'])
+    DataVersion.query.filter_by(scope=scope).update(
+        {'version': DataVersion.version + 1, 'updated_at': now}, synchronize_session=False
+    )
+    db.session.info.setdefault('changed_scopes', set()).add(scope)
+
+
+@event.listens_for(Session, 'after_commit')
+def _drop_committed(session):
+    for scope in session.info.pop('changed_scopes', ()):
+        _drop(scope, None, time.time())
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('changed_scopes', None)
+
+
+def stats() -> Dict:
+    """Number of cached responses and their total uncompressed size."""
+    with _lock:
+        return {
+            'entries': len(_entries),
+            'bytes': sum(len(entry['body']) for entry in _entries.values())
+        }
+
+
+metrics.CallbackMetric('ambulance_response_cache_entries', 'Responses held in the response cache',
+                       lambda: [({}, stats()['entries'])])
+metrics.CallbackMetric('ambulance_response_cache_bytes', 'Uncompressed size of cached responses',
+                       lambda: [({}, stats()['bytes'])])
+
+
+def init_app(app):
+    """Compress large text responses for clients that accept it."""
+
+    @app.after_request
+    def compress_response(response):
+        return compress(response)
+
+
+def compress(response: Response) -> Response:
+    """
+    Encode a response body with brotli or gzip if the client accepts it and
+    it is worth it. Streamed, passthrough (static file) and already encoded
+    responses are left alone.
+    """
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    entry = getattr(response, 'cache_entry', None)
+    body = entry['body'] if entry else response.get_data()
+    if len(body) < config.COMPRESSION_MIN_BYTES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    if entry is not None:
+        with _lock:
+            data = entry['encoded'].get(encoding)
+        if data is None:
+            data = _encode(body, encoding)
+            with _lock:
+                entry['encoded'][encoding] = data
+    else:
+        data = _encode(body, encoding)
+
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _choose_encoding() -> Optional[str]:
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _encode(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=config.BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=config.GZIP_LEVEL, mtime=0)
+
+
+def _new_entry(response: Response, scope: str) -> Dict:
+    body = response.get_data()
+    with _lock:
+        last_modified = _last_modified.get(scope, _started)
+    return {
+        'body': body,
+        'mimetype': response.mimetype,
+        'etag': hashlib.sha1(body).hexdigest(),
+        'last_modified': int(last_modified),
+        'encoded': {}
+    }
+
+
+def _respond(entry: Dict, max_age: int) -> Response:
+    response = Response(entry['body'], mimetype=entry['mimetype'])
+    # Weak: the same tag is sent for the identity, gzip and brotli encodings
+    response.set_etag(entry['etag'], weak=True)
+    response.last_modified = entry['last_modified']
+    if max_age:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    response.cache_entry = entry
+    return response.make_conditional(request)
+
+
+def _sync(scope: str):
+    """Drop this process's responses of a scope if any process changed it since."""
+    with _lock:
+        if (_versions.get(scope) is not None
+                and time.monotonic() - _checked.get(scope, 0) < config.RESPONSE_CACHE_SYNC_INTERVAL):
+            return
+    row = db.session.query(DataVersion.version, DataVersion.updated_at).filter_by(scope=scope).first()
+    version, updated_at = row if row else (0, _started)
+    with _lock:
+        _checked[scope] = time.monotonic()
+        if _versions.get(scope) == version:
+            return
+    _drop(scope, version, updated_at)
+
+
+def _drop(scope: str, version: Optional[int], last_modified: float):
+    with _lock:
+        _generations[scope] = _generations.get(scope, 0) + 1
+        _versions[scope] = version
+        _last_modified[scope] = last_modified
+        for key in [key for key in _entries if key[0] == scope]:
+            del _entries[key]
+
+
+def _get(key) -> Optional[Dict]:
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+        return entry
+
+
+def _put(key, entry: Dict, scope: str, generation: int):
+    with _lock:
+        if _generations.get(scope, 0) != generation:
+            return  # Invalidated while the view was rendering: the entry may be stale
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > config.RESPONSE_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
@@ -0,0 +1,328 @@
+"""
+Road Graph
+Offline shortest-path routing over a local road network.
+
+The network is a GeoJSON FeatureCollection of LineString/MultiLineString
+roads (coordinates in lon, lat order) stored at config.ROAD_NETWORK_PATH.
+It can be an OSM extract exported as GeoJSON, or built from the road
+geometries of stored trips with `python build_road_network.py`. Features
+may set `oneway` ('yes'/'-1') and `maxspeed` or `speed_kmh` (km/h).
+
+Vertices are merged on rounded coordinates into an adjacency list, a
+coarse grid index snaps query points to the nearest vertex, and A* with a
+great-circle heuristic finds the shortest road distance. Each process
+reloads the graph when the network file's modification time changes, so a
+network written later (by any process) is used without a restart.
+"""
+
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+NODE_PRECISION = 5  # Decimal places used to merge vertices (~1 m)
+GRID_CELL = 0.005  # Grid index cell size (degrees, ~500 m)
+EARTH_RADIUS_KM = 6371
+
+_graph = None
+_graph_mtime = None  # Modification time of the file _graph was loaded from (None if it was missing)
+_graph_lock = threading.Lock()
+
+
+class NoRouteError(Exception):
+    """Raised when the road graph cannot connect two points."""
+
+
+class RoadGraph:
+    """
+    Directed road graph with per-edge distance (km) and duration (minutes).
+
+    Args:
+        default_speed: Speed (km/h) for roads without a speed property
+        max_snap_km: Largest distance from a query point to the nearest road vertex
+    """
+
+    def __init__(self, default_speed: float = 25, max_snap_km: float = 0.3):
+        self.default_speed = default_speed
+        self.max_snap_km = max_snap_km
+        self.lats = []
+        self.lons = []
+        self.edges = []  # node -> {neighbour: (distance km, duration minutes)}
+        self._ids = {}
+        self._grid = defaultdict(list)
+
+    @classmethod
+    def from_geojson(cls, data: Dict, **options) -> 'RoadGraph':
+        """Build a graph from a GeoJSON FeatureCollection of roads."""
+        graph = cls(**options)
+        for feature in data.get('features', []):
+            geometry = feature.get('geometry') or {}
+            properties = feature.get('properties') or {}
+            if geometry.get('type') == 'LineString':
+                lines = [geometry['coordinates']]
+            elif geometry.get('type') == 'MultiLineString':
+                lines = geometry['coordinates']
+            else:
+                continue
+            for line in lines:
+                graph.add_road(line, properties)
+        return graph
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    @property
+    def node_count(self) -> int:
+        return len(self.lats)
+
+    @property
+    def edge_count(self) -> int:
+        return sum(len(edges) for edges in self.edges)
+
+    def add_road(self, coordinates: List[List[float]], properties: Optional[Dict] = None):
+        """
+        Add one road polyline.
+
+        Args:
+            coordinates: List of [lon, lat] points
+            properties: Optional oneway and maxspeed/speed_kmh tags
+        """
+        properties = properties or {}
+        speed = _speed(properties) or self.default_speed
+        oneway = str(properties.get('oneway', '')).lower()
+        forward = oneway != '-1'
+        backward = oneway not in ('yes', 'true', '1')
+
+        nodes = [self._node(lat, lon) for lon, lat in (point[:2] for point in coordinates)]
+        for a, b in zip(nodes, nodes[1:]):
+            if a == b:
+                continue
+            distance = _haversine(self.lats[a], self.lons[a], self.lats[b], self.lons[b])
+            duration = distance / speed * 60
+            if forward:
+                self._add_edge(a, b, distance, duration)
+            if backward:
+                self._add_edge(b, a, distance, duration)
+
+    def nearest(self, lat: float, lon: float) -> Tuple[Optional[int], float]:
+        """
+        Nearest vertex within max_snap_km.
+
+        Returns:
+            (node, distance km), or (None, inf) if no vertex is close enough
+        """
+        rings = int(self.max_snap_km / (GRID_CELL * 111)) + 1
+        row, col = _cell(lat, lon)
+        best, best_distance = None, math.inf
+        for r in range(row - rings, row + rings + 1):
+            for c in range(col - rings, col + rings + 1):
+                for node in self._grid.get((r, c), ()):
+                    distance = _haversine(lat, lon, self.lats[node], self.lons[node])
+                    if distance < best_distance:
+                        best, best_distance = node, distance
+        if best_distance > self.max_snap_km:
+            return None, math.inf
+        return best, best_distance
+
+    def shortest_path(self, source: int, target: int) -> Tuple[List[int], float, float]:
+        """
+        A* search for the shortest road distance between two vertices.
+
+        Returns:
+            (path as list of nodes, distance km, duration minutes)
+
+        Raises:
+            NoRouteError: If target is unreachable from source
+        """
+        target_lat, target_lon = self.lats[target], self.lons[target]
+        distances = {source: 0.0}
+        durations = {source: 0.0}
+        previous = {}
+        heap = [(0.0, 0.0, source)]
+        settled = set()
+
+        while heap:
+            _, _, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if node in settled:
+                continue
+            settled.add(node)
+            for neighbour, (distance, duration) in self.edges[node].items():
+                candidate = distances[node] + distance
+                if candidate < distances.get(neighbour, math.inf):
+                    distances[neighbour] = candidate
+                    durations[neighbour] = durations[node] + duration
+                    previous[neighbour] = node
+                    estimate = candidate + _haversine(self.lats[neighbour], self.lons[neighbour],
+                                                      target_lat, target_lon)
+                    # Ties go to the node furthest along, which keeps grid-like networks fast
+                    heapq.heappush(heap, (estimate, -candidate, neighbour))
+        else:
+            raise NoRouteError("Points are not connected in the road network")
+
+        path = [target]
+        while path[-1] != source:
+            path.append(previous[path[-1]])
+        path.reverse()
+        return path, distances[target], durations[target]
+
+    def route(self, start_coords: List[float], end_coords: List[float]) -> Dict:
+        """
+        Route between two points. The straight hops from each point to its
+        nearest road vertex are included at the default speed.
+
+        Args:
+            start_coords: [lon, lat] of starting point
+            end_coords: [lon, lat] of ending point
+
+        Returns:
+            Dict with distance (km), duration (minutes), geometry (list of [lat, lon])
+
+        Raises:
+            NoRouteError: If either point is too far from the network or they are not connected
+        """
+        (start_lon, start_lat), (end_lon, end_lat) = start_coords, end_coords
+        source, source_snap = self.nearest(start_lat, start_lon)
+        target, target_snap = self.nearest(end_lat, end_lon)
+        if source is None or target is None:
+            raise NoRouteError(f"No road within {self.max_snap_km} km of the route endpoints")
+
+        path, distance, duration = self.shortest_path(source, target)
+        snap = source_snap + target_snap
+        geometry = [[start_lat, start_lon]] + [[self.lats[n], self.lons[n]] for n in path] + [[end_lat, end_lon]]
+        return {
+            'distance': distance + snap,
+            'duration': duration + snap / self.default_speed * 60,
+            'geometry': geometry
+        }
+
+    def _add_edge(self, a: int, b: int, distance: float, duration: float):
+        # Roads drawn more than once keep their fastest duration
+        existing = self.edges[a].get(b)
+        if existing is None or duration < existing[1]:
+            self.edges[a][b] = (distance, duration)
+
+    def _node(self, lat: float, lon: float) -> int:
+        key = (round(lat, NODE_PRECISION), round(lon, NODE_PRECISION))
+        node = self._ids.get(key)
+        if node is None:
+            node = self._ids[key] = len(self.lats)
+            self.lats.append(key[0])
+            self.lons.append(key[1])
+            self.edges.append({})
+            self._grid[_cell(*key)].append(node)
+        return node
+
+
+def get_graph() -> Optional[RoadGraph]:
+    """
+    Shared graph loaded from config.ROAD_NETWORK_PATH on first use and
+    reloaded whenever the file is created, replaced or removed.
+
+    Returns:
+        RoadGraph, or None if offline routing is disabled or no network file exists
+    """
+    global _graph, _graph_mtime
+    if not config.ROAD_GRAPH_ENABLED:
+        return None
+    mtime = _mtime(config.ROAD_NETWORK_PATH)
+    if _graph is None or mtime != _graph_mtime:
+        with _graph_lock:
+            if _graph is None or mtime != _graph_mtime:
+                _graph = load(config.ROAD_NETWORK_PATH)
+                _graph_mtime = mtime
+    return _graph or None
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load(path: str) -> RoadGraph:
+    """
+    Load a road network file. A missing or unreadable file gives an empty graph.
+    """
+    graph = RoadGraph(default_speed=config.ROAD_GRAPH_SPEED_KMH, max_snap_km=config.ROAD_GRAPH_MAX_SNAP_KM)
+    if not os.path.exists(path):
+        return graph
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read road network {path}: {e}")
+        return graph
+
+    graph = RoadGraph.from_geojson(data, default_speed=config.ROAD_GRAPH_SPEED_KMH,
+                                   max_snap_km=config.ROAD_GRAPH_MAX_SNAP_KM)
+    logger.info(f"✓ Road graph loaded: {graph.node_count} nodes, {graph.edge_count} edges")
+    return graph
+
+
+def invalidate():
+    """Drop the loaded graph so the next query reloads the network file."""
+    global _graph
+    with _graph_lock:
+        _graph = None
+
+
+def network_from_routes(routes: Iterable[Tuple[List[List[float]], Optional[float]]]) -> Dict:
+    """
+    Build a road network from known road geometries (e.g. stored trip routes).
+
+    Args:
+        routes: Iterable of (geometry as list of [lat, lon], average speed km/h or None)
+
+    Returns:
+        GeoJSON FeatureCollection with one LineString per distinct route
+    """
+    features = []
+    seen = set()
+    for geometry, speed in routes:
+        coordinates = [[round(lon, NODE_PRECISION), round(lat, NODE_PRECISION)] for lat, lon in geometry]
+        key = tuple(map(tuple, coordinates))
+        if len(coordinates) < 2 or key in seen:
+            continue
+        seen.add(key)
+        features.append({
+            'type': 'Feature',
+            'properties': {'speed_kmh': round(speed, 1)} if speed else {},
+            'geometry': {'type': 'LineString', 'coordinates': coordinates}
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def _speed(properties: Dict) -> Optional[float]:
+    """Road speed in km/h from speed_kmh or an OSM maxspeed tag ('30', '30 km/h', '20 mph')."""
+    value = properties.get('speed_kmh') or properties.get('maxspeed')
+    if value is None:
+        return None
+    try:
+        if isinstance(value, str):
+            number = float(value.split()[0])
+            return number * 1.609 if 'mph' in value else number
+        return float(value) or None
+    except (ValueError, IndexError):
+        return None
+
+
+def _cell(lat: float, lon: float) -> Tuple[int, int]:
+    return int(math.floor(lat / GRID_CELL)), int(math.floor(lon / GRID_CELL))
+
+
+def _haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in km."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
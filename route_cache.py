@@ -0,0 +1,240 @@
+"""
+Route Cache
+Persistent cache in front of route_optimizer.calculate_route.
+
+Routes are keyed on rounded start/end coordinates and the routing provider
+chain, stored in a small SQLite file so they survive restarts, and evicted
+by age (TTL) and by size (least recently used). A small in-process LRU sits
+in front of SQLite so repeat lookups never leave memory.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import config
+import metrics
+import route_optimizer
+
+logger = logging.getLogger(__name__)
+
+
+class RouteCache:
+    """SQLite-backed route cache with TTL and LRU-size eviction."""
+
+    def __init__(self, path: str, ttl: int, max_entries: int,
+                 memory_entries: int = 256, precision: int = 5):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.precision = precision
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Shared by every worker process: wait for another process's write instead of failing
+        self._conn = sqlite3.connect(path, timeout=config.SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        if path != ':memory:' and config.SQLITE_WAL:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS route_cache ('
+            ' key TEXT PRIMARY KEY,'
+            ' route TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS ix_route_cache_accessed_at ON route_cache (accessed_at)'
+        )
+        self._conn.commit()
+
+    def make_key(self, start_coords: List[float], end_coords: List[float], provider: str) -> str:
+        """
+        Build a cache key from rounded coordinates and provider.
+
+        Args:
+            start_coords: [lon, lat] of starting point
+            end_coords: [lon, lat] of ending point
+            provider: Name of the provider chain used to compute the route
+
+        Returns:
+            String key
+        """
+        p = self.precision
+        return (f"{provider}:{round(start_coords[0], p)},{round(start_coords[1], p)}"
+                f";{round(end_coords[0], p)},{round(end_coords[1], p)}")
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached route for key, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                route, created_at = entry
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return route
+                del self._memory[key]
+
+            row = self._conn.execute(
+                'SELECT route, created_at FROM route_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            route_json, created_at = row
+            if now - created_at > self.ttl:
+                self._conn.execute('DELETE FROM route_cache WHERE key = ?', (key,))
+                self._conn.commit()
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute('UPDATE route_cache SET accessed_at = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+            route = json.loads(route_json)
+            self._remember(key, route, created_at)
+            self.hits += 1
+            return route
+
+    def set(self, key: str, route: Dict):
+        """Store a route and evict the least recently used entries past max_entries."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO route_cache (key, route, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(route), now, now)
+            )
+            self._remember(key, route, now)
+            self._evict(now)
+            self._conn.commit()
+
+    def clear(self):
+        """Remove every cached route and reset counters."""
+        with self._lock:
+            self._conn.execute('DELETE FROM route_cache')
+            self._conn.commit()
+            self._memory.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and current size."""
+        with self._lock:
+            size = self._conn.execute('SELECT COUNT(*) FROM route_cache').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'size': size,
+                'memory_size': len(self._memory),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl
+            }
+
+    def _remember(self, key: str, route: Dict, created_at: float):
+        self._memory[key] = (route, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        expired = self._conn.execute(
+            'DELETE FROM route_cache WHERE created_at < ?', (now - self.ttl,)
+        ).rowcount
+        overflow = self._conn.execute(
+            'DELETE FROM route_cache WHERE key IN ('
+            ' SELECT key FROM route_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        ).rowcount
+        self.evictions += max(expired, 0) + max(overflow, 0)
+        if overflow > 0:
+            # Rows dropped from SQLite must not linger in the memory layer
+            live = {row[0] for row in self._conn.execute('SELECT key FROM route_cache')}
+            for key in [k for k in self._memory if k not in live]:
+                del self._memory[key]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> RouteCache:
+    """Return the process-wide route cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RouteCache(
+                    config.ROUTE_CACHE_PATH,
+                    ttl=config.ROUTE_CACHE_TTL,
+                    max_entries=config.ROUTE_CACHE_MAX_ENTRIES,
+                    memory_entries=config.ROUTE_CACHE_MEMORY_ENTRIES,
+                    precision=config.ROUTE_CACHE_PRECISION
+                )
+    return _cache
+
+
+def _lookup_samples():
+    if _cache is None:
+        return []
+    return [({'result': 'hit'}, _cache.hits), ({'result': 'miss'}, _cache.misses)]
+
+
+def _size_samples():
+    return [({}, get_cache().stats()['size'])] if _cache is not None else []
+
+
+metrics.CallbackMetric('ambulance_route_cache_lookups_total', 'Route cache lookups',
+                       _lookup_samples, metric_type='counter', labelnames=['result'])
+metrics.CallbackMetric('ambulance_route_cache_entries', 'Routes stored in the route cache', _size_samples)
+
+
+def calculate_route(start_coords: List[float], end_coords: List[float], api_key: Optional[str] = None,
+                    **options) -> Dict:
+    """
+    Cached version of route_optimizer.calculate_route.
+
+    Offline (road graph and Haversine) results are never cached, so a route
+    computed while both providers were down is retried against them next time.
+
+    Args:
+        start_coords: [lon, lat] of starting point
+        end_coords: [lon, lat] of ending point
+        api_key: Optional OpenRouteService API key
+        **options: Passed through to route_optimizer.calculate_route
+
+    Returns:
+        Dict with keys: distance (km), duration (minutes), geometry (list of [lat, lon])
+    """
+    if not config.ROUTE_CACHE_ENABLED:
+        return route_optimizer.calculate_route(start_coords, end_coords, api_key, **options)
+
+    cache = get_cache()
+    provider = 'ors' if api_key else 'osrm'
+    key = cache.make_key(start_coords, end_coords, provider)
+
+    route = cache.get(key)
+    if route is not None:
+        logger.info("✓ Route served from cache")
+        return dict(route, cached=True)
+
+    route = route_optimizer.calculate_route(start_coords, end_coords, api_key, **options)
+    if route.get('source') not in route_optimizer.OFFLINE_SOURCES:
+        cache.set(key, route)
+    return route
@@ -0,0 +1,254 @@
+"""
+Route Frequency Aggregate
+Incrementally maintained per-date segment counts for the route frequency map.
+
+Each trip's geometry is split into segments of consecutive points rounded to
+4 decimals (direction-independent), and the counts are added to the
+route_segment_counts table in the same transaction as the trip itself, so
+the frequency endpoint never has to re-parse trip history.
+
+The same geometry is also snapped to the coarser grid of each tile level in
+config.ROUTE_TILE_LEVELS and counted into route_segment_level_counts, which
+route_tiles reads for zoomed-out map views.
+"""
+
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from models import db, AmbulanceTrip, RouteSegmentCount, RouteSegmentLevelCount
+import config
+import db_utils
+import geometry_codec
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PRECISION = 4
+
+
+def segment_counts(geometry: List[List[float]]) -> Counter:
+    """
+    Count rounded, direction-independent segments in a geometry.
+
+    Args:
+        geometry: List of [lat, lon] points
+
+    Returns:
+        Counter mapping ((lat1, lon1), (lat2, lon2)) to occurrences
+    """
+    counts = Counter()
+    for i in range(len(geometry) - 1):
+        # Create a segment key (rounded to reduce precision)
+        p1 = (round(geometry[i][0], SEGMENT_PRECISION), round(geometry[i][1], SEGMENT_PRECISION))
+        p2 = (round(geometry[i + 1][0], SEGMENT_PRECISION), round(geometry[i + 1][1], SEGMENT_PRECISION))
+        segment = tuple(sorted([p1, p2]))  # Sort to make direction-independent
+        counts[segment] += 1
+    return counts
+
+
+def level_segment_counts(geometry: List[List[float]]) -> Counter:
+    """
+    Count direction-independent segments of a geometry snapped to the grid
+    of every tile level. Consecutive points that snap to the same grid point
+    are collapsed, so a trip counts once per coarse segment it drives.
+
+    Args:
+        geometry: List of [lat, lon] points
+
+    Returns:
+        Counter mapping (level, ((lat1, lon1), (lat2, lon2))) to occurrences,
+        with levels numbered from 1 in config.ROUTE_TILE_LEVELS order
+    """
+    counts = Counter()
+    for level, (_, grid) in enumerate(config.ROUTE_TILE_LEVELS, start=1):
+        previous = None
+        for lat, lon in geometry:
+            point = (_snap(lat, grid), _snap(lon, grid))
+            if previous is not None and point != previous:
+                counts[(level, tuple(sorted([previous, point])))] += 1
+            previous = point
+    return counts
+
+
+def _snap(value: float, grid: float) -> float:
+    # Rounded again so that grid multiples compare (and store) exactly
+    return round(round(value / grid) * grid, 6)
+
+
+def record_trip(date: str, geometry: List[List[float]]):
+    """
+    Add a trip's segments to the aggregate within the current session.
+    The caller commits (or rolls back) together with the trip.
+
+    Args:
+        date: Trip date (YYYY-MM-DD)
+        geometry: List of [lat, lon] points
+    """
+    record_counts(Counter({(date, segment): n for segment, n in segment_counts(geometry).items()}))
+    record_level_counts(Counter({
+        (level, date, segment): n for (level, segment), n in level_segment_counts(geometry).items()
+    }))
+
+
+def record_counts(totals: Counter):
+    """
+    Add pre-counted segments to the aggregate within the current session.
+
+    Args:
+        totals: Counter mapping (date, segment) to occurrences, where segment
+            is a key from segment_counts()
+    """
+    rows = [
+        {'date': date, 'lat1': p1[0], 'lon1': p1[1], 'lat2': p2[0], 'lon2': p2[1], 'count': n}
+        for (date, (p1, p2)), n in totals.items()
+    ]
+    db_utils.upsert_add(RouteSegmentCount, rows, ['date', 'lat1', 'lon1', 'lat2', 'lon2'], ['count'])
+
+
+def record_level_counts(totals: Counter):
+    """
+    Add pre-counted tile level segments to the aggregate within the current session.
+
+    Args:
+        totals: Counter mapping (level, date, segment) to occurrences, where
+            level and segment come from level_segment_counts()
+    """
+    rows = [
+        {'level': level, 'date': date, 'lat1': p1[0], 'lon1': p1[1], 'lat2': p2[0], 'lon2': p2[1], 'count': n}
+        for (level, date, (p1, p2)), n in totals.items()
+    ]
+    db_utils.upsert_add(RouteSegmentLevelCount, rows,
+                        ['level', 'date', 'lat1', 'lon1', 'lat2', 'lon2'], ['count'])
+
+
+def rebuild(batch_size: int = 500) -> int:
+    """
+    Recompute the whole aggregate from stored trips and commit. Trips still
+    holding a provisional route are skipped, as in record_trip's callers;
+    the trip worker records their real legs once they are routed.
+
+    Args:
+        batch_size: Trips fetched per round trip to the database
+
+    Returns:
+        Number of aggregate rows written
+    """
+    totals = Counter()
+    level_totals = Counter()
+    query = db.session.query(
+        AmbulanceTrip.date, AmbulanceTrip.route_polyline, AmbulanceTrip.route_geometry
+    ).filter(
+        db.or_(AmbulanceTrip.route_polyline.isnot(None), AmbulanceTrip.route_geometry.isnot(None)),
+        AmbulanceTrip.has_final_route()
+    )
+    for date, route_polyline, route_geometry in query.yield_per(batch_size):
+        geometry = geometry_codec.decode_stored(route_polyline, route_geometry)
+        for segment, n in segment_counts(geometry).items():
+            totals[(date.isoformat(), segment)] += n
+        for (level, segment), n in level_segment_counts(geometry).items():
+            level_totals[(level, date.isoformat(), segment)] += n
+
+    RouteSegmentCount.query.delete()
+    RouteSegmentLevelCount.query.delete()
+    record_counts(totals)
+    record_level_counts(level_totals)
+    db.session.commit()
+
+    logger.info(f"✓ Route frequency aggregate rebuilt with {len(totals)} rows "
+                f"and {len(level_totals)} tile level rows")
+    return len(totals) + len(level_totals)
+
+
+def is_stale() -> bool:
+    """Return True if trips exist but the aggregate (or its tile levels) has never been built."""
+    return ((RouteSegmentCount.query.first() is None or RouteSegmentLevelCount.query.first() is None)
+            and AmbulanceTrip.query.filter(db.or_(
+                AmbulanceTrip.route_polyline.isnot(None), AmbulanceTrip.route_geometry.isnot(None)
+            ), AmbulanceTrip.has_final_route()).first() is not None)
+
+
+def query_segments(bbox: Optional[Tuple[float, float, float, float]] = None,
+                   start_date: Optional[str] = None, end_date: Optional[str] = None,
+                   min_frequency: int = 1) -> List[Dict]:
+    """
+    Read segment frequencies from the aggregate.
+
+    Args:
+        bbox: Optional (min_lat, min_lon, max_lat, max_lon); segments with
+            either endpoint inside are returned
+        start_date: Optional first date (inclusive, YYYY-MM-DD)
+        end_date: Optional last date (inclusive, YYYY-MM-DD)
+        min_frequency: Minimum total count for a segment to be returned
+
+    Returns:
+        List of dicts with coordinates ([[lat1, lon1], [lat2, lon2]]) and frequency
+    """
+    frequency = func.sum(RouteSegmentCount.count).label('frequency')
+    query = db.session.query(
+        RouteSegmentCount.lat1, RouteSegmentCount.lon1,
+        RouteSegmentCount.lat2, RouteSegmentCount.lon2, frequency
+    )
+
+    if start_date:
+        query = query.filter(RouteSegmentCount.date >= start_date)
+    if end_date:
+        query = query.filter(RouteSegmentCount.date <= end_date)
+    if bbox:
+        min_lat, min_lon, max_lat, max_lon = bbox
+        query = query.filter(db.or_(
+            db.and_(RouteSegmentCount.lat1.between(min_lat, max_lat), RouteSegmentCount.lon1.between(min_lon, max_lon)),
+            db.and_(RouteSegmentCount.lat2.between(min_lat, max_lat), RouteSegmentCount.lon2.between(min_lon, max_lon))
+        ))
+
+    query = query.group_by(
+        RouteSegmentCount.lat1, RouteSegmentCount.lon1, RouteSegmentCount.lat2, RouteSegmentCount.lon2
+    )
+    if min_frequency > 1:
+        query = query.having(frequency >= min_frequency)
+
+    return [
+        {'coordinates': [[lat1, lon1], [lat2, lon2]], 'frequency': count}
+        for lat1, lon1, lat2, lon2, count in query
+    ]
+
+
+def query_tile_segments(level: int, bounds: Tuple[float, float, float, float],
+                        start_date: Optional[str] = None, end_date: Optional[str] = None,
+                        min_frequency: int = 1) -> List[Tuple[Tuple[float, float], Tuple[float, float], int]]:
+    """
+    Read the segment frequencies of one tile from a tile level.
+
+    Each segment belongs to the tile containing its first endpoint (bounds
+    are half-open), so adjacent tiles never return the same segment.
+
+    Args:
+        level: 0 for the full-precision aggregate, otherwise a tile level
+            numbered from 1 in config.ROUTE_TILE_LEVELS order
+        bounds: (south, west, north, east) of the tile
+        start_date: Optional first date (inclusive, YYYY-MM-DD)
+        end_date: Optional last date (inclusive, YYYY-MM-DD)
+        min_frequency: Minimum total count for a segment to be returned
+
+    Returns:
+        List of ((lat1, lon1), (lat2, lon2), frequency)
+    """
+    model = RouteSegmentCount if level == 0 else RouteSegmentLevelCount
+    frequency = func.sum(model.count).label('frequency')
+    south, west, north, east = bounds
+    query = db.session.query(model.lat1, model.lon1, model.lat2, model.lon2, frequency).filter(
+        model.lat1 >= south, model.lat1 < north, model.lon1 >= west, model.lon1 < east
+    )
+    if level:
+        query = query.filter(model.level == level)
+    if start_date:
+        query = query.filter(model.date >= start_date)
+    if end_date:
+        query = query.filter(model.date <= end_date)
+
+    query = query.group_by(model.lat1, model.lon1, model.lat2, model.lon2)
+    if min_frequency > 1:
+        query = query.having(frequency >= min_frequency)
+
+    return [((lat1, lon1), (lat2, lon2), count) for lat1, lon1, lat2, lon2, count in query]
@@ -0,0 +1,258 @@
+"""
+Route Matrix
+Precomputed travel distance/duration matrix between the hospital and every
+campus location.
+
+The matrix is built with one batched matrix/table request per provider and
+stored in the route_matrix table. Known pairs are then served from memory
+so most dispatches never touch the network. Free-form points within
+config.ROUTE_MATRIX_SNAP_KM of a known location are snapped to it; other
+coordinates still go through route_optimizer.calculate_route. Entries
+built without geometry get their road path from the route cache
+(with_geometry), never a straight line.
+"""
+
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import config
+import metrics
+import route_cache
+import route_optimizer
+import spatial_index
+from models import db, RouteMatrixEntry
+
+logger = logging.getLogger(__name__)
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def known_locations() -> List[Tuple[str, List[float]]]:
+    """
+    Return the hospital and campus locations with duplicate coordinates removed.
+
+    Returns:
+        List of (name, [lat, lon]) tuples, hospital first
+    """
+    locations = [(config.HOSPITAL_NAME, config.HOSPITAL_COORDS)]
+    seen = {_point_key(config.HOSPITAL_COORDS[1], config.HOSPITAL_COORDS[0])}
+    for name, coords in config.CAMPUS_LOCATIONS.items():
+        key = _point_key(coords[1], coords[0])
+        if key not in seen:
+            seen.add(key)
+            locations.append((name, coords))
+    return locations
+
+
+def build_matrix(api_key: Optional[str] = None, with_geometry: bool = False) -> int:
+    """
+    Compute and store the full matrix for all known locations.
+    Must be called inside an application context.
+
+    Args:
+        api_key: Optional OpenRouteService API key
+        with_geometry: Also fetch road geometry for hospital legs that are not
+            already in the route cache (one route call per missing leg)
+
+    Returns:
+        Number of matrix entries stored
+    """
+    locations = known_locations()
+    points = [[coords[1], coords[0]] for _, coords in locations]  # lon, lat
+
+    matrix = route_optimizer.calculate_matrix(points, api_key)
+    hospital = points[0]
+
+    entries = []
+    for i, (origin_name, origin) in enumerate(locations):
+        for j, (destination_name, destination) in enumerate(locations):
+            if i == j:
+                continue
+            distance = matrix['distances'][i][j]
+            duration = matrix['durations'][i][j]
+            if distance is None or duration is None:
+                continue
+
+            start, end = points[i], points[j]
+            geometry = None
+            if start == hospital or end == hospital:
+                geometry = _leg_geometry(start, end, api_key, with_geometry)
+
+            entries.append(RouteMatrixEntry(
+                origin_name=origin_name,
+                origin_lat=origin[0],
+                origin_lon=origin[1],
+                destination_name=destination_name,
+                destination_lat=destination[0],
+                destination_lon=destination[1],
+                distance_km=distance,
+                duration_minutes=duration,
+                route_geometry=json.dumps(geometry) if geometry else None,
+                source=matrix['source']
+            ))
+
+    RouteMatrixEntry.query.delete()
+    db.session.add_all(entries)
+    db.session.commit()
+    invalidate()
+
+    logger.info(f"✓ Route matrix built with {len(entries)} entries from {matrix['source']}")
+    return len(entries)
+
+
+def lookup(start_coords: List[float], end_coords: List[float]) -> Optional[Dict]:
+    """
+    Serve a route between two known locations from the matrix.
+    Endpoints that miss the exact keys are snapped to the nearest known
+    location within config.ROUTE_MATRIX_SNAP_KM.
+    Must be called inside an application context.
+
+    Args:
+        start_coords: [lon, lat] of starting point
+        end_coords: [lon, lat] of ending point
+
+    Returns:
+        Dict with distance (km), duration (minutes), geometry (list of [lat, lon],
+        or None if the matrix holds no geometry for the pair; see with_geometry)
+        and source, or None if the pair is not in the matrix
+    """
+    if not config.ROUTE_MATRIX_ENABLED:
+        return None
+
+    index = _get_index()
+    entry = index.get((_point_key(*start_coords), _point_key(*end_coords)))
+    result = 'hit'
+    if entry is None and config.ROUTE_MATRIX_SNAP_KM:
+        snapped_start = spatial_index.snap_known(start_coords, config.ROUTE_MATRIX_SNAP_KM)
+        snapped_end = spatial_index.snap_known(end_coords, config.ROUTE_MATRIX_SNAP_KM)
+        if snapped_start and snapped_end:
+            entry = index.get((_point_key(*snapped_start), _point_key(*snapped_end)))
+            result = 'snapped'
+    if entry is None:
+        metrics.ROUTE_MATRIX_LOOKUPS.inc(result='miss')
+        return None
+    metrics.ROUTE_MATRIX_LOOKUPS.inc(result=result)
+
+    return {
+        'distance': entry['distance'],
+        'duration': entry['duration'],
+        'geometry': entry['geometry'],
+        'source': f"Matrix ({entry['source']})"
+    }
+
+
+def with_geometry(route: Dict, start_coords: List[float], end_coords: List[float],
+                  api_key: Optional[str] = None, **options) -> Dict:
+    """
+    Complete a matrix route that has no geometry with the road path from
+    route_cache.calculate_route, keeping the matrix distance and duration.
+    If no provider could route the leg, the offline route is returned as is
+    so its source marks the geometry as an estimate.
+
+    Args:
+        route: Result of lookup()
+        start_coords: [lon, lat] of starting point
+        end_coords: [lon, lat] of ending point
+        api_key: Optional OpenRouteService API key
+        **options: Passed through to route_optimizer.calculate_route
+
+    Returns:
+        Route dict with geometry
+    """
+    if route['geometry']:
+        return route
+    fetched = route_cache.calculate_route(start_coords, end_coords, api_key, **options)
+    if fetched.get('source') in route_optimizer.OFFLINE_SOURCES:
+        return fetched
+    return dict(route, geometry=fetched['geometry'])
+
+
+def duration_matrix(points: Sequence[Sequence[float]]) -> np.ndarray:
+    """
+    Matrix travel times between every pair of points, with each point
+    snapped to a known location within config.ROUTE_MATRIX_SNAP_KM.
+    Must be called inside an application context.
+
+    Args:
+        points: List of [lat, lon] points
+
+    Returns:
+        (len(points), len(points)) array of durations in minutes, NaN where
+        the pair is not in the matrix
+    """
+    durations = np.full((len(points), len(points)), np.nan)
+    if not config.ROUTE_MATRIX_ENABLED or not len(points):
+        return durations
+
+    index = _get_index()
+    known = {origin for origin, _ in index}
+    keys = []
+    for lat, lon in points:
+        key = _point_key(lon, lat)
+        if key not in known and config.ROUTE_MATRIX_SNAP_KM:
+            snapped = spatial_index.snap_known([lon, lat], config.ROUTE_MATRIX_SNAP_KM)
+            key = _point_key(*snapped) if snapped else None
+        keys.append(key)
+
+    for i, origin in enumerate(keys):
+        if origin is None:
+            continue
+        for j, destination in enumerate(keys):
+            entry = index.get((origin, destination)) if destination is not None else None
+            if entry is not None:
+                durations[i, j] = entry['duration']
+    return durations
+
+
+def invalidate():
+    """Drop the in-memory index so the next lookup reloads it from the database."""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def is_empty() -> bool:
+    """Return True if no matrix has been built yet."""
+    return RouteMatrixEntry.query.first() is None
+
+
+def _get_index() -> Dict:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = {}
+                for entry in RouteMatrixEntry.query.all():
+                    key = (_point_key(entry.origin_lon, entry.origin_lat),
+                           _point_key(entry.destination_lon, entry.destination_lat))
+                    index[key] = {
+                        'distance': entry.distance_km,
+                        'duration': entry.duration_minutes,
+                        'geometry': json.loads(entry.route_geometry) if entry.route_geometry else None,
+                        'source': entry.source
+                    }
+                _index = index
+    return _index
+
+
+def _leg_geometry(start: List[float], end: List[float], api_key: Optional[str], fetch: bool) -> Optional[List]:
+    """Road geometry for a leg, from the route cache or (if fetch) a single route call."""
+    if fetch:
+        route = route_cache.calculate_route(start, end, api_key)
+        return route['geometry'] if route.get('source') not in route_optimizer.OFFLINE_SOURCES else None
+
+    if not config.ROUTE_CACHE_ENABLED:
+        return None
+    cache = route_cache.get_cache()
+    route = cache.get(cache.make_key(start, end, 'ors' if api_key else 'osrm'))
+    return route['geometry'] if route else None
+
+
+def _point_key(lon: float, lat: float) -> Tuple[float, float]:
+    p = config.ROUTE_MATRIX_PRECISION
+    return (round(lon, p), round(lat, p))
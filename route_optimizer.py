@@ -1,22 +1,37 @@
 """
-Route Optimizer Service with 3-Tier Fallback System
+Route Optimizer Service with 4-Tier Fallback System
 Implements automatic fallback between routing services:
 1. OpenRouteService (ORS) - Most accurate, requires API key
 2. OSRM - Free public service, no API key needed
-3. Haversine - Straight-line calculation, always available
+3. Road Graph - Offline A* over the local road network, if one is installed
+4. Haversine - Straight-line calculation, always available
 """
 
-import requests
 import math
 import logging
-from typing import Dict, List, Tuple, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Tuple, Optional
+
+import config
+import metrics
+import provider_clients
+import road_graph
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Sources computed locally rather than by a routing provider
+OFFLINE_SOURCES = ('Road Graph', 'Haversine')
+
+# Shared pool for hedged provider requests
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='route-provider')
+
 
-def calculate_route(start_coords: List[float], end_coords: List[float], api_key: Optional[str] = None) -> Dict:
+def calculate_route(start_coords: List[float], end_coords: List[float], api_key: Optional[str] = None,
+                    timeout: Optional[float] = None, budget: Optional[float] = None,
+                    hedged: bool = False, hedge_delay: float = 0.5) -> Dict:
     """
     Calculate route between two points with automatic fallback.
     
@@ -24,31 +39,162 @@ def calculate_route(start_coords: List[float], end_coords: List[float], api_key:
         start_coords: [lon, lat] of starting point
         end_coords: [lon, lat] of ending point
         api_key: Optional OpenRouteService API key
+        timeout: Per-request timeout for each provider (seconds); defaults to
+            the provider client's config.ROUTING_TIMEOUT
+        budget: Optional overall deadline for the provider tiers (seconds);
+            the offline tiers are used once it runs out
+        hedged: Race OSRM against ORS if ORS has not answered within hedge_delay
+        hedge_delay: Seconds to wait for ORS before starting OSRM in hedged mode
     
     Returns:
         Dict with keys: distance (km), duration (minutes), geometry (list of [lat, lon])
     """
-    # Try OpenRouteService first (if API key available)
-    if api_key:
-        try:
-            logger.info("Attempting route calculation with OpenRouteService...")
-            return _try_openrouteservice(start_coords, end_coords, api_key)
-        except Exception as e:
-            logger.warning(f"OpenRouteService failed: {e}. Falling back to OSRM...")
+    route = _select_route(start_coords, end_coords, api_key, timeout, budget, hedged, hedge_delay)
+    metrics.ROUTES_CALCULATED.inc(source=route['source'])
+    return route
+
+
+def _select_route(start_coords: List[float], end_coords: List[float], api_key: Optional[str],
+                  timeout: Optional[float], budget: Optional[float], hedged: bool, hedge_delay: float) -> Dict:
+    """Walk the fallback tiers for calculate_route."""
+    deadline = time.monotonic() + budget if budget else None
+    tiers = _provider_tiers(start_coords, end_coords, api_key, deadline)
+
+    if hedged:
+        route = _calculate_hedged(tiers, timeout, deadline, hedge_delay)
+        if route is not None:
+            return route
+    else:
+        for name, fetch in tiers:
+            if _remaining(deadline) == 0:
+                logger.warning(f"Routing budget exhausted before trying {name}")
+                break
+            try:
+                logger.info(f"Attempting route calculation with {name}...")
+                return fetch(_request_timeout(timeout, deadline))
+            except Exception as e:
+                metrics.ROUTING_FALLBACKS.inc(tier=name)
+                logger.warning(f"{name} failed: {e}. Falling back...")
     
-    # Try OSRM as fallback
+    return calculate_offline_route(start_coords, end_coords)
+
+
+def calculate_offline_route(start_coords: List[float], end_coords: List[float]) -> Dict:
+    """
+    Calculate a route without any network call: the local road graph if it
+    covers both points, otherwise Haversine.
+    
+    Args:
+        start_coords: [lon, lat] of starting point
+        end_coords: [lon, lat] of ending point
+    
+    Returns:
+        Dict with keys: distance (km), duration (minutes), geometry (list of [lat, lon])
+    """
     try:
-        logger.info("Attempting route calculation with OSRM...")
-        return _try_osrm(start_coords, end_coords)
+        return _try_road_graph(start_coords, end_coords)
     except Exception as e:
-        logger.warning(f"OSRM failed: {e}. Falling back to Haversine calculation...")
+        metrics.ROUTING_FALLBACKS.inc(tier='Road Graph')
+        logger.warning(f"Road graph failed: {e}. Falling back...")
     
     # Use Haversine as last resort
     logger.info("Using Haversine straight-line calculation...")
     return _calculate_haversine(start_coords, end_coords)
 
 
-def _try_openrouteservice(start_coords: List[float], end_coords: List[float], api_key: str) -> Dict:
+def _provider_tiers(start_coords: List[float], end_coords: List[float], api_key: Optional[str],
+                    deadline: Optional[float]) -> List[Tuple[str, Callable[[Optional[float]], Dict]]]:
+    """
+    Road-based providers in fallback order, each as (name, fetch(timeout)).
+    Providers whose circuit breaker is open are skipped.
+    """
+    tiers = []
+    # Try OpenRouteService first (if API key available)
+    if api_key:
+        tiers.append(('OpenRouteService', 'ors',
+                      lambda t: _try_openrouteservice(start_coords, end_coords, api_key, timeout=t, deadline=deadline)))
+    # Try OSRM as fallback
+    tiers.append(('OSRM', 'osrm', lambda t: _try_osrm(start_coords, end_coords, timeout=t, deadline=deadline)))
+
+    available = []
+    for name, client, fetch in tiers:
+        if provider_clients.get_client(client).available():
+            available.append((name, fetch))
+        else:
+            logger.warning(f"{name} circuit is open, skipping")
+    return available
+
+
+def _calculate_hedged(tiers: List[Tuple[str, Callable[[Optional[float]], Dict]]], timeout: Optional[float],
+                      deadline: Optional[float], hedge_delay: float) -> Optional[Dict]:
+    """
+    Start the first provider, then start the next one whenever the current
+    ones fail or hedge_delay passes without an answer. The first successful
+    result wins.
+
+    Returns:
+        Route dict, or None if every provider failed or the deadline passed
+    """
+    pending = {}
+    next_tier = 0
+
+    def launch():
+        nonlocal next_tier
+        name, fetch = tiers[next_tier]
+        next_tier += 1
+        logger.info(f"Attempting route calculation with {name} (hedged)...")
+        pending[_executor.submit(fetch, _request_timeout(timeout, deadline))] = name
+
+    if not tiers:
+        return None
+
+    launch()
+    while pending or next_tier < len(tiers):
+        if not pending:
+            launch()
+            continue
+
+        wait_for = _remaining(deadline)
+        if next_tier < len(tiers):
+            wait_for = hedge_delay if wait_for is None else min(wait_for, hedge_delay)
+
+        done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            try:
+                return future.result()
+            except Exception as e:
+                metrics.ROUTING_FALLBACKS.inc(tier=name)
+                logger.warning(f"{name} failed: {e}")
+
+        if _remaining(deadline) == 0:
+            logger.warning("Routing budget exhausted while waiting for providers")
+            return None
+        if not done and next_tier < len(tiers):
+            launch()
+
+    return None
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left before deadline (never negative), or None without a deadline."""
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+
+def _request_timeout(timeout: Optional[float], deadline: Optional[float]) -> Optional[float]:
+    """Per-request timeout clipped to the remaining budget (None means the client default)."""
+    remaining = _remaining(deadline)
+    if remaining is None:
+        return timeout
+    if timeout is None:
+        timeout = provider_clients.default_timeout()
+    return max(min(timeout, remaining), config.PROVIDER_MIN_TIMEOUT)
+
+
+def _try_openrouteservice(start_coords: List[float], end_coords: List[float], api_key: str,
+                          timeout: Optional[float] = None, deadline: Optional[float] = None) -> Dict:
     """
     Calculate route using OpenRouteService API.
     
@@ -56,6 +202,8 @@ def _try_openrouteservice(start_coords: List[float], end_coords: List[float], ap
         start_coords: [lon, lat] of starting point
         end_coords: [lon, lat] of ending point
         api_key: OpenRouteService API key
+        timeout: Request timeout (seconds), defaults to the client's
+        deadline: Optional time.monotonic() value bounding every attempt
     
     Returns:
         Dict with distance, duration, and geometry
@@ -63,7 +211,7 @@ def _try_openrouteservice(start_coords: List[float], end_coords: List[float], ap
     Raises:
         Exception: If API call fails
     """
-    url = 'https://api.openrouteservice.org/v2/directions/driving-car'
+    url = f'{config.ORS_BASE_URL}/v2/directions/driving-car'
     
     headers = {
         'Authorization': api_key,
@@ -74,7 +222,7 @@ def _try_openrouteservice(start_coords: List[float], end_coords: List[float], ap
         'coordinates': [start_coords, end_coords]
     }
     
-    response = requests.post(url, json=body, headers=headers, timeout=10)
+    response = provider_clients.get_client('ors').post(url, json=body, headers=headers, timeout=timeout, deadline=deadline)
     
     if response.status_code == 200:
         data = response.json()
@@ -96,13 +244,16 @@ def _try_openrouteservice(start_coords: List[float], end_coords: List[float], ap
         raise Exception(f"ORS API error: {response.status_code} - {response.text}")
 
 
-def _try_osrm(start_coords: List[float], end_coords: List[float]) -> Dict:
+def _try_osrm(start_coords: List[float], end_coords: List[float],
+             timeout: Optional[float] = None, deadline: Optional[float] = None) -> Dict:
     """
     Calculate route using OSRM public API.
     
     Args:
         start_coords: [lon, lat] of starting point
         end_coords: [lon, lat] of ending point
+        timeout: Request timeout (seconds), defaults to the client's
+        deadline: Optional time.monotonic() value bounding every attempt
     
     Returns:
         Dict with distance, duration, and geometry
@@ -111,14 +262,14 @@ def _try_osrm(start_coords: List[float], end_coords: List[float]) -> Dict:
         Exception: If API call fails
     """
     # OSRM format: /route/v1/{profile}/{coordinates}
-    url = f"https://router.project-osrm.org/route/v1/driving/{start_coords[0]},{start_coords[1]};{end_coords[0]},{end_coords[1]}"
+    url = f"{config.OSRM_BASE_URL}/route/v1/driving/{start_coords[0]},{start_coords[1]};{end_coords[0]},{end_coords[1]}"
     
     params = {
         'overview': 'full',
         'geometries': 'geojson'
     }
     
-    response = requests.get(url, params=params, timeout=10)
+    response = provider_clients.get_client('osrm').get(url, params=params, timeout=timeout, deadline=deadline)
     
     if response.status_code == 200:
         data = response.json()
@@ -144,6 +295,29 @@ def _try_osrm(start_coords: List[float], end_coords: List[float]) -> Dict:
         raise Exception(f"OSRM API error: {response.status_code}")
 
 
+def _try_road_graph(start_coords: List[float], end_coords: List[float]) -> Dict:
+    """
+    Calculate route with A* over the local road network.
+    
+    Args:
+        start_coords: [lon, lat] of starting point
+        end_coords: [lon, lat] of ending point
+    
+    Returns:
+        Dict with distance, duration, and geometry
+    
+    Raises:
+        Exception: If no road network is installed or it cannot connect the points
+    """
+    graph = road_graph.get_graph()
+    if graph is None:
+        raise Exception("No road network installed")
+    
+    route = graph.route(start_coords, end_coords)
+    logger.info("✓ Road graph route calculated successfully")
+    return dict(route, source='Road Graph')
+
+
 def _calculate_haversine(start_coords: List[float], end_coords: List[float]) -> Dict:
     """
     Calculate straight-line distance and estimated duration using Haversine formula.
@@ -189,3 +363,155 @@ def _calculate_haversine(start_coords: List[float], end_coords: List[float]) ->
         'geometry': geometry,
         'source': 'Haversine'
     }
+
+
+def calculate_matrix(locations: List[List[float]], api_key: Optional[str] = None) -> Dict:
+    """
+    Calculate the full distance/duration matrix between locations with one
+    batched request, falling back from OpenRouteService to OSRM.
+
+    Args:
+        locations: List of [lon, lat] points
+        api_key: Optional OpenRouteService API key
+
+    Returns:
+        Dict with keys: distances (km), durations (minutes), both as
+        len(locations) x len(locations) nested lists, and source
+
+    Raises:
+        Exception: If every matrix provider fails
+    """
+    if api_key:
+        try:
+            logger.info("Attempting matrix calculation with OpenRouteService...")
+            return _try_openrouteservice_matrix(locations, api_key)
+        except Exception as e:
+            logger.warning(f"OpenRouteService matrix failed: {e}. Falling back to OSRM...")
+
+    logger.info("Attempting matrix calculation with OSRM...")
+    return _try_osrm_matrix(locations)
+
+
+def _try_openrouteservice_matrix(locations: List[List[float]], api_key: str) -> Dict:
+    """
+    Calculate a distance/duration matrix using the OpenRouteService matrix API.
+
+    Args:
+        locations: List of [lon, lat] points
+        api_key: OpenRouteService API key
+
+    Returns:
+        Dict with distances, durations and source
+
+    Raises:
+        Exception: If API call fails
+    """
+    url = f'{config.ORS_BASE_URL}/v2/matrix/driving-car'
+
+    headers = {
+        'Authorization': api_key,
+        'Content-Type': 'application/json'
+    }
+
+    body = {
+        'locations': locations,
+        'metrics': ['distance', 'duration'],
+        'units': 'km'
+    }
+
+    response = provider_clients.get_client('ors').post(url, json=body, headers=headers)
+
+    if response.status_code == 200:
+        data = response.json()
+        logger.info("✓ OpenRouteService matrix calculated successfully")
+        return {
+            'distances': data['distances'],
+            'durations': [[d / 60 if d is not None else None for d in row] for row in data['durations']],
+            'source': 'OpenRouteService'
+        }
+    else:
+        raise Exception(f"ORS matrix API error: {response.status_code} - {response.text}")
+
+
+def _try_osrm_matrix(locations: List[List[float]]) -> Dict:
+    """
+    Calculate a distance/duration matrix using the OSRM table API.
+
+    Args:
+        locations: List of [lon, lat] points
+
+    Returns:
+        Dict with distances, durations and source
+
+    Raises:
+        Exception: If API call fails
+    """
+    coordinates = ';'.join(f"{lon},{lat}" for lon, lat in locations)
+    url = f"{config.OSRM_BASE_URL}/table/v1/driving/{coordinates}"
+
+    params = {
+        'annotations': 'duration,distance'
+    }
+
+    response = provider_clients.get_client('osrm').get(url, params=params)
+
+    if response.status_code == 200:
+        data = response.json()
+
+        if data['code'] == 'Ok':
+            logger.info("✓ OSRM matrix calculated successfully")
+            return {
+                'distances': [[d / 1000 if d is not None else None for d in row] for row in data['distances']],
+                'durations': [[d / 60 if d is not None else None for d in row] for row in data['durations']],
+                'source': 'OSRM'
+            }
+        else:
+            raise Exception(f"OSRM table returned an error: {data.get('code', 'Unknown error')}")
+    else:
+        raise Exception(f"OSRM table API error: {response.status_code}")
+
+
+def calculate_isochrones(coords: List[float], ranges: List[int], api_key: str) -> Dict:
+    """
+    Calculate isochrones for several time ranges with a single OpenRouteService request.
+
+    Args:
+        coords: [lon, lat] of the centre point
+        ranges: Travel times in seconds
+        api_key: OpenRouteService API key
+
+    Returns:
+        GeoJSON FeatureCollection with one polygon per range (coordinates in
+        lon, lat order) and a 'seconds' property on each feature, smallest
+        range first
+
+    Raises:
+        Exception: If API call fails
+    """
+    url = f'{config.ORS_BASE_URL}/v2/isochrones/driving-car'
+
+    headers = {
+        'Authorization': api_key,
+        'Content-Type': 'application/json'
+    }
+
+    body = {
+        'locations': [coords],
+        'range': sorted(ranges)
+    }
+
+    response = provider_clients.get_client('ors').post(url, json=body, headers=headers)
+
+    if response.status_code == 200:
+        data = response.json()
+        features = []
+        for feature in sorted(data['features'], key=lambda f: f['properties']['value']):
+            features.append({
+                'type': 'Feature',
+                'properties': {'seconds': feature['properties']['value']},
+                'geometry': feature['geometry']
+            })
+        logger.info("✓ OpenRouteService isochrones calculated successfully")
+        return {'type': 'FeatureCollection', 'features': features}
+    else:
+        raise Exception(f"OpenRouteService API error: {response.status_code}")
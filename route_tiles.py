@@ -0,0 +1,185 @@
+"""
+Route Frequency Tiles
+Viewport- and zoom-sized route frequency responses for the analysis map.
+
+The map is cut into standard web map tiles (z/x/y). Each zoom reads the
+coarsest pre-aggregated level that still looks right at that scale
+(config.ROUTE_TILE_LEVELS, or the full-precision segments from
+ROUTE_TILE_BASE_ZOOM up). Connected segments with the same frequency are
+merged into polylines and simplified with Douglas-Peucker to about a pixel
+at the tile's zoom, so a tile carries a few polylines instead of thousands
+of two-point segments.
+"""
+
+import math
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import config
+import route_frequency
+
+MAX_ZOOM = 22
+TILE_SIZE = 256  # Pixels
+
+Point = Tuple[float, float]
+
+
+def level_for_zoom(zoom: int) -> int:
+    """Aggregate level drawn at a zoom: 0 (full precision) or a tile level numbered from 1."""
+    if zoom >= config.ROUTE_TILE_BASE_ZOOM:
+        return 0
+    for level, (min_zoom, _) in enumerate(config.ROUTE_TILE_LEVELS, start=1):
+        if zoom >= min_zoom:
+            return level
+    return len(config.ROUTE_TILE_LEVELS)
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """
+    Geographic bounds of a web map tile.
+
+    Returns:
+        (south, west, north, east) in degrees
+
+    Raises:
+        ValueError: If the tile does not exist
+    """
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError(f"zoom must be between 0 and {MAX_ZOOM}")
+    n = 2 ** zoom
+    if not (0 <= x < n and 0 <= y < n):
+        raise ValueError(f"tile {x}/{y} does not exist at zoom {zoom}")
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return lat(y + 1), x / n * 360 - 180, lat(y), (x + 1) / n * 360 - 180
+
+
+def merge_segments(segments: Sequence[Tuple[Point, Point, int]]) -> List[Tuple[List[Point], int]]:
+    """
+    Join connected segments with the same frequency into polylines.
+
+    Lines are walked between points where the route branches or ends, so a
+    polyline never passes through a junction; loops become closed lines.
+
+    Args:
+        segments: (p1, p2, frequency) tuples
+
+    Returns:
+        List of (points, frequency), in a deterministic order
+    """
+    by_frequency = defaultdict(list)
+    for p1, p2, frequency in segments:
+        if p1 != p2:
+            by_frequency[frequency].append((p1, p2))
+
+    lines = []
+    for frequency in sorted(by_frequency, reverse=True):
+        adjacency = defaultdict(list)
+        for p1, p2 in by_frequency[frequency]:
+            adjacency[p1].append(p2)
+            adjacency[p2].append(p1)
+        used = set()
+
+        def walk(start, following):
+            line = [start]
+            previous, current = start, following
+            used.add(frozenset((start, following)))
+            while True:
+                line.append(current)
+                neighbours = adjacency[current]
+                if len(neighbours) != 2:
+                    return line
+                following = neighbours[1] if neighbours[0] == previous else neighbours[0]
+                edge = frozenset((current, following))
+                if edge in used:
+                    return line
+                used.add(edge)
+                previous, current = current, following
+
+        # Line ends and junctions first, then whatever is left is a loop
+        starts = sorted(p for p in adjacency if len(adjacency[p]) != 2) + sorted(adjacency)
+        for start in starts:
+            for following in adjacency[start]:
+                if frozenset((start, following)) not in used:
+                    lines.append((walk(start, following), frequency))
+    return lines
+
+
+def simplify(points: List[Point], tolerance: float) -> List[Point]:
+    """
+    Douglas-Peucker simplification of a [lat, lon] polyline.
+
+    Args:
+        points: Polyline points
+        tolerance: Maximum distance (degrees of longitude) a dropped point
+            may lie from the simplified line
+
+    Returns:
+        The kept points, including both ends
+    """
+    if len(points) < 3 or tolerance <= 0:
+        return list(points)
+
+    # Stretch latitude so distances match the (Mercator) map locally
+    scale = 1 / max(math.cos(math.radians(points[0][0])), 1e-6)
+    xy = [(lon, lat * scale) for lat, lon in points]
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = xy[first], xy[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        farthest, max_distance = None, tolerance
+        for i in range(first + 1, last):
+            x, y = xy[i]
+            if length:
+                distance = abs(dy * (x - x1) - dx * (y - y1)) / length
+            else:
+                distance = math.hypot(x - x1, y - y1)
+            if distance > max_distance:
+                farthest, max_distance = i, distance
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def get_tile(zoom: int, x: int, y: int, start_date: Optional[str] = None,
+             end_date: Optional[str] = None, min_frequency: int = 1) -> Dict:
+    """
+    Merged, simplified route frequency polylines for one tile.
+
+    Args:
+        zoom, x, y: Web map tile coordinates
+        start_date: Optional first date (inclusive, YYYY-MM-DD)
+        end_date: Optional last date (inclusive, YYYY-MM-DD)
+        min_frequency: Minimum times a segment was driven
+
+    Returns:
+        Dict with level, lines (list of {'coordinates': [[lat, lon], ...],
+        'frequency'}) and max_frequency
+
+    Raises:
+        ValueError: If the tile does not exist
+    """
+    bounds = tile_bounds(zoom, x, y)
+    level = level_for_zoom(zoom)
+    segments = route_frequency.query_tile_segments(level, bounds, start_date, end_date, min_frequency)
+
+    tolerance = config.ROUTE_TILE_SIMPLIFY_PIXELS * 360 / (TILE_SIZE * 2 ** zoom)
+    lines = [
+        {'coordinates': [list(point) for point in simplify(points, tolerance)], 'frequency': frequency}
+        for points, frequency in merge_segments(segments)
+    ]
+    return {
+        'level': level,
+        'lines': lines,
+        'max_frequency': max((line['frequency'] for line in lines), default=0)
+    }
@@ -0,0 +1,63 @@
+"""
+Production Server Script
+Serves the app with gunicorn: several worker processes, each with a pool of
+request threads, sharing the database
+
+Every worker imports the app itself (nothing is preloaded, so no database
+connections or background threads are inherited across fork); startup
+migrations are serialized with migrations.startup_lock(). Workers write
+their metrics to config.METRICS_MULTIPROCESS_DIR (instance/metrics by
+default), which is cleared on start, and /metrics merges them.
+"""
+
+import argparse
+import glob
+import os
+import sys
+
+import config
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # Optional: the development server (python app.py) works without it
+    BaseApplication = None
+
+parser = argparse.ArgumentParser(description='Run the ambulance tracker with multiple worker processes')
+parser.add_argument('--bind', default=config.SERVER_BIND, help='address to listen on (host:port)')
+parser.add_argument('--workers', type=int, default=config.SERVER_WORKERS, help='worker processes')
+parser.add_argument('--threads', type=int, default=config.SERVER_THREADS, help='request threads per worker')
+parser.add_argument('--timeout', type=int, default=config.SERVER_TIMEOUT, help='seconds before a stuck worker is restarted')
+args = parser.parse_args()
+
+if BaseApplication is None:
+    sys.exit("✗ gunicorn is not installed (pip install gunicorn); use python app.py for development")
+
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for name, value in self.options.items():
+            self.cfg.set(name, value)
+
+    def load(self):
+        from app import app
+        return app
+
+
+# Metrics of the previous run's workers must not be added to this run's
+config.METRICS_MULTIPROCESS_DIR = config.METRICS_MULTIPROCESS_DIR or os.path.join(config.INSTANCE_DIR, 'metrics')
+os.makedirs(config.METRICS_MULTIPROCESS_DIR, exist_ok=True)
+for path in glob.glob(os.path.join(config.METRICS_MULTIPROCESS_DIR, '*.json')):
+    os.remove(path)
+
+Server({
+    'bind': args.bind,
+    'workers': args.workers,
+    'threads': args.threads,
+    'worker_class': 'gthread',
+    'timeout': args.timeout,
+    'preload_app': False
+}).run()
@@ -0,0 +1,338 @@
+"""
+Spatial Index
+Vectorized great-circle distances and nearest-location lookups.
+
+haversine_matrix() computes many-to-many distances with NumPy. A
+SpatialIndex buckets points into a lat/lon grid; batch queries are grouped
+by cell and compared against the surrounding cells in one vectorized step,
+with a brute-force pass for any query whose nearest point may lie further
+out. Two shared indexes are kept: the known locations (hospital and campus
+locations, the route matrix keys) and the distinct historical pickup points.
+
+A PolygonIndex prepares polygons (such as isochrones) for batch
+point-in-polygon tests: edges are bucketed into latitude bands so each
+point is only tested against the edges crossing its band.
+"""
+
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func
+
+import config
+from models import db, AmbulanceTrip
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371
+GRID_CELL = 0.01  # Grid cell size (degrees, ~1 km)
+BRUTE_FORCE_POINTS = 2048  # Indexes this small are searched without the grid
+MAX_REACH = 4  # Rings of cells searched before falling back to brute force
+CHUNK_ELEMENTS = 4_000_000  # Largest distance block computed at once
+
+_known = None
+_pickups = None
+_pickups_last_id = 0  # Last trip included in the pickup index
+_lock = threading.Lock()
+
+
+def haversine_matrix(origins: Sequence[Sequence[float]], destinations: Sequence[Sequence[float]]) -> np.ndarray:
+    """
+    Great-circle distances between every origin and every destination.
+
+    Args:
+        origins: N points as [lat, lon]
+        destinations: M points as [lat, lon]
+
+    Returns:
+        N x M array of distances in km
+    """
+    a = np.asarray(origins, dtype=float).reshape(-1, 2)
+    b = np.asarray(destinations, dtype=float).reshape(-1, 2)
+    return _haversine(a[:, None, :], b[None, :, :])
+
+
+def _haversine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Element-wise great-circle distance (km) between broadcastable [..., (lat, lon)] arrays."""
+    a, b = np.radians(a), np.radians(b)
+    lat1, lon1, lat2, lon2 = a[..., 0], a[..., 1], b[..., 0], b[..., 1]
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def _unit_vectors(coords: np.ndarray) -> np.ndarray:
+    """[lat, lon] points as 3D unit vectors; the nearest point has the largest dot product."""
+    lat, lon = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+class SpatialIndex:
+    """
+    Grid index over labelled points for batch nearest-neighbour queries.
+
+    Args:
+        coords: Points as [lat, lon]
+        labels: One dict per point, returned with each match
+    """
+
+    def __init__(self, coords: Sequence[Sequence[float]], labels: List[Dict]):
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        self.labels = labels
+        self._vectors = _unit_vectors(self.coords)
+        self._cells = defaultdict(list)
+        for i, (row, col) in enumerate(_cells(self.coords)):
+            self._cells[(row, col)].append(i)
+        self._cells = {cell: np.array(members) for cell, members in self._cells.items()}
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def nearest(self, queries: Sequence[Sequence[float]], max_km: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Nearest indexed point for each query.
+
+        Args:
+            queries: Points as [lat, lon]
+            max_km: Optional search radius; queries with nothing closer get index -1
+
+        Returns:
+            (indices, distances in km), one entry per query
+        """
+        queries = np.asarray(queries, dtype=float).reshape(-1, 2)
+        indices = np.full(len(queries), -1, dtype=int)
+        distances = np.full(len(queries), np.inf)
+        if not len(self) or not len(queries):
+            return indices, distances
+
+        if len(self) <= BRUTE_FORCE_POINTS:
+            self._brute_force(queries, np.arange(len(queries)), indices, distances)
+        else:
+            self._grid_search(queries, indices, distances)
+
+        if max_km is not None:
+            indices[distances > max_km] = -1
+        return indices, distances
+
+    def _grid_search(self, queries: np.ndarray, indices: np.ndarray, distances: np.ndarray):
+        # A point outside the block of cells within `reach` of a query's cell
+        # is at least `reach` cell widths away
+        cell_km = np.radians(GRID_CELL) * EARTH_RADIUS_KM * np.cos(np.radians(np.abs(queries[:, 0]) + GRID_CELL))
+        pending = defaultdict(list)
+        for i, cell in enumerate(_cells(queries)):
+            pending[cell].append(i)
+        pending = {cell: np.array(members) for cell, members in pending.items()}
+
+        for reach in range(1, MAX_REACH + 1):
+            remaining = {}
+            for (row, col), members in pending.items():
+                candidates = [self._cells[(r, c)]
+                              for r in range(row - reach, row + reach + 1)
+                              for c in range(col - reach, col + reach + 1) if (r, c) in self._cells]
+                if candidates:
+                    candidates = np.concatenate(candidates)
+                    block = haversine_matrix(queries[members], self.coords[candidates])
+                    best = block.argmin(axis=1)
+                    best_distance = block[np.arange(len(members)), best]
+                    certain = best_distance <= reach * cell_km[members]
+                    indices[members[certain]] = candidates[best[certain]]
+                    distances[members[certain]] = best_distance[certain]
+                    members = members[~certain]
+                if len(members):
+                    remaining[(row, col)] = members
+            pending = remaining
+            if not pending:
+                return
+
+        self._brute_force(queries, np.concatenate(list(pending.values())), indices, distances)
+
+    def _brute_force(self, queries: np.ndarray, members: np.ndarray, indices: np.ndarray, distances: np.ndarray):
+        # One matrix product per chunk instead of a full haversine block
+        step = max(CHUNK_ELEMENTS // len(self), 1)
+        for start in range(0, len(members), step):
+            chunk = members[start:start + step]
+            best = (_unit_vectors(queries[chunk]) @ self._vectors.T).argmax(axis=1)
+            indices[chunk] = best
+            distances[chunk] = _haversine(queries[chunk], self.coords[best])
+
+
+class PolygonIndex:
+    """
+    Prepared polygon for vectorized point-in-polygon tests (even-odd rule,
+    so holes and multi-polygons are handled).
+
+    Args:
+        rings: Rings as lists of [lon, lat] positions (GeoJSON order); all
+            rings of a Polygon or MultiPolygon may be passed together
+        bands: Number of latitude bands the edges are bucketed into
+    """
+
+    def __init__(self, rings: Sequence[Sequence[Sequence[float]]], bands: int = 64):
+        edges = []
+        for ring in rings:
+            ring = np.asarray(ring, dtype=float).reshape(-1, 2)
+            if len(ring) < 3:
+                continue
+            edges.append(np.column_stack((ring, np.roll(ring, -1, axis=0))))  # lon1, lat1, lon2, lat2
+        edges = np.concatenate(edges) if edges else np.empty((0, 4))
+        edges = edges[edges[:, 1] != edges[:, 3]]  # Horizontal edges never cross a ray
+        self._edges = edges
+
+        if not len(edges):
+            self.bounds = None
+            return
+        lat_min, lat_max = edges[:, [1, 3]].min(), edges[:, [1, 3]].max()
+        lon_min, lon_max = edges[:, [0, 2]].min(), edges[:, [0, 2]].max()
+        self.bounds = (lat_min, lon_min, lat_max, lon_max)
+        self._band_count = bands
+        self._band_height = (lat_max - lat_min) / bands or 1.0
+        first = self._band(np.minimum(edges[:, 1], edges[:, 3]))
+        last = self._band(np.maximum(edges[:, 1], edges[:, 3]))
+        self._bands = [np.flatnonzero((first <= b) & (last >= b)) for b in range(bands)]
+
+    def _band(self, lat: np.ndarray) -> np.ndarray:
+        bands = np.floor((lat - self.bounds[0]) / self._band_height).astype(int)
+        return np.clip(bands, 0, self._band_count - 1)
+
+    def contains(self, points: Sequence[Sequence[float]]) -> np.ndarray:
+        """
+        Test which points lie inside the polygon.
+
+        Args:
+            points: Points as [lat, lon]
+
+        Returns:
+            Boolean array, one entry per point
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        inside = np.zeros(len(points), dtype=bool)
+        if self.bounds is None or not len(points):
+            return inside
+
+        lat_min, lon_min, lat_max, lon_max = self.bounds
+        candidates = np.flatnonzero((points[:, 0] >= lat_min) & (points[:, 0] <= lat_max)
+                                    & (points[:, 1] >= lon_min) & (points[:, 1] <= lon_max))
+        bands = self._band(points[candidates, 0])
+        for band in np.unique(bands):
+            edges = self._edges[self._bands[band]]
+            members = candidates[bands == band]
+            step = max(CHUNK_ELEMENTS // max(len(edges), 1), 1)
+            for start in range(0, len(members), step):
+                chunk = members[start:start + step]
+                lat, lon = points[chunk, 0:1], points[chunk, 1:2]
+                lon1, lat1, lon2, lat2 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+                # Count crossings of a ray from each point towards increasing longitude
+                spans = (lat1 > lat) != (lat2 > lat)
+                crossing_lon = lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1)
+                inside[chunk] = (spans & (lon < crossing_lon)).sum(axis=1) % 2 == 1
+        return inside
+
+
+def nearest(points: Sequence[Sequence[float]], source: str = 'campus', max_km: Optional[float] = None) -> List[Optional[Dict]]:
+    """
+    Nearest known location or historical pickup for each point.
+    Must be called inside an application context when source includes pickups.
+
+    Args:
+        points: Points as [lat, lon]
+        source: 'campus' (hospital and campus locations), 'pickups'
+            (historical pickup points) or 'all'
+        max_km: Optional search radius
+
+    Returns:
+        One match per point (None when nothing is within max_km), each with
+        name, kind, lat, lon, distance_km and, for pickups, trip_count
+    """
+    if source not in ('campus', 'pickups', 'all'):
+        raise ValueError(f"Unknown source: {source}")
+
+    indexes = []
+    if source in ('campus', 'all'):
+        indexes.append(get_known_index())
+    if source in ('pickups', 'all'):
+        indexes.append(get_pickup_index())
+
+    matches = [None] * len(points)
+    best = np.full(len(points), np.inf)
+    for index in indexes:
+        found, distances = index.nearest(points, max_km)
+        for i in np.flatnonzero((found >= 0) & (distances < best)):
+            best[i] = distances[i]
+            lat, lon = index.coords[found[i]]
+            matches[i] = dict(index.labels[found[i]], lat=float(lat), lon=float(lon),
+                              distance_km=round(float(distances[i]), 4))
+    return matches
+
+
+def snap_known(coords: List[float], max_km: float) -> Optional[List[float]]:
+    """
+    Snap a point to the nearest hospital/campus location.
+
+    Args:
+        coords: [lon, lat] point
+        max_km: Snap radius
+
+    Returns:
+        [lon, lat] of the known location, or None if none is within max_km
+    """
+    index = get_known_index()
+    found, _ = index.nearest([[coords[1], coords[0]]], max_km)
+    if found[0] < 0:
+        return None
+    lat, lon = index.coords[found[0]]
+    return [float(lon), float(lat)]
+
+
+def get_known_index() -> SpatialIndex:
+    """Shared index over the hospital and campus locations (route matrix keys)."""
+    global _known
+    if _known is None:
+        with _lock:
+            if _known is None:
+                locations = [(config.HOSPITAL_NAME, config.HOSPITAL_COORDS, 'hospital')]
+                locations += [(name, coords, 'campus') for name, coords in config.CAMPUS_LOCATIONS.items()]
+                _known = SpatialIndex(
+                    [coords for _, coords, _ in locations],
+                    [{'name': name, 'kind': kind} for name, _, kind in locations]
+                )
+    return _known
+
+
+def get_pickup_index() -> SpatialIndex:
+    """
+    Shared index over distinct historical pickup points, built on first use
+    and rebuilt once trips have been added (by this or another worker process).
+    Must be called inside an application context.
+    """
+    global _pickups, _pickups_last_id
+    last_trip_id = db.session.query(func.max(AmbulanceTrip.id)).scalar() or 0
+    if _pickups is None or last_trip_id > _pickups_last_id:
+        with _lock:
+            if _pickups is None or last_trip_id > _pickups_last_id:
+                rows = db.session.query(
+                    AmbulanceTrip.pickup_lat, AmbulanceTrip.pickup_lon, AmbulanceTrip.pickup_location,
+                    func.count(AmbulanceTrip.id)
+                ).filter(AmbulanceTrip.id <= last_trip_id).group_by(
+                    AmbulanceTrip.pickup_lat, AmbulanceTrip.pickup_lon, AmbulanceTrip.pickup_location
+                ).all()
+                _pickups = SpatialIndex(
+                    [[lat, lon] for lat, lon, _, _ in rows],
+                    [{'name': name, 'kind': 'pickup', 'trip_count': count} for _, _, name, count in rows]
+                )
+                _pickups_last_id = last_trip_id
+                logger.info(f"✓ Pickup index built with {len(rows)} points")
+    return _pickups
+
+
+def invalidate_pickups():
+    """Drop the pickup index so the next query rebuilds it with new trips."""
+    global _pickups
+    with _lock:
+        _pickups = None
+
+
+def _cells(coords: np.ndarray) -> List[Tuple[int, int]]:
+    cells = np.floor(coords / GRID_CELL).astype(int)
+    return [tuple(cell) for cell in cells.tolist()]
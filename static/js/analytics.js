@@ -57,36 +57,11 @@ function displayRouteFrequency(segments) {
     });
 }
 
-// Calculate statistics from trip data
-function calculateStatistics(trips) {
-    if (!trips || trips.length === 0) {
-        return null;
-    }
-
-    const totalDistance = trips.reduce((sum, trip) => sum + trip.distance_km, 0);
-    const totalDuration = trips.reduce((sum, trip) => sum + trip.duration_minutes, 0);
-    const avgDistance = totalDistance / trips.length;
-    const avgDuration = totalDuration / trips.length;
-
-    // Find most common pickup location
-    const locationCounts = {};
-    trips.forEach(trip => {
-        locationCounts[trip.pickup_location] = (locationCounts[trip.pickup_location] || 0) + 1;
-    });
-
-    const mostCommonLocation = Object.keys(locationCounts).reduce((a, b) =>
-        locationCounts[a] > locationCounts[b] ? a : b
-    );
-
-    return {
-        totalTrips: trips.length,
-        totalDistance: totalDistance.toFixed(2),
-        totalDuration: Math.round(totalDuration),
-        avgDistance: avgDistance.toFixed(2),
-        avgDuration: Math.round(avgDuration),
-        mostCommonLocation: mostCommonLocation,
-        locationCount: locationCounts[mostCommonLocation]
-    };
+// Fetch trip statistics computed on the server
+async function fetchStatistics(params = {}) {
+    const response = await fetch('/api/stats/summary?' + new URLSearchParams(params));
+    const data = await response.json();
+    return data.success ? data.statistics : null;
 }
 
 // Display statistics on the page
@@ -97,27 +72,23 @@ function displayStatistics(stats) {
     // You can add a statistics panel to the UI if needed
 }
 
-// Analyze peak hours from trip data
-function analyzePeakHours(trips) {
-    const hourCounts = new Array(24).fill(0);
-
-    trips.forEach(trip => {
-        const hour = parseInt(trip.time.split(':')[0]);
-        hourCounts[hour]++;
-    });
-
-    const peakHour = hourCounts.indexOf(Math.max(...hourCounts));
+// Fetch trips per hour of day and the peak hour from the server
+async function fetchPeakHours(params = {}) {
+    const response = await fetch('/api/stats/hourly?' + new URLSearchParams(params));
+    const data = await response.json();
+    if (!data.success) {
+        return null;
+    }
     return {
-        peakHour: peakHour,
-        peakCount: hourCounts[peakHour],
-        hourlyDistribution: hourCounts
+        peakHour: data.peakHour,
+        peakCount: data.peakCount,
+        hourlyDistribution: data.hourlyDistribution
     };
 }
 
 // Export analytics data
-function exportAnalytics(trips) {
-    const stats = calculateStatistics(trips);
-    const peakHours = analyzePeakHours(trips);
+async function exportAnalytics(params = {}) {
+    const [stats, peakHours] = await Promise.all([fetchStatistics(params), fetchPeakHours(params)]);
 
     return {
         statistics: stats,
@@ -4,6 +4,10 @@ let hospitalCoords = [19.1309507, 72.9146062];
 let ambulanceMarker;
 let currentRoute = null;
 let pickupMarker = null;
+let routeFrequencyLayer;
+const routeFrequencyTiles = new Map(); // 'z/x/y' -> tile response
+const ROUTE_FREQUENCY_TILE_SIZE = 256;
+const ROUTE_FREQUENCY_MAX_TILES = 500; // Fetched tiles kept in memory
 
 // Initialize on page load
 document.addEventListener('DOMContentLoaded', function () {
@@ -48,6 +52,10 @@ function initializeMaps() {
         })
     }).addTo(analysisMap).bindPopup('<b>IITB Hospital</b>');
 
+    // Route frequency is fetched per tile for the visible area and zoom
+    routeFrequencyLayer = L.layerGroup().addTo(analysisMap);
+    analysisMap.on('moveend', () => loadRouteFrequency());
+
     // Load analytics data
     loadIsochrones();
     loadRouteFrequency();
@@ -128,7 +136,8 @@ async function handleFormSubmit(e) {
         patient_name: formData.get('patientName'),
         driver_name: formData.get('driverName'),
         purpose: formData.get('purpose'),
-        notes: formData.get('notes')
+        notes: formData.get('notes'),
+        geometry_format: 'polyline'
     };
 
     // Show loading
@@ -156,7 +165,7 @@ async function handleFormSubmit(e) {
             loadCurrentOdometer();
 
             // Reload analytics
-            loadRouteFrequency();
+            loadRouteFrequency(true);
         } else {
             alert('Error: ' + data.error);
         }
@@ -183,8 +192,8 @@ function displayRoute(data, locationData) {
     }).addTo(routeMap).bindPopup(`<b>${locationData.name}</b>`);
 
     // Combine route geometries
-    const route1Coords = data.route1.geometry;
-    const route2Coords = data.route2.geometry;
+    const route1Coords = routeCoords(data.route1);
+    const route2Coords = routeCoords(data.route2);
     const allCoords = [...route1Coords, ...route2Coords];
 
     // Draw route
@@ -201,6 +210,32 @@ function displayRoute(data, locationData) {
     animateAmbulance(allCoords);
 }
 
+// Route geometry as [lat, lon] pairs, decoding encoded polylines
+function routeCoords(route) {
+    return route.geometry_format === 'polyline' ? decodePolyline(route.geometry) : route.geometry;
+}
+
+// Decode an encoded polyline (5 decimal precision) into [lat, lon] pairs
+function decodePolyline(encoded) {
+    const coords = [];
+    let index = 0, lat = 0, lon = 0;
+
+    while (index < encoded.length) {
+        for (const axis of [0, 1]) {
+            let result = 0, shift = 0, b;
+            do {
+                b = encoded.charCodeAt(index++) - 63;
+                result |= (b & 0x1f) << shift;
+                shift += 5;
+            } while (b >= 0x20);
+            const delta = (result & 1) ? ~(result >> 1) : (result >> 1);
+            if (axis === 0) lat += delta; else lon += delta;
+        }
+        coords.push([lat / 1e5, lon / 1e5]);
+    }
+    return coords;
+}
+
 // Clear route from map (but keep ambulance at hospital)
 function clearRoute() {
     if (currentRoute) {
@@ -309,34 +344,68 @@ async function loadIsochrones() {
     }
 }
 
-// Load route frequency (called from analytics.js)
-async function loadRouteFrequency() {
-    try {
-        const response = await fetch('/api/get-route-frequency');
-        const data = await response.json();
-
-        if (data.success && data.segments.length > 0) {
-            data.segments.forEach(segment => {
-                const frequency = segment.normalized_frequency;
-                let color;
-
-                // Color based on frequency
-                if (frequency > 0.7) {
-                    color = '#ef4444'; // Red - high frequency
-                } else if (frequency > 0.4) {
-                    color = '#f97316'; // Orange - medium frequency
-                } else {
-                    color = '#fbbf24'; // Yellow - low frequency
-                }
-
-                L.polyline(segment.coordinates, {
-                    color: color,
-                    weight: 6,
-                    opacity: 0.7
-                }).addTo(analysisMap).bindPopup(`Used ${segment.frequency} times`);
-            });
+// Tiles ('z/x/y') covering the visible part of the analysis map
+function visibleRouteFrequencyTiles(zoom) {
+    const bounds = analysisMap.getBounds();
+    const min = analysisMap.project(bounds.getNorthWest(), zoom).divideBy(ROUTE_FREQUENCY_TILE_SIZE).floor();
+    const max = analysisMap.project(bounds.getSouthEast(), zoom).divideBy(ROUTE_FREQUENCY_TILE_SIZE).floor();
+    const n = Math.pow(2, zoom);
+    const keys = [];
+    for (let x = min.x; x <= max.x; x++) {
+        for (let y = Math.max(min.y, 0); y <= Math.min(max.y, n - 1); y++) {
+            keys.push(`${zoom}/${((x % n) + n) % n}/${y}`);
         }
+    }
+    return keys;
+}
+
+// Load route frequency for the visible tiles (refresh drops tiles fetched before)
+async function loadRouteFrequency(refresh = false) {
+    if (refresh || routeFrequencyTiles.size > ROUTE_FREQUENCY_MAX_TILES) {
+        routeFrequencyTiles.clear();
+    }
+    const zoom = Math.round(analysisMap.getZoom());
+    const keys = visibleRouteFrequencyTiles(zoom);
+
+    try {
+        await Promise.all(keys.filter(key => !routeFrequencyTiles.has(key)).map(async key => {
+            const response = await fetch(`/api/route-frequency/tiles/${key}`);
+            const data = await response.json();
+            if (data.success) {
+                routeFrequencyTiles.set(key, data);
+            }
+        }));
     } catch (error) {
         console.error('Error loading route frequency:', error);
     }
+
+    // A later call draws the map if it moved to another zoom meanwhile
+    if (Math.round(analysisMap.getZoom()) !== zoom) {
+        return;
+    }
+
+    const tiles = keys.map(key => routeFrequencyTiles.get(key)).filter(Boolean);
+    const maxFrequency = Math.max(1, ...tiles.map(tile => tile.max_frequency));
+    routeFrequencyLayer.clearLayers();
+    tiles.forEach(tile => {
+        tile.lines.forEach(line => {
+            const frequency = line.frequency / maxFrequency;
+            let color;
+
+            // Color based on frequency
+            if (frequency > 0.7) {
+                color = '#ef4444'; // Red - high frequency
+            } else if (frequency > 0.4) {
+                color = '#f97316'; // Orange - medium frequency
+            } else {
+                color = '#fbbf24'; // Yellow - low frequency
+            }
+
+            L.polyline(line.coordinates, {
+                color: color,
+                weight: 6,
+                opacity: 0.7
+            }).addTo(routeFrequencyLayer).bindPopup(`Used ${line.frequency} times`);
+        });
+    });
 }
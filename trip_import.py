@@ -0,0 +1,297 @@
+"""
+Trip Import
+Bulk import of historical trips from CSV or JSONL.
+
+Records are streamed in batches. Within each batch the distinct pickup
+points are resolved once (two legs each, fetched concurrently), trips are
+chained on the odometer in file order, and rows are written with a single
+executemany insert plus one aggregate update per batch. The live odometer
+only moves forward: a backfilled chain (start_odometer or explicit readings
+below the current reading) never pulls it back over stored trips.
+"""
+
+import csv
+import io
+import json
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from sqlalchemy import insert
+
+import config
+import fleet
+import geometry_codec
+import response_cache
+import route_frequency
+import trip_stats
+from models import db, AmbulanceTrip
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_FIELDS = ['date', 'time', 'pickup_location', 'patient_name', 'driver_name', 'purpose']
+MAX_REPORTED_ERRORS = 100
+
+
+class TripImportError(Exception):
+    """Raised for a record that cannot be imported."""
+
+
+def read_records(stream: TextIO, fmt: str) -> Iterator[Dict]:
+    """
+    Stream records from a CSV or JSONL file.
+
+    Args:
+        stream: Text stream
+        fmt: 'csv' or 'jsonl'
+
+    Yields:
+        One dict per CSV row, or the JSON text of each JSONL line (decoded
+        by import_trips, so a malformed line is skipped and reported like
+        any other invalid record)
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield line
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+
+def detect_format(filename: str) -> str:
+    """Guess 'csv' or 'jsonl' from a file name."""
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def import_trips(records: Iterable[Dict], resolve_routes: Callable[[List[Tuple]], List[Dict]],
+                 batch_size: int = 1000, start_odometer: Optional[float] = None,
+                 progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """
+    Import trips in batches. Must be called inside an application context.
+
+    Args:
+        records: Iterable of dicts (or JSON object text) with date
+            (YYYY-MM-DD), time (HH:MM), pickup_location, patient_name,
+            driver_name, purpose and optional notes, pickup_lat/pickup_lon
+            (required unless pickup_location is a known campus location) and
+            km_reading_start/km_reading_end
+        resolve_routes: Function taking a list of (start, end) [lon, lat]
+            pairs and returning one route dict per pair
+        batch_size: Records inserted per commit
+        start_odometer: Odometer before the first imported trip (defaults to
+            the current odometer of trips recorded without a vehicle); the
+            live odometer is only advanced if the chain ends beyond it
+        progress: Optional callback receiving the running summary after each batch
+
+    Returns:
+        Summary dict with imported, skipped, errors, unique_routes, elapsed
+        and rows_per_second
+
+    Raises:
+        ValueError: If batch_size is not positive
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be a positive integer")
+
+    summary = {'imported': 0, 'skipped': 0, 'errors': [], 'unique_routes': 0,
+               'elapsed': 0.0, 'rows_per_second': 0.0}
+    routes = {}  # rounded pickup point -> resolved round trip
+    started = time.perf_counter()
+
+    batch = []
+    for line, record in enumerate(records, 1):
+        try:
+            batch.append(_parse(record))
+        except (TripImportError, ValueError, KeyError, TypeError) as e:
+            summary['skipped'] += 1
+            if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                summary['errors'].append({'record': line, 'error': str(e)})
+            continue
+
+        if len(batch) >= batch_size:
+            end_odometer = _import_batch(batch, routes, resolve_routes, start_odometer, summary)
+            if start_odometer is not None:
+                start_odometer = end_odometer  # A backfilled chain continues where it stopped
+            _report(summary, started, progress)
+            batch = []
+
+    if batch:
+        _import_batch(batch, routes, resolve_routes, start_odometer, summary)
+    _report(summary, started, progress)
+    return summary
+
+
+def _parse(record) -> Dict:
+    """Validate a raw record (dict, or JSON object text) and convert its fields."""
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError as e:
+            raise TripImportError(f"Invalid JSON: {e}")
+    if not isinstance(record, dict):
+        raise TripImportError("Record is not an object")
+    missing = [field for field in REQUIRED_FIELDS if not record.get(field)]
+    if missing:
+        raise TripImportError(f"Missing fields: {', '.join(missing)}")
+
+    departure_time = datetime.strptime(f"{record['date']} {record['time']}", "%Y-%m-%d %H:%M")
+
+    if record.get('pickup_lat') not in (None, '') and record.get('pickup_lon') not in (None, ''):
+        pickup_lat, pickup_lon = float(record['pickup_lat']), float(record['pickup_lon'])
+    elif record['pickup_location'] in config.CAMPUS_LOCATIONS:
+        pickup_lat, pickup_lon = config.CAMPUS_LOCATIONS[record['pickup_location']]
+    else:
+        raise TripImportError(f"Unknown pickup location without coordinates: {record['pickup_location']}")
+
+    def optional_float(name):
+        value = record.get(name)
+        return float(value) if value not in (None, '') else None
+
+    return {
+        'departure_time': departure_time,
+        'pickup_location': record['pickup_location'],
+        'pickup_lat': pickup_lat,
+        'pickup_lon': pickup_lon,
+        'patient_name': record['patient_name'],
+        'driver_name': record['driver_name'],
+        'purpose': record['purpose'],
+        'notes': record.get('notes') or '',
+        'km_reading_start': optional_float('km_reading_start'),
+        'km_reading_end': optional_float('km_reading_end')
+    }
+
+
+def _import_batch(batch: List[Dict], routes: Dict, resolve_routes: Callable, start_odometer: Optional[float],
+                  summary: Dict) -> float:
+    """
+    Resolve new pickup points, chain odometers, insert and commit one batch.
+    Readings continue from start_odometer, or from the current odometer if
+    None; the odometer is locked from then until the commit, so concurrent
+    submissions are chained after the batch. Returns the last reading of
+    the batch's chain.
+    """
+    hospital = [config.HOSPITAL_COORDS[1], config.HOSPITAL_COORDS[0]]
+
+    # Resolve each distinct pickup point once
+    new_points = []
+    for trip in batch:
+        key = _point_key(trip)
+        if key not in routes and key not in new_points:
+            new_points.append(key)
+    if new_points:
+        legs = []
+        for lat, lon in new_points:
+            pickup = [lon, lat]
+            legs += [(hospital, pickup), (pickup, hospital)]
+        resolved = resolve_routes(legs)
+        for i, key in enumerate(new_points):
+            route1, route2 = resolved[2 * i], resolved[2 * i + 1]
+            geometry = route1['geometry'] + route2['geometry']
+            routes[key] = {
+                'distance': route1['distance'] + route2['distance'],
+                'duration': route1['duration'] + route2['duration'],
+                'polyline': geometry_codec.encode_polyline(geometry),
+                'segments': route_frequency.segment_counts(geometry),
+                'level_segments': route_frequency.level_segment_counts(geometry)
+            }
+        summary['unique_routes'] += len(new_points)
+
+    current = fleet.advance_odometer(None, 0)[1]
+    odometer = current if start_odometer is None else start_odometer
+    highest = current
+    rows = []
+    segment_totals = Counter()
+    level_totals = Counter()
+    for trip in batch:
+        route = routes[_point_key(trip)]
+        km_reading_start = trip['km_reading_start'] if trip['km_reading_start'] is not None else odometer
+        km_reading_end = trip['km_reading_end'] if trip['km_reading_end'] is not None \
+            else km_reading_start + route['distance']
+        odometer = km_reading_end
+        highest = max(highest, km_reading_end)
+
+        departure_time = trip['departure_time']
+        rows.append({
+            'date': departure_time.date(),
+            'time': departure_time.time(),
+            'km_reading_start': km_reading_start,
+            'km_reading_end': km_reading_end,
+            'pickup_location': trip['pickup_location'],
+            'pickup_lat': trip['pickup_lat'],
+            'pickup_lon': trip['pickup_lon'],
+            'patient_name': trip['patient_name'],
+            'driver_name': trip['driver_name'],
+            'purpose': trip['purpose'],
+            'notes': trip['notes'],
+            'distance_km': route['distance'],
+            'duration_minutes': route['duration'],
+            'departure_time': departure_time,
+            'arrival_time': departure_time + timedelta(minutes=route['duration']),
+            'route_polyline': route['polyline']
+        })
+
+        date = departure_time.date().isoformat()
+        for segment, n in route['segments'].items():
+            segment_totals[(date, segment)] += n
+        for (level, segment), n in route['level_segments'].items():
+            level_totals[(level, date, segment)] += n
+
+    try:
+        # Never move the live odometer back over trips already recorded
+        fleet.advance_odometer(None, highest - current)
+        db.session.execute(insert(AmbulanceTrip), rows)
+        route_frequency.record_counts(segment_totals)
+        route_frequency.record_level_counts(level_totals)
+        trip_stats.record_trips(
+            (row['date'], row['time'], row['pickup_location'], row['distance_km'], row['duration_minutes'])
+            for row in rows
+        )
+        response_cache.record_change()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    summary['imported'] += len(rows)
+    return odometer
+
+
+def _report(summary: Dict, started: float, progress: Optional[Callable[[Dict], None]]):
+    summary['elapsed'] = round(time.perf_counter() - started, 3)
+    summary['rows_per_second'] = round(summary['imported'] / summary['elapsed'], 1) if summary['elapsed'] else 0.0
+    logger.info(f"Imported {summary['imported']} trips ({summary['rows_per_second']} rows/s)")
+    if progress:
+        progress(summary)
+
+
+def _point_key(trip: Dict) -> Tuple[float, float]:
+    p = config.ROUTE_CACHE_PRECISION
+    return (round(trip['pickup_lat'], p), round(trip['pickup_lon'], p))
+
+
+def text_stream(binary: BinaryIO) -> TextIO:
+    """Wrap a binary stream (e.g. an upload) as UTF-8 text without reading it all."""
+    if not isinstance(binary, io.IOBase):
+        # WSGI input from servers such as gunicorn only has read()
+        binary = io.BufferedReader(_RawStream(binary))
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+class _RawStream(io.RawIOBase):
+    """Minimal raw I/O over an object that only implements read(size)."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
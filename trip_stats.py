@@ -0,0 +1,233 @@
+"""
+Trip Statistics
+Daily rollup tables and the aggregate queries behind /api/stats.
+
+Every submitted trip adds to three small rollups (per date, per date/hour,
+per date/pickup location) in the same transaction as the trip, so the
+statistics endpoints read a few rows per day instead of scanning trips.
+"""
+
+import logging
+from collections import Counter
+from datetime import date as date_type
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+
+from models import db, AmbulanceTrip, TripDailyStats, TripHourlyStats, TripLocationStats
+import db_utils
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def record_trip(trip: AmbulanceTrip):
+    """
+    Add a trip to the rollups within the current session.
+    The caller commits (or rolls back) together with the trip.
+    """
+    record_trips([(trip.date, trip.time, trip.pickup_location, trip.distance_km, trip.duration_minutes)])
+
+
+def record_trips(trips) -> int:
+    """
+    Add several trips to the rollups within the current session.
+
+    Args:
+        trips: Iterable of (date, time, pickup_location, distance_km, duration_minutes)
+
+    Returns:
+        Number of trips added
+    """
+    daily = {}
+    hourly = Counter()
+    locations = Counter()
+    count = 0
+
+    for date, time, pickup_location, distance, duration in trips:
+        date = date.isoformat()
+        trips_on_date, total_distance, total_duration = daily.get(date, (0, 0.0, 0.0))
+        daily[date] = (trips_on_date + 1, total_distance + distance, total_duration + duration)
+        hourly[(date, time.hour)] += 1
+        locations[(date, pickup_location)] += 1
+        count += 1
+
+    _add(daily, hourly, locations)
+    return count
+
+
+def record_adjustment(date: date_type, distance_delta: float, duration_delta: float):
+    """
+    Correct a date's distance/duration totals after a trip's route changed,
+    without counting the trip again.
+    """
+    db_utils.upsert_add(TripDailyStats, [{
+        'date': date.isoformat(), 'trip_count': 0,
+        'total_distance_km': distance_delta, 'total_duration_minutes': duration_delta
+    }], ['date'], ['trip_count', 'total_distance_km', 'total_duration_minutes'])
+
+
+def rebuild(batch_size: int = 500) -> int:
+    """
+    Recompute every rollup from stored trips and commit.
+
+    Args:
+        batch_size: Trips fetched per round trip to the database
+
+    Returns:
+        Number of trips aggregated
+    """
+    query = db.session.query(
+        AmbulanceTrip.date, AmbulanceTrip.time, AmbulanceTrip.pickup_location,
+        AmbulanceTrip.distance_km, AmbulanceTrip.duration_minutes
+    )
+
+    TripDailyStats.query.delete()
+    TripHourlyStats.query.delete()
+    TripLocationStats.query.delete()
+    count = record_trips(query.yield_per(batch_size))
+    db.session.commit()
+
+    logger.info(f"✓ Trip statistics rebuilt from {count} trips")
+    return count
+
+
+def is_stale() -> bool:
+    """Return True if trips exist but the rollups have never been built."""
+    return TripDailyStats.query.first() is None and AmbulanceTrip.query.first() is not None
+
+
+def summary(start_date: Optional[str] = None, end_date: Optional[str] = None) -> Optional[Dict]:
+    """
+    Totals, averages and most common pickup location.
+
+    Returns:
+        Dict mirroring analytics.js calculateStatistics, or None if there are no trips
+    """
+    trips, total_distance, total_duration = _date_filter(db.session.query(
+        func.coalesce(func.sum(TripDailyStats.trip_count), 0),
+        func.coalesce(func.sum(TripDailyStats.total_distance_km), 0.0),
+        func.coalesce(func.sum(TripDailyStats.total_duration_minutes), 0.0)
+    ), TripDailyStats, start_date, end_date).one()
+
+    if not trips:
+        return None
+
+    location_count = func.sum(TripLocationStats.trip_count)
+    most_common = _date_filter(
+        db.session.query(TripLocationStats.pickup_location, location_count),
+        TripLocationStats, start_date, end_date
+    ).group_by(TripLocationStats.pickup_location).order_by(location_count.desc()).first()
+
+    return {
+        'totalTrips': trips,
+        'totalDistance': round(total_distance, 2),
+        'totalDuration': round(total_duration),
+        'avgDistance': round(total_distance / trips, 2),
+        'avgDuration': round(total_duration / trips),
+        'mostCommonLocation': most_common[0],
+        'locationCount': most_common[1]
+    }
+
+
+def hourly(start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict:
+    """
+    Trips per hour of day.
+
+    Returns:
+        Dict mirroring analytics.js analyzePeakHours
+    """
+    rows = _date_filter(
+        db.session.query(TripHourlyStats.hour, func.sum(TripHourlyStats.trip_count)),
+        TripHourlyStats, start_date, end_date
+    ).group_by(TripHourlyStats.hour)
+
+    distribution = [0] * 24
+    for hour, count in rows:
+        distribution[hour] = count
+
+    peak_hour = distribution.index(max(distribution))
+    return {
+        'peakHour': peak_hour,
+        'peakCount': distribution[peak_hour],
+        'hourlyDistribution': distribution
+    }
+
+
+def daily(start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict:
+    """
+    Trips per date and per day of week.
+
+    Returns:
+        Dict with days (list of per-date totals) and weekdayDistribution
+    """
+    days = []
+    weekday_distribution = [0] * 7
+    for row in _daily_rows(start_date, end_date):
+        days.append({
+            'date': row.date,
+            'trips': row.trip_count,
+            'distance': round(row.total_distance_km, 2),
+            'duration': round(row.total_duration_minutes)
+        })
+        weekday_distribution[_parse_date(row.date).weekday()] += row.trip_count
+
+    return {
+        'days': days,
+        'weekdays': WEEKDAYS,
+        'weekdayDistribution': weekday_distribution
+    }
+
+
+def weekly(start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict:
+    """
+    Trips per ISO week.
+
+    Returns:
+        Dict with weeks (list of per-week totals, e.g. '2025-W47')
+    """
+    weeks = {}
+    for row in _daily_rows(start_date, end_date):
+        year, week, _ = _parse_date(row.date).isocalendar()
+        key = f"{year}-W{week:02d}"
+        totals = weeks.setdefault(key, {'week': key, 'trips': 0, 'distance': 0.0, 'duration': 0.0})
+        totals['trips'] += row.trip_count
+        totals['distance'] += row.total_distance_km
+        totals['duration'] += row.total_duration_minutes
+
+    for totals in weeks.values():
+        totals['distance'] = round(totals['distance'], 2)
+        totals['duration'] = round(totals['duration'])
+    return {'weeks': list(weeks.values())}
+
+
+def _add(daily: Dict, hourly: Dict, locations: Dict):
+    db_utils.upsert_add(TripDailyStats, [
+        {'date': date, 'trip_count': trips, 'total_distance_km': distance, 'total_duration_minutes': duration}
+        for date, (trips, distance, duration) in daily.items()
+    ], ['date'], ['trip_count', 'total_distance_km', 'total_duration_minutes'])
+    db_utils.upsert_add(TripHourlyStats, [
+        {'date': date, 'hour': hour, 'trip_count': trips}
+        for (date, hour), trips in hourly.items()
+    ], ['date', 'hour'], ['trip_count'])
+    db_utils.upsert_add(TripLocationStats, [
+        {'date': date, 'pickup_location': location, 'trip_count': trips}
+        for (date, location), trips in locations.items()
+    ], ['date', 'pickup_location'], ['trip_count'])
+
+
+def _daily_rows(start_date: Optional[str], end_date: Optional[str]) -> List[TripDailyStats]:
+    return _date_filter(TripDailyStats.query, TripDailyStats, start_date, end_date).order_by(TripDailyStats.date).all()
+
+
+def _date_filter(query, model, start_date: Optional[str], end_date: Optional[str]):
+    if start_date:
+        query = query.filter(model.date >= start_date)
+    if end_date:
+        query = query.filter(model.date <= end_date)
+    return query
+
+
+def _parse_date(value: str) -> date_type:
+    return date_type.fromisoformat(value)
@@ -0,0 +1,175 @@
+"""
+Trip Routing Worker
+Background routing for trips submitted asynchronously.
+
+An async submission is saved at once with a provisional offline estimate
+and route_status 'pending'. A local thread pool then computes the real
+route and applies the difference to the trip, to the odometer readings of
+every later trip, and to the statistics rollups in one transaction. All
+adjustments are deltas, so trips finishing in any order leave the odometer
+chain consistent. While no provider can route a trip (both legs come back
+from the offline fallbacks) it stays pending and is retried with
+exponential backoff. With several worker processes each re-queues the pending
+trips at startup; the first to finish a trip applies it and the others
+discard their result.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Dict, List, Tuple
+
+import config
+import fleet
+import geometry_codec
+import response_cache
+import route_frequency
+import route_optimizer
+import trip_stats
+from models import db, AmbulanceTrip, Vehicle
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+COMPLETE = 'complete'
+FAILED = 'failed'
+
+_app = None
+_resolve_routes = None
+_executor = None
+_attempts = {}  # trip id -> offline-only routing attempts so far
+_attempts_lock = threading.Lock()
+
+
+def init_app(app, resolve_routes: Callable[[List[Tuple]], List[Dict]]):
+    """
+    Start the worker pool and re-queue trips left pending by a previous run.
+
+    Args:
+        app: Flask application (workers run inside its app context)
+        resolve_routes: Function taking a list of (start, end) [lon, lat]
+            pairs and returning one route dict per pair
+    """
+    global _app, _resolve_routes, _executor
+    _app = app
+    _resolve_routes = resolve_routes
+    _executor = ThreadPoolExecutor(max_workers=config.ROUTING_WORKERS, thread_name_prefix='trip-routing')
+
+    with app.app_context():
+        pending = [trip_id for (trip_id,) in db.session.query(AmbulanceTrip.id).filter(
+            AmbulanceTrip.route_status == PENDING
+        ).order_by(AmbulanceTrip.id)]
+    for trip_id in pending:
+        enqueue(trip_id)
+    if pending:
+        logger.info(f"Re-queued {len(pending)} pending trips for routing")
+
+
+def provisional_routes(start_coords: List[float], end_coords: List[float]) -> Tuple[Dict, Dict]:
+    """Offline (road graph or Haversine) estimates for the outbound and return legs."""
+    return (route_optimizer.calculate_offline_route(start_coords, end_coords),
+            route_optimizer.calculate_offline_route(end_coords, start_coords))
+
+
+def enqueue(trip_id: int):
+    """Schedule a pending trip for routing."""
+    _executor.submit(_process, trip_id)
+
+
+def _retry_later(trip_id: int):
+    """Re-queue a trip after a delay that doubles with each offline-only attempt."""
+    with _attempts_lock:
+        attempt = _attempts.get(trip_id, 0)
+        _attempts[trip_id] = attempt + 1
+    delay = min(config.ROUTING_RETRY_DELAY * 2 ** attempt, config.ROUTING_RETRY_MAX_DELAY)
+    logger.warning(f"No routing provider reachable for trip {trip_id}; retrying in {delay}s")
+    timer = threading.Timer(delay, enqueue, args=(trip_id,))
+    timer.daemon = True
+    timer.start()
+
+
+def _process(trip_id: int):
+    with _app.app_context():
+        try:
+            _route_trip(trip_id)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Routing trip {trip_id} failed: {e}")
+            AmbulanceTrip.query.filter_by(id=trip_id, route_status=PENDING).update(
+                {'route_status': FAILED}, synchronize_session=False
+            )
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+
+def _route_trip(trip_id: int):
+    trip = db.session.get(AmbulanceTrip, trip_id)
+    if trip is None or trip.route_status != PENDING:
+        return
+
+    hospital_coords = [config.HOSPITAL_COORDS[1], config.HOSPITAL_COORDS[0]]
+    pickup_coords = [trip.pickup_lon, trip.pickup_lat]
+    route1, route2 = _resolve_routes([(hospital_coords, pickup_coords), (pickup_coords, hospital_coords)])
+    offline = [route.get('source') in route_optimizer.OFFLINE_SOURCES for route in (route1, route2)]
+    if all(offline):
+        # Nothing better than the provisional estimate yet
+        db.session.rollback()
+        _retry_later(trip_id)
+        return
+    with _attempts_lock:
+        _attempts.pop(trip_id, None)
+
+    total_distance = route1['distance'] + route2['distance']
+    total_duration = route1['duration'] + route2['duration']
+    combined_geometry = route1['geometry'] + route2['geometry']
+    distance_delta = total_distance - trip.distance_km
+    duration_delta = total_duration - trip.duration_minutes
+
+    arrival_time = trip.departure_time + timedelta(minutes=total_duration)
+
+    # Only the worker that moves the trip out of 'pending' applies the deltas
+    updated = AmbulanceTrip.query.filter_by(id=trip_id, route_status=PENDING).update({
+        'distance_km': total_distance,
+        'duration_minutes': total_duration,
+        'arrival_time': arrival_time,
+        'km_reading_end': AmbulanceTrip.km_reading_end + distance_delta,
+        'route_polyline': geometry_codec.encode_polyline(combined_geometry),
+        'route_geometry': None,
+        'route_status': COMPLETE
+    }, synchronize_session=False)
+    if not updated:
+        db.session.rollback()
+        return
+
+    # Later trips of the same vehicle started from this trip's provisional end reading.
+    # The odometer is advanced before they are shifted: while its row is locked
+    # no trip can join the chain, so none is missed.
+    if distance_delta:
+        fleet.advance_odometer(trip.vehicle_id, distance_delta)
+        same_vehicle = (AmbulanceTrip.vehicle_id == trip.vehicle_id if trip.vehicle_id is not None
+                        else AmbulanceTrip.vehicle_id.is_(None))
+        AmbulanceTrip.query.filter(AmbulanceTrip.id > trip_id, same_vehicle).update({
+            'km_reading_start': AmbulanceTrip.km_reading_start + distance_delta,
+            'km_reading_end': AmbulanceTrip.km_reading_end + distance_delta
+        }, synchronize_session=False)
+
+    # The vehicle is free when this trip ends, unless it has been given later work since
+    if trip.vehicle_id is not None:
+        Vehicle.query.filter_by(id=trip.vehicle_id, available_at=trip.arrival_time).update(
+            {'available_at': arrival_time}, synchronize_session=False
+        )
+
+    # Legs only the offline fallbacks could route are kept out of the frequency
+    # map, like provisional estimates
+    routed_geometry = [point for route, is_offline in zip((route1, route2), offline) if not is_offline
+                       for point in route['geometry']]
+    if routed_geometry:
+        route_frequency.record_trip(trip.date.isoformat(), routed_geometry)
+    trip_stats.record_adjustment(trip.date, distance_delta, duration_delta)
+    response_cache.record_change()
+    db.session.commit()
+
+    logger.info(f"✓ Trip {trip_id} routed via {route1.get('source')}/{route2.get('source')} "
+                f"({distance_delta:+.3f} km vs estimate)")